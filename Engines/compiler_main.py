@@ -2,6 +2,7 @@
 import os
 import sys
 import logging
+import multiprocessing
 
 # Error handler for library errors
 def handle_library_error(e):
@@ -71,7 +72,7 @@ while True:
 
 def run_type_request():
     print("Usage:")
-    print("  compiler_main <run type> [--no-pause]")
+    print("  compiler_main <run type> [--no-pause] [--jobs N] [--contents-folder]")
     print("run type:")
     print("  0                         all-in-one mode, runs every step")
     print("  1                         extracted_from_exports mode, unpacks and checks exports")
@@ -79,6 +80,8 @@ def run_type_request():
     print("  3                         patches_from_contents mode, packs the patches")
     print("")
     print("  --no-pause                disable pausing regardless of settings")
+    print("  --jobs N                  process the exports with N parallel jobs (0 uses every cpu)")
+    print("  --contents-folder         always write the patches_contents folder in all-in-one mode")
     print("")
 
     # Ask the user for a run type, read a single character input
@@ -116,7 +119,7 @@ def get_main_folder():
     # Return the folder containing the Engines folder
     return os.path.dirname(current_folder_path)
 
-def main(run_type, no_pause=False):
+def main(run_type, no_pause=False, jobs=None, contents_folder=False):
 
     # Set the working folder to the main compiler folder
     os.chdir(get_main_folder())
@@ -134,6 +137,14 @@ def main(run_type, no_pause=False):
     if no_pause:
         os.environ['PAUSE_ALLOW'] = '0'
 
+    # Save the number of parallel jobs if requested
+    if jobs is not None:
+        os.environ['JOBS'] = str(jobs)
+
+    # Force writing the patches_contents folder if requested
+    if contents_folder:
+        os.environ['CONTENTS_FOLDER_WRITE'] = '1'
+
     # Check for updates
     updates_check = int(os.environ.get('UPDATES_CHECK', '1'))
     if updates_check:
@@ -218,6 +229,9 @@ def main(run_type, no_pause=False):
 
 if __name__ == "__main__":
 
+    # Let the worker processes started by --jobs run in the compiled version
+    multiprocessing.freeze_support()
+
     if len(sys.argv) > 1 and sys.argv[1] == "-1":
         # Run the log cleaner to remove the username from the logs
         username_clean_from_logs()
@@ -250,5 +264,15 @@ if __name__ == "__main__":
     # Check for --no-pause flag
     no_pause = "--no-pause" in sys.argv
 
+    # Check for --jobs flag, followed by the number of jobs
+    jobs = None
+    if "--jobs" in sys.argv:
+        jobs_index = sys.argv.index("--jobs") + 1
+        if jobs_index < len(sys.argv) and sys.argv[jobs_index].isdigit():
+            jobs = int(sys.argv[jobs_index])
+
+    # Check for --contents-folder flag
+    contents_folder = "--contents-folder" in sys.argv
+
     # Run the main function
-    main(run_type, no_pause=no_pause)
+    main(run_type, no_pause=no_pause, jobs=jobs, contents_folder=contents_folder)
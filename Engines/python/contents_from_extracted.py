@@ -8,6 +8,7 @@ from .lib.contents_packing import contents_pack
 from .lib.utils import COLORS
 from .lib.utils.app_tools import app_title
 from .lib.utils.file_management import remove_readonly
+from .lib.utils.contents_manifest import contents_copy, contents_source_remove
 from .lib.utils.logging_tools import logger_stop
 from .lib.utils.pausing import pause
 from .lib.utils.FILE_INFO import (
@@ -85,12 +86,7 @@ def contents_from_extracted():
         if os.path.exists(refs_template_path):
             print(f"- Copying referee base files from {refs_template_name}")
             for item in os.listdir(refs_template_path):
-                src_path = os.path.join(refs_template_path, item)
-                dst_path = os.path.join(refs_folder_path, item)
-                if os.path.isdir(src_path):
-                    shutil.copytree(src_path, dst_path)
-                else:
-                    shutil.copy2(src_path, dst_path)
+                contents_copy(os.path.join(refs_template_path, item), refs_folder_name, item)
         else:
             logging.error( "- ERROR - Refs template folder not found")
             logging.error(f"- Folder path: {refs_template_path}")
@@ -119,40 +115,33 @@ def contents_from_extracted():
         contents_pack(EXTRACTED_TEAMS_PATH, faces_folder_name, uniform_folder_name)
 
         # Delete the "extracted" folder
-        if os.path.exists(EXTRACTED_TEAMS_PATH):
-            shutil.rmtree(EXTRACTED_TEAMS_PATH, onerror=remove_readonly)
+        contents_source_remove(EXTRACTED_TEAMS_PATH)
 
     if refs_present:
         # Pack the referees' contents
         contents_pack(EXTRACTED_REFEREES_PATH, refs_folder_name, refs_folder_name)
 
         # Delete the "extracted" folder
-        if os.path.exists(EXTRACTED_REFEREES_PATH):
-            shutil.rmtree(EXTRACTED_REFEREES_PATH, onerror=remove_readonly)
+        contents_source_remove(EXTRACTED_REFEREES_PATH)
 
     if sideload_present:
         # Determine the target folder for the sideload files
         refs_folder_path = os.path.join(PATCHES_CONTENTS_PATH, refs_folder_name)
         if not teams_present and os.path.exists(refs_folder_path):
             # If there's a Refscpk folder but no Singlecpk folder, copy to Refscpk
-            sideload_target_path = refs_folder_path
+            sideload_target_name = refs_folder_name
         else:
             # Otherwise, copy to the singlecpk folder
-            sideload_target_path = os.path.join(PATCHES_CONTENTS_PATH, faces_folder_name)
-            os.makedirs(sideload_target_path, exist_ok=True)
+            sideload_target_name = faces_folder_name
+            os.makedirs(os.path.join(PATCHES_CONTENTS_PATH, faces_folder_name), exist_ok=True)
 
         print( "-")
         print(
             f"- Copying the contents of the {COLORS.DARK_MAGENTA}sideload folder{COLORS.RESET} "
-            f"to the {os.path.basename(sideload_target_path)} folder"
+            f"to the {sideload_target_name} folder"
         )
         for item in os.listdir(SIDELOAD_PATH):
-            src_path = os.path.join(SIDELOAD_PATH, item)
-            dst_path = os.path.join(sideload_target_path, item)
-            if os.path.isdir(src_path):
-                shutil.copytree(src_path, dst_path, dirs_exist_ok=True)
-            else:
-                shutil.copy2(src_path, dst_path)
+            contents_copy(os.path.join(SIDELOAD_PATH, item), sideload_target_name, item)
 
 
     if 'all_in_one' in os.environ:
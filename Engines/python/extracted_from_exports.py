@@ -4,6 +4,7 @@ import sys
 import py7zr
 import shutil
 import logging
+from concurrent.futures import ProcessPoolExecutor
 
 from .lib.dummy_kit_replace import dummy_kits_replace
 from .lib.export_check import export_check
@@ -20,13 +21,31 @@ from .lib.utils.file_management import remove_readonly, readonlybit_remove_tree
 from .lib.utils.logging_tools import log_presence_warn
 from .lib.utils.pausing import pause
 from .lib.utils.zlib_plus import zlib_files_in_folder
+from .lib.utils.ftex_cache import (
+    ftex_cache_stats_reset,
+    ftex_cache_stats_take,
+    ftex_cache_stats_add,
+    ftex_cache_summary,
+)
+from .lib.utils.texture_conversion import texture_executor_shutdown
+from .lib.utils.worker_pool import (
+    jobs_count,
+    worker_init,
+    output_capture,
+    output_replay,
+)
 from .lib.utils.FILE_INFO import (
     EXPORTS_TO_ADD_PATH,
     EXTRACTED_TEAMS_PATH,
     EXTRACTED_REFEREES_PATH,
+    EXTRACTED_STAGING_PATH,
     TEAMNOTES_PATH,
 )
 
+# Range of team IDs usable by non-referee exports
+TEAM_ID_MIN = 701
+TEAM_ID_MAX = 920
+
 
 # Append the contents of a txt file to teamnotes.txt for quick reading
 def note_txt_append(team_name, export_destination_path):
@@ -68,12 +87,337 @@ def note_txt_append(team_name, export_destination_path):
     return True
 
 
+def export_info_get(export_name):
+    '''Prepare the names and paths of an export, returns None if the export must be skipped'''
+
+    export_source_path = os.path.join(EXPORTS_TO_ADD_PATH, export_name)
+
+    # Check the export type
+    if os.path.isdir(export_source_path):
+        export_type = "folder"
+        export_name_clean = export_name
+
+        # Skip the export if it has a NO_USE file
+        nouse_file_path = os.path.join(export_source_path, "NO_USE")
+        nouse_file_txt_path = os.path.join(export_source_path, "NO_USE.txt")
+        if os.path.exists(nouse_file_path) or os.path.exists(nouse_file_txt_path):
+            print(f"- \"{export_name}\" has a {COLORS.DARK_MAGENTA}NO_USE{COLORS.RESET} file - Skipped")
+            print( "-")
+            return None
+    else:
+        export_name_clean, export_type = os.path.splitext(export_name)
+
+    # Split the words in the export
+    export_name_words = re.findall(r"[^.\s\-\+\_]+", export_name)
+
+    if not export_name_words:
+        raise ValueError
+
+    # Get the team name from the first word of the export name
+    team_name_folder_raw = export_name_words[0]
+    team_name_folder = f"/{team_name_folder_raw.lower()}/"
+
+    if team_name_folder == "/refs/":
+        main_destination_path = EXTRACTED_REFEREES_PATH
+    else:
+        main_destination_path = EXTRACTED_TEAMS_PATH
+
+    export_info = {
+        'name': export_name,
+        'name_clean': export_name_clean,
+        'type': export_type,
+        'source_path': export_source_path,
+        'team_name_folder': team_name_folder,
+        'main_destination_path': main_destination_path,
+        'destination_path': os.path.join(main_destination_path, export_name_clean),
+    }
+
+    return export_info
+
+
+def export_unpack(export_name, export_type, export_source_path, export_destination_path):
+    '''Extract or copy the export into a new export folder, returns False if the export could not be extracted'''
+
+    # Delete the export destination folder if present
+    if os.path.exists(export_destination_path):
+        shutil.rmtree(export_destination_path, onerror=remove_readonly)
+
+    # Extract or copy the export into a new export folder, removing the .db and .ini files
+    if not export_type == "folder":
+        export_destination_path_temp = export_destination_path + "_temp"
+        os.makedirs(export_destination_path_temp, exist_ok=True)
+
+        try:
+            if export_type == ".zip":
+                shutil.unpack_archive(export_source_path, export_destination_path_temp, "zip")
+            elif export_type == ".7z":
+                with py7zr.SevenZipFile(export_source_path, mode='r') as z:
+                    z.extractall(export_destination_path_temp)
+
+        except Exception as e:
+            logging.error( "-")
+            logging.error( "- ERROR - Failed to extract export")
+            logging.error(f"- Export name:    {export_name}")
+            logging.error(f"- Error type:     {e}")
+            logging.error( "- This export will be skipped")
+            logging.error( "-")
+            logging.error( "- Try re-downloading the export or asking for it to be re-uploaded")
+            pause()
+            print("-")
+            return False
+
+        shutil.copytree(export_destination_path_temp, export_destination_path, ignore=shutil.ignore_patterns("*.db", "*.ini"))
+        shutil.rmtree(export_destination_path_temp, onerror=remove_readonly)
+    else:
+        shutil.copytree(export_source_path, export_destination_path, ignore=shutil.ignore_patterns("*.db", "*.ini"))
+
+    # Remove the read-only flag from every item inside the export folder
+    readonlybit_remove_tree(export_destination_path)
+
+    return True
+
+
+def export_prepare(export_destination_path, team_id, team_name):
+    '''Move the portraits and check the export, returns False if the export was discarded'''
+
+    # If the export has a Faces folder
+    if os.path.exists(os.path.join(export_destination_path, "Faces")):
+
+        # Move the portraits out of the Faces folder
+        export_deleted = portraits_move(export_destination_path, team_id)
+
+        # If the export was deleted, there is nothing left to check
+        if export_deleted:
+            return False
+
+    # Check the export for all kinds of errors
+    export_check(export_destination_path, team_name, team_id)
+
+    return True
+
+
+def export_process(export_info, fox_mode):
+    '''Extract, check and move a single export'''
+
+    team_name_folder = export_info['team_name_folder']
+    main_destination_path = export_info['main_destination_path']
+    export_destination_path = export_info['destination_path']
+
+    # Print team without a new line
+    print(f"- {team_name_folder} ", end='', flush=True)
+
+    export_unpacked = export_unpack(
+        export_info['name'], export_info['type'], export_info['source_path'], export_destination_path
+    )
+    if not export_unpacked:
+        return
+
+    # Handle referee export
+    if team_name_folder == "/refs/":
+
+        # Force team ID to 999 for referee exports
+        team_id = "999"
+        team_name = "/refs/"
+
+        print("- " + referee_title())
+
+        # Process the referee export
+        refs_error = referee_export_process(export_destination_path, fox_mode)
+
+        if refs_error:
+            os.remove(export_destination_path)
+            return
+
+    else:
+        # Get the team ID and real name for non-referee exports
+        team_id, team_name = team_id_get(export_destination_path, team_name_folder, TEAM_ID_MIN, TEAM_ID_MAX)
+
+    # If the teamID was not found, proceed to the next export
+    if not team_id:
+        return
+
+    # Check the export, and proceed to the next export if it was discarded
+    if not export_prepare(export_destination_path, team_id, team_name):
+        return
+
+    # If the export has a Note.txt file, append its Other Notes section to the teamnotes.txt file
+    note_txt_append(team_name, export_destination_path)
+
+    # Move the contents of the export to the root of "extracted"
+    export_move(export_destination_path, team_id, team_name)
+
+    # If fox mode is enabled and the team has a common folder replace the dummy textures with the kit 1 textures
+    if fox_mode and os.path.exists(os.path.join(os.path.dirname(main_destination_path), "Common", team_id)):
+        dummy_kits_replace(team_id, team_name, main_destination_path)
+
+    # Delete the now empty export folder
+    shutil.rmtree(export_destination_path, onerror=remove_readonly)
+
+    print("-")
+
+
+def export_staged_move(export_staged_path, team_id, team_name):
+    '''Check an export inside its staging folder and move its contents to the root of that folder
+
+    Returns whether it was moved, and the texture cache stats of its textures for the main process to add up'''
+
+    ftex_cache_stats_reset()
+
+    if not export_prepare(export_staged_path, team_id, team_name):
+        return False, ftex_cache_stats_take()
+
+    export_move(export_staged_path, team_id, team_name)
+
+    # Delete the now empty export folder
+    shutil.rmtree(export_staged_path, onerror=remove_readonly)
+
+    return True, ftex_cache_stats_take()
+
+
+def staging_folder_merge(staging_path, main_destination_path):
+    '''Move the contents of a staging folder to the main folder, replacing any items already present'''
+
+    for item_name in os.listdir(staging_path):
+        item_path = os.path.join(staging_path, item_name)
+        item_destination_path = os.path.join(main_destination_path, item_name)
+
+        # Files at the root, like the Note files, replace the old ones
+        if os.path.isfile(item_path):
+            if os.path.exists(item_destination_path):
+                os.remove(item_destination_path)
+            shutil.move(item_path, main_destination_path)
+            continue
+
+        os.makedirs(item_destination_path, exist_ok=True)
+
+        # Every item inside the item folders replaces the old one, like export_move does
+        for subitem_name in os.listdir(item_path):
+            subitem_destination_path = os.path.join(item_destination_path, subitem_name)
+            if os.path.isdir(subitem_destination_path):
+                shutil.rmtree(subitem_destination_path, onerror=remove_readonly)
+            elif os.path.exists(subitem_destination_path):
+                os.remove(subitem_destination_path)
+            shutil.move(os.path.join(item_path, subitem_name), item_destination_path)
+
+
+def exports_parallel_process(export_info_list, fox_mode, jobs):
+    '''Extract, check and move the exports on a process pool
+
+    Every export is worked on inside its own staging folder, and then merged into the main
+    folder in the original order, so that the output and the notes compilation are deterministic'''
+
+    # Referee exports may need to ask the user for confirmation, so they are processed serially,
+    # in their original place among the other exports when merging
+    export_team_info_list = [x for x in export_info_list if x['team_name_folder'] != "/refs/"]
+
+    if os.path.exists(EXTRACTED_STAGING_PATH):
+        shutil.rmtree(EXTRACTED_STAGING_PATH, onerror=remove_readonly)
+
+    # Give each export its own staging folder
+    for index, export_info in enumerate(export_team_info_list):
+        export_info['staging_path'] = os.path.join(EXTRACTED_STAGING_PATH, str(index))
+        export_info['staged_path'] = os.path.join(export_info['staging_path'], export_info['name_clean'])
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=worker_init) as executor:
+
+        # Unpack all the exports at once
+        unpack_results = executor.map(
+            output_capture,
+            [export_unpack] * len(export_team_info_list),
+            [x['name'] for x in export_team_info_list],
+            [x['type'] for x in export_team_info_list],
+            [x['source_path'] for x in export_team_info_list],
+            [x['staged_path'] for x in export_team_info_list],
+        )
+
+        # Get the team IDs one by one, since the user may be asked for one
+        export_ready_list = []
+        for export_info, (export_unpacked, events) in zip(export_team_info_list, unpack_results):
+
+            # Print team without a new line
+            print(f"- {export_info['team_name_folder']} ", end='', flush=True)
+
+            if output_replay(events):
+                pause()
+
+            if not export_unpacked:
+                continue
+
+            team_id, team_name = team_id_get(
+                export_info['staged_path'], export_info['team_name_folder'], TEAM_ID_MIN, TEAM_ID_MAX
+            )
+
+            if team_id:
+                export_info['team_id'] = team_id
+                export_info['team_name'] = team_name
+                export_ready_list.append(export_info)
+
+        print("-")
+        print(f"- Checking the exports ({jobs} jobs)")
+        print("-")
+
+        # Check and move all the exports at once
+        stage_results = executor.map(
+            output_capture,
+            [export_staged_move] * len(export_ready_list),
+            [x['staged_path'] for x in export_ready_list],
+            [x['team_id'] for x in export_ready_list],
+            [x['team_name'] for x in export_ready_list],
+        )
+        stage_result_iterator = iter(stage_results)
+
+        # Merge the staging folders into the main folder in the original order
+        for export_info in export_info_list:
+
+            # Process the referee exports in their place
+            if export_info['team_name_folder'] == "/refs/":
+                export_process(export_info, fox_mode)
+                continue
+
+            # Skip the exports which couldn't be unpacked or got no team ID
+            if 'team_id' not in export_info:
+                continue
+
+            (export_staged, cache_stats), events = next(stage_result_iterator)
+            ftex_cache_stats_add(cache_stats)
+
+            team_id = export_info['team_id']
+            team_name = export_info['team_name']
+            main_destination_path = export_info['main_destination_path']
+
+            if events:
+                # Print team without a new line, so that the messages about it can be told apart
+                print(f"- {export_info['team_name_folder']} ", end='', flush=True)
+
+                if output_replay(events):
+                    pause()
+                print("-")
+
+            if not export_staged:
+                continue
+
+            # If the export has a Note.txt file, append its Other Notes section to the teamnotes.txt file
+            note_txt_append(team_name, export_info['staging_path'])
+
+            # Move the contents of the staging folder to the root of "extracted"
+            staging_folder_merge(export_info['staging_path'], main_destination_path)
+
+            # If fox mode is enabled and the team has a common folder replace the dummy textures with the kit 1 textures
+            if fox_mode and os.path.exists(os.path.join(os.path.dirname(main_destination_path), "Common", team_id)):
+                dummy_kits_replace(team_id, team_name, main_destination_path)
+
+    # Delete the staging folders
+    if os.path.exists(EXTRACTED_STAGING_PATH):
+        shutil.rmtree(EXTRACTED_STAGING_PATH, onerror=remove_readonly)
+
+
 def extracted_from_exports():
 
     # Read the necessary parameters
     all_in_one = int(os.environ.get('ALL_IN_ONE', '0'))
     fox_mode = (int(os.environ.get('PES_VERSION', '19')) >= 18)
     dds_compression = int(os.environ.get('DDS_COMPRESSION', '0'))
+    jobs = jobs_count()
 
     print("-")
     print("- Extracting and checking the exports")
@@ -100,6 +444,9 @@ def extracted_from_exports():
     if os.path.exists(TEAMNOTES_PATH):
         os.remove(TEAMNOTES_PATH)
 
+    # Reset the texture cache counters
+    ftex_cache_stats_reset()
+
     EXPORT_FILE_TYPES_LIST = [".zip", ".7z"]
 
     exports_list = [
@@ -118,134 +465,18 @@ def extracted_from_exports():
         pause("Press any key to exit... ", force=True)
         sys.exit()
 
-    for export_name in exports_list:
-
-        export_source_path = os.path.join(main_source_path, export_name)
-
-        # Check the export type
-        if os.path.isdir(export_source_path):
-            export_type = "folder"
-            export_name_clean = export_name
-
-            # Skip the export if it has a NO_USE file
-            nouse_file_path = os.path.join(export_source_path, "NO_USE")
-            nouse_file_txt_path = os.path.join(export_source_path, "NO_USE.txt")
-            if os.path.exists(nouse_file_path) or os.path.exists(nouse_file_txt_path):
-                print(f"- \"{export_name}\" has a {COLORS.DARK_MAGENTA}NO_USE{COLORS.RESET} file - Skipped")
-                print( "-")
-                continue
-        else:
-            export_name_clean, export_type = os.path.splitext(export_name)
-
-        # Split the words in the export
-        export_name_words = re.findall(r"[^.\s\-\+\_]+", export_name)
-
-        if not export_name_words:
-            raise ValueError
-
-        # Get the team name from the first word of the export name
-        team_name_folder_raw = export_name_words[0]
-        team_name_folder = f"/{team_name_folder_raw.lower()}/"
-
-        # Print team without a new line
-        print(f"- {team_name_folder} ", end='', flush=True)
-
-        if team_name_folder == "/refs/":
-            main_destination_path = referees_destination_path
-        else:
-            main_destination_path = teams_destination_path
-
-        export_destination_path = os.path.join(main_destination_path, export_name_clean)
-
-        # Delete the export destination folder if present
-        if os.path.exists(export_destination_path):
-            shutil.rmtree(export_destination_path, onerror=remove_readonly)
-
-        # Extract or copy the export into a new export folder, removing the .db and .ini files
-        if not export_type == "folder":
-            export_destination_path_temp = export_destination_path + "_temp"
-            os.makedirs(export_destination_path_temp, exist_ok=True)
-
-            try:
-                if export_type == ".zip":
-                    shutil.unpack_archive(export_source_path, export_destination_path_temp, "zip")
-                elif export_type == ".7z":
-                    with py7zr.SevenZipFile(export_source_path, mode='r') as z:
-                        z.extractall(export_destination_path_temp)
-
-            except Exception as e:
-                logging.error( "-")
-                logging.error( "- ERROR - Failed to extract export")
-                logging.error(f"- Export name:    {export_name}")
-                logging.error(f"- Error type:     {e}")
-                logging.error( "- This export will be skipped")
-                logging.error( "-")
-                logging.error( "- Try re-downloading the export or asking for it to be re-uploaded")
-                pause()
-                print("-")
-                continue
-
-            shutil.copytree(export_destination_path_temp, export_destination_path, ignore=shutil.ignore_patterns("*.db", "*.ini"))
-            shutil.rmtree(export_destination_path_temp, onerror=remove_readonly)
-        else:
-            shutil.copytree(export_source_path, export_destination_path, ignore=shutil.ignore_patterns("*.db", "*.ini"))
-
-        # Remove the read-only flag from every item inside the export folder
-        readonlybit_remove_tree(export_destination_path)
-
-        # Handle referee export
-        if team_name_folder == "/refs/":
-
-            # Force team ID to 999 for referee exports
-            team_id = "999"
-            team_name = "/refs/"
-
-            print("- " + referee_title())
-
-            # Process the referee export
-            refs_error = referee_export_process(export_destination_path, fox_mode)
-
-            if refs_error:
-                os.remove(export_destination_path)
-                continue
-
+    try:
+        if jobs > 1:
+            export_info_list = [x for x in map(export_info_get, exports_list) if x is not None]
+            exports_parallel_process(export_info_list, fox_mode, jobs)
         else:
-            # Get the team ID and real name for non-referee exports
-            team_id_min = 701
-            team_id_max = 920
-            team_id, team_name = team_id_get(export_destination_path, team_name_folder, team_id_min, team_id_max)
-
-        # If the teamID was not found, proceed to the next export
-        if not team_id:
-            continue
-
-        # If the export has a Faces folder
-        if os.path.exists(os.path.join(export_destination_path, "Faces")):
-
-            # Move the portraits out of the Faces folder
-            export_deleted = portraits_move(export_destination_path, team_id)
-
-            # If the export was deleted, proceed to the next export
-            if export_deleted:
-                continue
-
-        # Check the export for all kinds of errors
-        export_check(export_destination_path, team_name, team_id)
-
-        # If the export has a Note.txt file, append its Other Notes section to the teamnotes.txt file
-        note_txt_append(team_name, export_destination_path)
-
-        # Move the contents of the export to the root of "extracted"
-        export_move(export_destination_path, team_id, team_name)
-
-        # If fox mode is enabled and the team has a common folder replace the dummy textures with the kit 1 textures
-        if fox_mode and os.path.exists(os.path.join(os.path.dirname(main_destination_path), "Common", team_id)):
-            dummy_kits_replace(team_id, team_name, main_destination_path)
-
-        # Delete the now empty export folder
-        shutil.rmtree(export_destination_path, onerror=remove_readonly)
-
-        print("-")
+            for export_name in exports_list:
+                export_info = export_info_get(export_name)
+                if export_info is not None:
+                    export_process(export_info, fox_mode)
+    finally:
+        # Stop the texture conversion processes, every export has been moved by now
+        texture_executor_shutdown()
 
     if dds_compression and not fox_mode:
         # zlib compress all the dds files
@@ -253,6 +484,10 @@ def extracted_from_exports():
         print("-")
         zlib_files_in_folder(teams_destination_path, "dds")
 
+    if fox_mode:
+        # Report how many textures were reused from the texture cache
+        ftex_cache_summary()
+
     print("- Done")
     print("-")
 
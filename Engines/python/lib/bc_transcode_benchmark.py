@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import shutil
+import struct
+import tempfile
+
+from .utils.bc_transcode import np, bc_transcode_available, dds_dxt5_transcode
+from .utils.texture_conversion import dds_dxt5_tool_available, dds_dxt5_batch_conv
+
+
+def benchmark_texture_write(tex_path, size):
+    '''Write a square BC7 texture with mipmaps, made of random mode 6 blocks, to time the conversion with'''
+
+    rng = np.random.default_rng(0)
+
+    mipmap_count = size.bit_length()
+    block_count = sum(max((size >> mipmap_index) // 4, 1) ** 2 for mipmap_index in range(mipmap_count))
+    blocks = rng.integers(0, 256, (block_count, 16), np.uint8)
+    blocks[:, 0] = (blocks[:, 0] & 0x80) | 0x40
+
+    header = struct.pack('< 4s 7I 44x 2I 4s 5I 2I 12x 4I 4x',
+        b'DDS ', 124, 0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | 0x80000, size, size, size * size, 0, mipmap_count,
+        32, 0x4, b'DX10', 0, 0, 0, 0, 0, 0x1000 | 0x8 | 0x400000, 0,
+        98, 3, 0, 1,
+    )
+
+    with open(tex_path, 'wb') as f:
+        f.write(header)
+        f.write(blocks.tobytes())
+
+
+def copies_make(tex_path_list, folder_path):
+    '''Copy some textures into a folder, since they get converted in place, and return the paths of the copies'''
+
+    os.makedirs(folder_path)
+
+    copy_path_list = [os.path.join(folder_path, os.path.basename(tex_path)) for tex_path in tex_path_list]
+    for tex_path, copy_path in zip(tex_path_list, copy_path_list):
+        shutil.copyfile(tex_path, copy_path)
+
+    return copy_path_list
+
+
+def benchmark(tex_path_list):
+    '''Time the in-process conversion of some textures, and the conversion with texconv or ImageMagick if available'''
+
+    with tempfile.TemporaryDirectory() as temp_folder_path:
+
+        copy_path_list = copies_make(tex_path_list, os.path.join(temp_folder_path, "in_process"))
+        start = time.perf_counter()
+        converted_count = sum(dds_dxt5_transcode(copy_path) for copy_path in copy_path_list)
+        seconds = time.perf_counter() - start
+        print(f"- In-process:       {seconds:.3f} s for {converted_count} of {len(copy_path_list)} textures")
+
+        if not dds_dxt5_tool_available():
+            print("- texconv or ImageMagick not found, the external conversion couldn't be timed")
+            return
+
+        copy_path_list = copies_make(tex_path_list, os.path.join(temp_folder_path, "external"))
+        start = time.perf_counter()
+        dds_dxt5_batch_conv("DXT5", copy_path_list, os.path.join(temp_folder_path, "staging"))
+        seconds = time.perf_counter() - start
+        print(f"- External tool:    {seconds:.3f} s for {len(copy_path_list)} textures")
+
+
+if __name__ == "__main__":
+
+    # Run from the compiler's folder like this:
+    # python -m Engines.python.lib.bc_transcode_benchmark [dds texture]...
+    # Without textures, a 1024x1024 BC7 texture with mipmaps gets generated
+    if not bc_transcode_available():
+        print("- NumPy is not installed")
+        sys.exit(1)
+
+    if len(sys.argv) > 1:
+        benchmark(sys.argv[1:])
+    else:
+        with tempfile.TemporaryDirectory() as temp_folder_path:
+            tex_path = os.path.join(temp_folder_path, "benchmark_bc7.dds")
+            benchmark_texture_write(tex_path, 1024)
+            benchmark([tex_path])
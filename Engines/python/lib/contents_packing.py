@@ -1,13 +1,10 @@
 import os
-import shutil
 
 from .model_packing import models_pack
-from .utils.file_management import (
-    remove_readonly,
-    move_files_to_windx11,
-)
-from .utils.FILE_INFO import (
-    PATCHES_CONTENTS_PATH,
+from .utils.contents_manifest import (
+    contents_move,
+    contents_windx11_move,
+    contents_source_remove,
 )
 
 
@@ -16,9 +13,6 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
     # Read the necessary parameters
     fox_mode = (int(os.environ.get('PES_VERSION', '19')) >= 18)
 
-    faces_folder_path = os.path.join(PATCHES_CONTENTS_PATH, faces_folder_name)
-    uniform_folder_path = os.path.join(PATCHES_CONTENTS_PATH, uniform_folder_name)
-
     refs_mode = extracted_path.endswith("referees")
     refs_string = "referee " if refs_mode else ""
 
@@ -28,7 +22,7 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
 
         print(f"- \n- Packing the {refs_string}face folders")
 
-        models_pack('face', main_dir, 'face/real', faces_folder_path)
+        models_pack('face', main_dir, 'face/real', faces_folder_name)
 
 
     # Moving the kit configs if 'Kit Configs' directory exists
@@ -36,26 +30,14 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
     if os.path.exists(main_dir):
         print(f"- \n- Moving the {refs_string}kit configs")
 
-        items_dir = f"{uniform_folder_path}/common/character0/model/character/uniform/team"
-
-        # Create a "team" folder if needed
-        os.makedirs(items_dir, exist_ok=True)
+        items_folder_path = "common/character0/model/character/uniform/team"
 
-        # Move the kit configs to the Uniform cpk folder
+        # Move the kit configs to the Uniform cpk folder, replacing any old ones
         for item in os.listdir(main_dir):
-            item_path = os.path.join(main_dir, item)
-            target_item_path = os.path.join(items_dir, item)
-
-            # If the target item path exists, remove it
-            if os.path.exists(target_item_path):
-                shutil.rmtree(target_item_path, onerror=remove_readonly)
-
-            # Move the item to the target directory
-            shutil.move(item_path, items_dir)
+            contents_move(os.path.join(main_dir, item), uniform_folder_name, f"{items_folder_path}/{item}")
 
         # Delete the main 'Kit Configs' folder
-        if os.path.exists(main_dir):
-            shutil.rmtree(main_dir, onerror=remove_readonly)
+        contents_source_remove(main_dir)
 
 
     # If there's a Kit Textures folder, move its stuff
@@ -63,29 +45,17 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
     if os.path.exists(main_dir):
         print(f"- \n- Moving the {refs_string}kit textures")
 
-        items_dir = (
-            f"{uniform_folder_path}/common/character0/model/character/uniform/texture" if not fox_mode
-            else f"{uniform_folder_path}/Asset/model/character/uniform/texture/#windx11"
+        items_folder_path = (
+            "common/character0/model/character/uniform/texture" if not fox_mode
+            else "Asset/model/character/uniform/texture/#windx11"
         )
 
-        # Create a texture folder if needed
-        os.makedirs(items_dir, exist_ok=True)
-
-        # Move the kit textures to the Uniform cpk folder
+        # Move the kit textures to the Uniform cpk folder, replacing any old ones
         for item in os.listdir(main_dir):
-            item_path = os.path.join(main_dir, item)
-            target_item_path = os.path.join(items_dir, item)
-
-            # If the target item path exists, remove it
-            if os.path.exists(target_item_path):
-                os.remove(target_item_path)
-
-            # Move the item to the target directory
-            shutil.move(item_path, items_dir)
+            contents_move(os.path.join(main_dir, item), uniform_folder_name, f"{items_folder_path}/{item}")
 
         # Delete the main 'Kit Textures' folder
-        if os.path.exists(main_dir):
-            shutil.rmtree(main_dir, onerror=remove_readonly)
+        contents_source_remove(main_dir)
 
 
     # If there's a Boots folder, move or pack its stuff
@@ -99,7 +69,7 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
             print( '-')
             print(f'- Packing the {refs_string}boots folders')
 
-        models_pack('boots', main_dir, 'boots', faces_folder_path)
+        models_pack('boots', main_dir, 'boots', faces_folder_name)
 
     # If there's a Gloves folder, move its stuff
     main_dir = os.path.join(extracted_path, "Gloves")
@@ -112,7 +82,7 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
             print( '-')
             print(f'- Packing the {refs_string}gloves folders')
 
-        models_pack('glove', main_dir, 'glove', faces_folder_path)
+        models_pack('glove', main_dir, 'glove', faces_folder_name)
 
 
     other_message = False
@@ -132,21 +102,12 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
             else 'Asset/model/character/uniform/nocloth/#Win'
         )
 
-        # Create a "collars" folder if needed
-        items_folder_path_full = os.path.join(PATCHES_CONTENTS_PATH, faces_folder_name, items_folder_path)
-        if not os.path.exists(items_folder_path_full):
-            os.makedirs(items_folder_path_full)
-
-        # Move the collars to the Faces cpk folder
+        # Move the collars to the Faces cpk folder, replacing any old ones
         for item in os.listdir(main_dir):
-            # First delete if it already exists
-            if os.path.exists(os.path.join(items_folder_path_full, item)):
-                os.remove(os.path.join(items_folder_path_full, item))
-
-            shutil.move(os.path.join(main_dir, item), items_folder_path_full)
+            contents_move(os.path.join(main_dir, item), faces_folder_name, f"{items_folder_path}/{item}")
 
         # Then delete the main folder
-        shutil.rmtree(main_dir, onerror=remove_readonly)
+        contents_source_remove(main_dir)
 
 
     # If there's a Portraits folder, move its stuff
@@ -159,21 +120,14 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
             print( '-')
             print(f'- Moving the other {refs_string}stuff')
 
-        # Create a "player" folder if needed
-        items_folder_path_full = os.path.join(PATCHES_CONTENTS_PATH, faces_folder_name, 'common/render/symbol/player')
-        if not os.path.exists(items_folder_path_full):
-            os.makedirs(items_folder_path_full)
+        items_folder_path = 'common/render/symbol/player'
 
-        # Move the portraits to the Faces cpk folder
+        # Move the portraits to the Faces cpk folder, replacing any old ones
         for item in os.listdir(main_dir):
-            # First delete if it already exists
-            if os.path.exists(os.path.join(items_folder_path_full, item)):
-                os.remove(os.path.join(items_folder_path_full, item))
-
-            shutil.move(os.path.join(main_dir, item), items_folder_path_full)
+            contents_move(os.path.join(main_dir, item), faces_folder_name, f"{items_folder_path}/{item}")
 
         # Then delete the main folder
-        shutil.rmtree(main_dir, onerror=remove_readonly)
+        contents_source_remove(main_dir)
 
 
     # If there's a Logo folder, move its stuff
@@ -186,21 +140,14 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
             print( '-')
             print(f'- Moving the other {refs_string}stuff')
 
-        # Create a "flag" folder if needed
-        items_folder_path_full = os.path.join(PATCHES_CONTENTS_PATH, uniform_folder_name, 'common/render/symbol/flag')
-        if not os.path.exists(items_folder_path_full):
-            os.makedirs(items_folder_path_full)
+        items_folder_path = 'common/render/symbol/flag'
 
-        # Move the logos to the Uniform cpk folder
+        # Move the logos to the Uniform cpk folder, replacing any old ones
         for item in os.listdir(main_dir):
-            # First delete if it already exists
-            if os.path.exists(os.path.join(items_folder_path_full, item)):
-                os.remove(os.path.join(items_folder_path_full, item))
-
-            shutil.move(os.path.join(main_dir, item), items_folder_path_full)
+            contents_move(os.path.join(main_dir, item), uniform_folder_name, f"{items_folder_path}/{item}")
 
         # Then delete the main folder
-        shutil.rmtree(main_dir, onerror=remove_readonly)
+        contents_source_remove(main_dir)
 
 
     # Set the common folder path depending on the fox mode setting
@@ -219,28 +166,18 @@ def contents_pack(extracted_path: str, faces_folder_name: str, uniform_folder_na
             print( '-')
             print(f'- Moving the other {refs_string}stuff')
 
-        # Create a "common" folder if needed
-        items_folder_path_full = os.path.join(PATCHES_CONTENTS_PATH, faces_folder_name, common_path)
-        if not os.path.exists(items_folder_path_full):
-            os.makedirs(items_folder_path_full)
-
-        # Move the team folders to the Faces cpk folder
+        # Move the team folders to the Faces cpk folder, replacing any old ones
         for item in os.listdir(main_dir):
 
             item_path = os.path.join(main_dir, item)
-            item_destination_path = os.path.join(items_folder_path_full, item)
-
-            # If the folder already exists, delete it
-            if os.path.exists(item_destination_path):
-                shutil.rmtree(item_destination_path, onerror=remove_readonly)
 
             if not fox_mode:
                 # Move the folder
-                shutil.move(item_path, item_destination_path)
+                contents_move(item_path, faces_folder_name, f"{common_path}/{item}")
 
             else:
                 # Move textures to windx11 subfolder structure
-                move_files_to_windx11(item_path, item_destination_path)
+                contents_windx11_move(item_path, faces_folder_name, f"{common_path}/{item}")
 
         # Then delete the main folder
-        shutil.rmtree(main_dir, onerror=remove_readonly)
+        contents_source_remove(main_dir)
@@ -1,8 +1,9 @@
 import os
 import sys
+import json
 import shutil
 import logging
-import tempfile
+import datetime
 
 from .utils import (
     cpk,
@@ -14,52 +15,76 @@ from .utils.zlib_plus import tryDecompress
 from .utils.logging_tools import logger_stop
 from .utils.file_management import file_critical_check
 from .utils.FILE_INFO import (
+    STATE_FOLDER_PATH,
+    CPK_TOC_CACHE_PATH,
     SIDELOAD_PATH,
     SIDELOAD_WARNED_PATH,
 )
 
 
+# Write a cpk again with a file replaced, leaving out the dead space left behind by patching it
+def cpk_file_rewrite(cpk_path, file_destination_path, new_file_data, new_file_time):
+
+    cpk_reader = cpk.CpkReader()
+    cpk_reader.open(cpk_path)
+
+    # Write the new cpk next to the old one, so that it can replace it in one go
+    cpk_temp_path = f"{cpk_path}.tmp"
+    cpk_writer = cpk.CpkWriter()
+    cpk_writer.open(cpk_temp_path)
+    rewritten = False
+
+    try:
+        # Copy all files except the one we are overwriting, as they are stored
+        for file in cpk_reader.files:
+            if file.name != file_destination_path:
+                cpk_writer.writeFileFromCpk(file.name, cpk_reader, file)
+
+        cpk_writer.writeFile(file_destination_path, new_file_data, new_file_time)
+        cpk_writer.close()
+        rewritten = True
+
+    finally:
+        cpk_reader.close()
+
+        # Don't leave a half-written cpk behind
+        if not rewritten:
+            cpk_writer.discard()
+            os.remove(cpk_temp_path)
+
+    os.replace(cpk_temp_path, cpk_path)
+
+
 # Write a file to a cpk
 def cpk_file_write(cpk_path, file_source_path, file_destination_path):
 
     # Read the new file's content
     with open(file_source_path, "rb") as f:
         new_file_data = f.read()
+    new_file_time = datetime.datetime.fromtimestamp(os.stat(file_source_path).st_mtime)
 
     # Create a cpk writer object
     cpk_writer = cpk.CpkWriter()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".cpk") as temp_file:
-        temp_cpk_path = temp_file.name
-    cpk_writer.open(temp_cpk_path)
 
     if os.path.exists(cpk_path):
-        cpk_reader = cpk.CpkReader()
-        cpk_reader.open(cpk_path)
+        # Patch the cpk, only the new file and the tables get appended to it, if the file changed
+        cpk_writer.openExisting(cpk_path)
 
-        # Copy all files except the one we are overwriting
-        for file in cpk_reader.files:
-            if file.name == file_destination_path:
-                cpk_writer.writeFile(file.name, new_file_data)
-            else:
-                file_data = cpk_reader.readFile(file)
-                cpk_writer.writeFile(file.name, file_data, file.modificationTime)
+        # Once earlier patches have left too much dead space behind, write the whole cpk again instead
+        if cpk_writer.deadSize * 4 > os.path.getsize(cpk_path):
+            cpk_writer.discard()
+            cpk_file_rewrite(cpk_path, file_destination_path, new_file_data, new_file_time)
+            return
 
-        cpk_reader.close()
+        cpk_writer.replaceFile(file_destination_path, new_file_data, new_file_time)
 
     else:
         # Write the new file only
-        cpk_writer.writeFile(file_destination_path, new_file_data)
+        cpk_writer.open(cpk_path)
+        cpk_writer.writeFile(file_destination_path, new_file_data, new_file_time)
 
     cpk_writer.close()
 
-    # Replace the old cpk with the new one
-    try:
-        os.replace(temp_cpk_path, cpk_path)
-    except OSError:
-        # Fallback if temp directory is on a different drive
-        shutil.copyfile(temp_cpk_path, cpk_path)
-        os.remove(temp_cpk_path)
-
 
 # Find the file in the cpk
 def cpk_file_search(cpk_path, file_source_path, fetch=False):
@@ -70,24 +95,99 @@ def cpk_file_search(cpk_path, file_source_path, fetch=False):
     cpk_search = cpk.CpkReader()
     cpk_search.open(cpk_path)
 
-    # Search through the files
-    for file in cpk_search.files:
+    # Look the file up in the cpk's index
+    file = cpk_search.find(file_source_path)
 
-        if file.name == file_source_path:
+    if file is not None:
 
-            if fetch:
-                # Read the file contents
-                file_contents = cpk_search.readFile(file)
-            else:
-                file_contents = file.name
-
-            break
+        if fetch:
+            # Read the file contents
+            file_contents = cpk_search.readFile(file)
+        else:
+            file_contents = file.name
 
     cpk_search.close()
 
     return file_contents
 
 
+def cpk_toc_cache_load():
+    '''Load the cached tables of contents of the cpks in the download folder'''
+
+    if not os.path.exists(CPK_TOC_CACHE_PATH):
+        return {}
+
+    try:
+        with open(CPK_TOC_CACHE_PATH, "r", encoding='utf-8') as f:
+            toc_cache = json.load(f)
+    except (OSError, ValueError):
+        # A broken cache is just rebuilt
+        return {}
+
+    if not isinstance(toc_cache, dict):
+        return {}
+
+    return toc_cache
+
+
+def cpk_toc_cache_save(toc_cache):
+    '''Save the cached tables of contents, dropping the cpks which don't exist anymore'''
+
+    toc_cache = {cpk_path: toc for cpk_path, toc in toc_cache.items() if os.path.exists(cpk_path)}
+
+    # Create a "state" folder if it doesn't exist
+    if not os.path.exists(STATE_FOLDER_PATH):
+        os.makedirs(STATE_FOLDER_PATH)
+
+    # Write to a temporary file first so that an interrupted run can't leave a half-written cache
+    cache_temp_path = CPK_TOC_CACHE_PATH + ".tmp"
+    with open(cache_temp_path, "w", encoding='utf-8') as f:
+        json.dump(toc_cache, f, separators=(',', ':'))
+    os.replace(cache_temp_path, CPK_TOC_CACHE_PATH)
+
+
+def cpk_toc_get(cpk_path, toc_cache):
+    '''
+    Get the list of file entries of a cpk, from the cache if the cpk hasn't changed since it was stored.
+
+    Args:
+        cpk_path (str): Path to the cpk
+        toc_cache (dict): Cache loaded by cpk_toc_cache_load, updated in place on a miss
+
+    Returns:
+        tuple: The list of file entries, and True if the cache was updated
+    '''
+
+    cpk_path_absolute = os.path.abspath(cpk_path)
+    cpk_stat = os.stat(cpk_path_absolute)
+
+    toc = toc_cache.get(cpk_path_absolute)
+    if (
+        isinstance(toc, dict)
+        and toc.get('size') == cpk_stat.st_size
+        and toc.get('mtime') == cpk_stat.st_mtime_ns
+    ):
+        file_list = [
+            cpk.CpkReader.FileEntry(name, size, offset, None, compressed_size)
+            for name, offset, size, compressed_size in toc['files']
+        ]
+        return file_list, False
+
+    # Parse the cpk and store its entries, without the modification times since they aren't needed for fetching
+    cpk_reader = cpk.CpkReader()
+    cpk_reader.open(cpk_path_absolute)
+    file_list = cpk_reader.files
+    cpk_reader.close()
+
+    toc_cache[cpk_path_absolute] = {
+        'size': cpk_stat.st_size,
+        'mtime': cpk_stat.st_mtime_ns,
+        'files': [[file.name, file.offset, file.size, file.compressedSize] for file in file_list],
+    }
+
+    return file_list, True
+
+
 def files_fetch_from_cpks(file_info_list, cpk_names_list, fetch=True):
 
     # Read the necessary parameters
@@ -110,43 +210,83 @@ def files_fetch_from_cpks(file_info_list, cpk_names_list, fetch=True):
         # List with every cpk file in the dpfl, in reverse alphabetical order
         cpk_file_list = sorted(dpfl_list, reverse=True)
 
-        file_found_all = True
+        # Tables of contents of the cpks, cached between runs
+        toc_cache = cpk_toc_cache_load()
+        toc_cache_updated = False
 
-        for file_info in file_info_list:
+        # Files not found yet, in their original order
+        file_info_missing_list = list(file_info_list)
+
+        cpk_name_found = False
+
+        # Walk the cpks once in priority order, resolving every missing file against each of them
+        for cpk_file in cpk_file_list:
 
-            cpk_name_found = False
+            if not file_info_missing_list:
+                break
+
+            # Skip the cpks until we have found and skipped the cpk we are about to pack
+            if not cpk_name_found:
+                if cpk_file == cpk_name + ".cpk":
+                    cpk_name_found = True
+                continue
+
+            # Only search the cpks whose name contains any of the names in the list
+            if not any(x in cpk_file for x in cpk_names_list):
+                continue
+
+            cpk_path = os.path.join(pes_download_path, cpk_file)
+
+            if not os.path.exists(cpk_path):
+                # Skip any missing cpks
+                continue
+
+            file_list, cpk_toc_updated = cpk_toc_get(cpk_path, toc_cache)
+            toc_cache_updated = toc_cache_updated or cpk_toc_updated
+
+            cpk_index = {}
+            for file in file_list:
+                cpk_index.setdefault(file.name, file)
+
+            file_info_found_list = [
+                (file_info, cpk_index[file_info['source_path']])
+                for file_info in file_info_missing_list
+                if file_info['source_path'] in cpk_index
+            ]
+
+            if not file_info_found_list:
+                continue
+
+            if fetch:
 
-            for cpk_file in cpk_file_list:
+                # The cpk itself only gets opened when something has to be read from it,
+                # mapped so that big files aren't copied around before being saved
+                cpk_reader = cpk.CpkReader()
+                cpk_reader.open(cpk_path, file_list, mapped=True)
 
-                # Skip the cpks until we have found and skipped the cpk we are about to pack
-                if not cpk_name_found:
-                    if cpk_file == cpk_name + ".cpk":
-                        cpk_name_found = True
-                    continue
+                for file_info, file in file_info_found_list:
 
-                # If the cpk name contains any of the names in the list, search for the corresponding file
-                if any(x in cpk_file for x in cpk_names_list):
+                    print(f"- {os.path.basename(file_info['source_path'])} found in {os.path.basename(cpk_path)}")
 
-                    cpk_path = os.path.join(pes_download_path, cpk_file)
+                    file_data = cpk_reader.readFile(file)
 
-                    if not os.path.exists(cpk_path):
-                        # Skip any missing cpks
-                        continue
+                    # Save the file to the corresponding destination path after unzlibbing it if needed
+                    with open(file_info['destination_path'], "wb") as file:
+                        file.write(tryDecompress(file_data))
 
-                    file_data = cpk_file_search(cpk_path, file_info['source_path'], fetch)
+                    file_data = None
 
-                    if file_data is not None:
-                        if fetch:
+                cpk_reader.close()
 
-                            print(f"- {os.path.basename(file_info['source_path'])} found in {os.path.basename(cpk_path)}")
+            file_info_missing_list = [
+                file_info for file_info in file_info_missing_list
+                if file_info['source_path'] not in cpk_index
+            ]
 
-                            # Save the file to the corresponding destination path after unzlibbing it if needed
-                            with open(file_info['destination_path'], "wb") as file:
-                                file.write(tryDecompress(file_data))
+        file_found_all = not file_info_missing_list
 
-                        break
-            else:
-                file_found_all = False
+        if toc_cache_updated:
+            cpk_toc_cache_save(toc_cache)
 
     if fetch and not file_found_all:
 
@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+
+import sys
+import time
+import random
+
+from .utils import crilayla
+
+def benchmarkContent(size):
+	# Repeated words of random bytes, compressing about as well as model files
+	generator = random.Random(0)
+	words = [generator.randbytes(generator.randint(2, 12)) for i in range(400)]
+	content = bytearray()
+	while len(content) < size:
+		content += generator.choice(words)
+	return bytes(content[0:size])
+
+def benchmark(content, repeats = 3):
+	start = time.perf_counter()
+	compressed = crilayla.compressCrilayla(content)
+	compressionSeconds = time.perf_counter() - start
+	if compressed is None:
+		print("Compression:       %.1f MB/s" % (len(content) / compressionSeconds / 1000000))
+		print("The content doesn't get any smaller when compressed")
+		return
+	
+	start = time.perf_counter()
+	for i in range(repeats):
+		decompressed = crilayla.decompressCrilayla(compressed)
+	seconds = (time.perf_counter() - start) / repeats
+	if bytes(decompressed) != content:
+		print("Decompression failed")
+		return
+	
+	print("Compressed size:   %.1f%%" % (len(compressed) * 100 / len(content)))
+	print("Compression:       %.1f MB/s" % (len(content) / compressionSeconds / 1000000))
+	print("Decompression:     %.1f MB/s" % (len(content) / seconds / 1000000))
+
+def usage():
+	print("crilayla-benchmark -- Check the crilayla decoder and measure the speed of the codec")
+	print("Usage:")
+	print("  crilayla-benchmark [filename]")
+	print("    Decompresses the fixture, then compresses and decompresses <filename>")
+	print("    or 4 MB of generated content, printing the throughput in MB/s")
+	sys.exit()
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1][0:1] == '-'):
+		usage()
+	
+	if bytes(crilayla.decompressCrilayla(crilayla.fixtureCompressed)) != crilayla.fixtureExpected:
+		print("Fixture: decompressed content doesn't match")
+		sys.exit(1)
+	print("Fixture: ok")
+	
+	if len(sys.argv) == 2:
+		with open(sys.argv[1], 'rb') as inputStream:
+			benchmark(inputStream.read())
+	else:
+		benchmark(benchmarkContent(4 << 20))
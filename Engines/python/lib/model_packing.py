@@ -1,167 +1,149 @@
 import os
-import shutil
+from concurrent.futures import ProcessPoolExecutor
 
 from . import pes_cpk_pack as cpktool
-from . import pes_fpk_pack as fpktool
+from .utils import fpk
+from .utils.contents_manifest import (
+    contents_move,
+    contents_copy,
+    contents_remove,
+    contents_source_remove,
+)
 from .utils.file_management import file_critical_check
+from .utils.worker_pool import jobs_count, worker_init
 from .utils.FILE_INFO import (
     TEMPLATE_FOLDER_PATH,
     GENERIC_FPKD_NAME,
 )
 
 
-def models_pack(models_type, models_source_path, models_destination_folder, cpk_folder_path):
+# List of files allowed in the fpk, any other files and folders go to the #windx11 folder
+FILE_TYPE_ALLOWED_LIST = [".bin", ".fmdl", ".skl", ".fclo"]
 
-    # Read the necessary parameters
-    fox_mode = (int(os.environ.get('PES_VERSION', '19')) >= 18)
 
-    temp_folder_path = os.path.join("temp")
+def model_fpk_build(model_folder_path, fpk_path):
+    '''Pack the files allowed in the fpk straight from a model folder'''
 
-    # Check if the temp folder exists and delete it
-    if os.path.exists(temp_folder_path):
-        shutil.rmtree(temp_folder_path)
+    fpk_file = fpk.FpkFile()
 
-    # Pre-Fox mode
-    if not fox_mode:
+    for item_name in os.listdir(model_folder_path):
+        item_path = os.path.join(model_folder_path, item_name)
+        if os.path.isfile(item_path) and os.path.splitext(item_name)[1] in FILE_TYPE_ALLOWED_LIST:
+            fpk_file.entries[item_name] = item_path
 
-        # Set the destination path
-        if models_type == "face":
-            models_destination_path = os.path.join(
-                cpk_folder_path,"common","character0","model","character","face","real"
-            )
-        else:
-            models_destination_path = os.path.join(
-                cpk_folder_path,"common","character0","model","character",models_destination_folder
-            )
+    fpk_file.writeFile(fpk_path)
 
-        # Create a destination folder if needed
-        if not os.path.exists(models_destination_path):
-            os.makedirs(models_destination_path)
 
-        # For every folder in the source directory
-        for model_folder_name in os.listdir(models_source_path):
+def model_cpk_build(model_folder_path, model_path_in_cpk, cpk_path):
+    '''Pack a model folder straight into its own cpk, with the folder at the given path inside it'''
 
-            if models_type == "face" and model_folder_name.startswith("referee"):
-                model_id = model_folder_name[:10]
-            else:
-                model_id = model_folder_name[:5]
-            print(f"- {model_folder_name}")
+    file_list = cpktool.fileListRecursive(model_folder_path, model_path_in_cpk, [])
+    manifest = {packed_path: real_path for real_path, packed_path in file_list}
 
-            model_folder_path = os.path.join(models_source_path, model_folder_name)
+    cpktool.main(cpk_path, [], True, manifest=manifest)
 
-            if models_type == "face":
 
-                # Move the face folder to a properly structured temp folder
-                model_temp_folder_path = os.path.join(
-                    temp_folder_path, model_id,
-                    "common", "character0", "model", "character", "face", "real", model_id
-                )
-                shutil.move(model_folder_path, model_temp_folder_path)
+def models_pack(models_type, models_source_path, models_destination_folder, cpk_folder_name):
 
-                # Make a cpk and put it in the Faces folder
-                cpk_source = os.path.join(temp_folder_path, model_id, "common")
-                cpk_destination = os.path.join(models_destination_path, f"{model_id}.cpk")
-                cpktool.main(cpk_destination, [cpk_source], allowOverwrite=True)
+    # Read the necessary parameters
+    fox_mode = (int(os.environ.get('PES_VERSION', '19')) >= 18)
 
-            else:
-                # Delete the destination folder if present
-                model_destination_path = os.path.join(models_destination_path, model_id)
-                if os.path.exists(model_destination_path):
-                    shutil.rmtree(model_destination_path)
+    # Set the path of the models inside the cpk
+    if not fox_mode:
+        models_destination_path = f"common/character0/model/character/{models_destination_folder}"
+    else:
+        models_destination_path = f"Asset/model/character/{models_destination_folder}"
 
-                # Move the model folder, renaming it to the model ID
-                shutil.move(model_folder_path, model_destination_path)
+    # Make a list of the model folders and their IDs
+    model_info_list = []
+    for model_folder_name in os.listdir(models_source_path):
 
-    # Fox mode
+        if models_type == "face" and model_folder_name.startswith("referee"):
+            model_id = model_folder_name[:10]
+        else:
+            model_id = model_folder_name[:5]
+
+        model_info_list.append((model_folder_name, model_id, os.path.join(models_source_path, model_folder_name)))
+
+    # Pre-Fox mode faces and Fox mode models get packed into archives next to their folders,
+    # which are then moved to their final place along with the rest of their files
+    archive_build = None
+    if not fox_mode and models_type == "face":
+        archive_build = model_cpk_build
+        archive_arguments_list = [
+            (model_folder_path, f"{models_destination_path}/{model_id}", f"{model_folder_path}.cpk")
+            for _, model_id, model_folder_path in model_info_list
+        ]
+    elif fox_mode:
+        archive_build = model_fpk_build
+        archive_arguments_list = [
+            (model_folder_path, f"{model_folder_path}.fpk")
+            for _, _, model_folder_path in model_info_list
+        ]
+
+    # Archives for different models don't depend on each other, so they can be packed on a process pool
+    jobs = min(jobs_count(), len(model_info_list))
+    executor = None
+    if archive_build is None:
+        archive_results = [None] * len(model_info_list)
+    elif jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=worker_init)
+        archive_results = executor.map(archive_build, *zip(*archive_arguments_list))
     else:
+        archive_results = (archive_build(*arguments) for arguments in archive_arguments_list)
 
-        # Set the destination path
-        models_destination_path = os.path.join(
-            cpk_folder_path, "Asset", "model", "character", models_destination_folder
-        )
+    try:
+        # For every folder in the source directory, in order
+        for (model_folder_name, model_id, model_folder_path), _ in zip(model_info_list, archive_results):
 
-        # Create a destination folder if needed
-        if not os.path.exists(models_destination_path):
-            os.makedirs(models_destination_path)
+            print(f"- {model_folder_name}")
 
-        # Make a list of files allowed in the fpk
-        FILE_TYPE_ALLOWED_LIST = [".bin", ".fmdl", ".skl", ".fclo"]
+            model_path = f"{models_destination_path}/{model_id}"
 
-        # For every folder in the source directory
-        for model_folder_name in os.listdir(models_source_path):
+            # Pre-Fox mode
+            if not fox_mode:
 
-            if models_type == "face" and model_folder_name.startswith("referee"):
-                model_id = model_folder_name[:10]
-            else:
-                model_id = model_folder_name[:5]
+                if models_type == "face":
+                    # Move the face cpk to the Faces folder
+                    contents_move(f"{model_folder_path}.cpk", cpk_folder_name, f"{model_path}.cpk")
 
-            print(f"- {model_folder_name}")
+                else:
+                    # Move the model folder, renaming it to the model ID
+                    contents_move(model_folder_path, cpk_folder_name, model_path)
 
-            model_folder_path = os.path.join(models_source_path, model_folder_name)
-
-            # Delete the destination folder if present
-            model_destination_path = os.path.join(models_destination_path, model_id)
-            if os.path.exists(model_destination_path):
-                shutil.rmtree(model_destination_path)
-
-            # Move the model folder to the temp folder, renaming it with the model type
-            model_temp_folder_path = os.path.join(temp_folder_path, model_id)
-            fpk_temp_folder_path = os.path.join(model_temp_folder_path, f"{models_type}_fpk")
-            shutil.move(model_folder_path, fpk_temp_folder_path)
-
-            # Make a #windx11 folder for the other files
-            windx_temp_path = os.path.join(model_temp_folder_path, "#windx11")
-            os.makedirs(windx_temp_path, exist_ok=True)
-
-            # Move any folders and any files which aren't on the allowed list
-            for item_name in os.listdir(fpk_temp_folder_path):
-                item_path = os.path.join(fpk_temp_folder_path, item_name)
-                if not (
-                    os.path.isfile(item_path) and
-                    os.path.splitext(item_name)[1] in FILE_TYPE_ALLOWED_LIST
-                ):
-                    shutil.move(item_path, windx_temp_path)
-
-            # Prepare an array with the files to pack
-            file_path_list = []
-            for file_name in os.listdir(fpk_temp_folder_path):
-                file_path = os.path.join(fpk_temp_folder_path, file_name)
-                file_path_list.append(file_path)
-
-            # Pack the fpk
-            fpk_temp_path = os.path.join(model_temp_folder_path, f"{models_type}.fpk")
-            fpktool.main(fpk_temp_path, file_path_list, True)
-
-            # Make the final folder structure
-            model_final_folder_path = os.path.join(models_destination_path, model_id)
-            fpk_final_folder_path = os.path.join(model_final_folder_path, "#Win")
-            os.makedirs(fpk_final_folder_path, exist_ok=True)
-
-            # Move the fpk to the contents folder
-            shutil.move(fpk_temp_path, fpk_final_folder_path)
-
-            # Copy the generic fpkd to the same folder and rename it
-            GENERIC_FPKD_PATH = os.path.join(TEMPLATE_FOLDER_PATH, GENERIC_FPKD_NAME)
-            file_critical_check(GENERIC_FPKD_PATH)
-            fpkd_destination_path = os.path.join(fpk_final_folder_path, f"{models_type}.fpkd")
-            shutil.copy(GENERIC_FPKD_PATH, fpkd_destination_path)
-
-            # Move the other files, using sourceimages in the path if it's a face model
-            # Keep in mind that model folders do not support loading textures from subfolders
-            if models_type == "face":
-                windx_final_path = os.path.join(model_final_folder_path, "sourceimages", "#windx11")
+            # Fox mode
             else:
-                windx_final_path = os.path.join(model_final_folder_path, "#windx11")
-
-            shutil.move(windx_temp_path, windx_final_path)
 
-            # Delete the temp folder
-            shutil.rmtree(model_temp_folder_path)
+                # Delete the destination folder if present
+                contents_remove(cpk_folder_name, model_path)
+
+                # Move the fpk to the contents folder
+                contents_move(f"{model_folder_path}.fpk", cpk_folder_name, f"{model_path}/#Win/{models_type}.fpk")
+
+                # Copy the generic fpkd to the same folder and rename it
+                GENERIC_FPKD_PATH = os.path.join(TEMPLATE_FOLDER_PATH, GENERIC_FPKD_NAME)
+                file_critical_check(GENERIC_FPKD_PATH)
+                contents_copy(GENERIC_FPKD_PATH, cpk_folder_name, f"{model_path}/#Win/{models_type}.fpkd")
+
+                # Move the other files, using sourceimages in the path if it's a face model
+                # Keep in mind that model folders do not support loading textures from subfolders
+                if models_type == "face":
+                    windx_path = f"{model_path}/sourceimages/#windx11"
+                else:
+                    windx_path = f"{model_path}/#windx11"
+
+                # Move any folders and any files which aren't on the allowed list
+                for item_name in os.listdir(model_folder_path):
+                    item_path = os.path.join(model_folder_path, item_name)
+                    if not (
+                        os.path.isfile(item_path) and
+                        os.path.splitext(item_name)[1] in FILE_TYPE_ALLOWED_LIST
+                    ):
+                        contents_move(item_path, cpk_folder_name, f"{windx_path}/{item_name}")
+
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     # Delete the source folder
-    if os.path.exists(models_source_path):
-        shutil.rmtree(models_source_path)
-
-    # Delete the main temp folder
-    if os.path.exists(temp_folder_path):
-        shutil.rmtree(temp_folder_path)
+    contents_source_remove(models_source_path)
@@ -2,48 +2,238 @@
 
 import os
 import sys
+import json
+import hashlib
 import datetime
+import concurrent.futures
 
-from .utils import cpk
+from .utils import cpk, crilayla
 
-def addFile(cpk, realFilename, packedFilename):
+def fileHash(realFilename):
+	fileContentHash = hashlib.blake2b(digest_size = 16)
+	with open(realFilename, 'rb') as inputStream:
+		for chunk in iter(lambda: inputStream.read(1 << 20), b''):
+			fileContentHash.update(chunk)
+	return fileContentHash.hexdigest()
+
+#
+# Unchanged files are recognized by the hash of their content, since the files
+# to pack usually get written again on every run even if nothing changed.
+# The size and modification time of each file are recorded along with its hash,
+# so that files which really weren't touched don't need to be hashed again.
+#
+def sourceRecord(realFilename, previousRecord):
 	stat = os.stat(realFilename)
-	mtime = datetime.datetime.fromtimestamp(stat.st_mtime)
+	if (
+		previousRecord is not None
+		and previousRecord.get('size') == stat.st_size
+		and previousRecord.get('mtime') == stat.st_mtime_ns
+	):
+		fileContentHash = previousRecord['hash']
+	else:
+		fileContentHash = fileHash(realFilename)
+
+	return { 'hash': fileContentHash, 'size': stat.st_size, 'mtime': stat.st_mtime_ns }
+
+def previousEntryFind(cpk, packedFilename, record, previousCpk, previousRecords):
+	if previousCpk is None:
+		return None
+
+	previousEntry = previousCpk.find(packedFilename)
+	previousRecord = previousRecords.get(packedFilename)
+	if previousEntry is None or previousRecord is None:
+		return None
+
+	# Entries are only reused if they were stored the way they would be now,
+	# and if the previous cpk still has them where the record says
+	if (
+		previousRecord['hash'] == record['hash']
+		and previousRecord['compression'] == cpk.compressionWanted(packedFilename)
+		and previousRecord['offset'] == previousEntry.offset
+		and previousRecord['storedSize'] == previousEntry.compressedSize
+	):
+		return previousEntry
+	return None
+
+def previousRecordsRead(hashesFile, previousCpkFile):
+	if hashesFile is None or previousCpkFile is None or not os.path.exists(previousCpkFile):
+		return {}
+
+	try:
+		with open(hashesFile, 'r') as inputStream:
+			hashes = json.load(inputStream)
+	except (OSError, ValueError):
+		return {}
+
+	# The records only describe the cpk they were written along with
+	if hashes.get('cpkSize') != os.path.getsize(previousCpkFile):
+		return {}
 
-	inputFile = open(realFilename, 'rb')
-	content = inputFile.read()
-	inputFile.close()
+	return hashes.get('files', {})
 
-	if not cpk.writeFile(packedFilename, content, mtime):
+def recordsWrite(hashesFile, cpkFile, records):
+	hashesFolder = os.path.dirname(hashesFile)
+	if hashesFolder:
+		os.makedirs(hashesFolder, exist_ok = True)
+
+	temporaryFilename = hashesFile + '.tmp'
+	with open(temporaryFilename, 'w') as outputStream:
+		json.dump({ 'cpkSize': os.path.getsize(cpkFile), 'files': records }, outputStream)
+	os.replace(temporaryFilename, hashesFile)
+
+def compressFile(realFilename):
+	with open(realFilename, 'rb') as inputStream:
+		return crilayla.compressCrilayla(inputStream.read())
+
+def addFile(cpk, realFilename, packedFilename, previousCpk = None, previousEntry = None, compression = None, contentDigest = None):
+	if previousEntry is not None:
+		# Copy the stored bytes straight from the previous cpk
+		written = cpk.writeFileFromCpk(packedFilename, previousCpk, previousEntry)
+	else:
+		stat = os.stat(realFilename)
+		mtime = datetime.datetime.fromtimestamp(stat.st_mtime)
+
+		if compression is not None:
+			# Compressed on the pool already, with None meaning that it didn't get any smaller
+			compressedContent = compression.result()
+			if compressedContent is not None:
+				written = cpk.writeStoredFile(packedFilename, compressedContent, stat.st_size, mtime)
+			else:
+				written = cpk.writeFileFromPath(packedFilename, realFilename, mtime, allowCompression = False, contentDigest = contentDigest)
+		else:
+			written = cpk.writeFileFromPath(packedFilename, realFilename, mtime, contentDigest = contentDigest)
+
+	if not written:
 		print("Cannot pack duplicate filename '%s'" % packedFilename)
 		return False
 
 	return True
 
-def addFileRecursive(cpk, filename, pathPrefix):
+def fileListRecursive(filename, pathPrefix, fileList):
 	if not os.path.isdir(filename):
-		if not addFile(cpk, filename, pathPrefix):
-			return False
+		fileList.append((filename, pathPrefix))
 	else:
 		for entry in sorted(list(os.listdir(filename))):
 			path = os.path.join(filename, entry)
-			if not addFileRecursive(cpk, path, "%s/%s" % (pathPrefix, entry)):
-				return False
-	return True
+			fileListRecursive(path, "%s/%s" % (pathPrefix, entry), fileList)
+	return fileList
 
-def main(cpkFile, packedFiles, allowOverwrite):
+def previousCpkOpen(previousCpkFile):
+	if previousCpkFile is None or not os.path.exists(previousCpkFile):
+		return None
+
+	previousCpk = cpk.CpkReader()
+	try:
+		previousCpk.open(previousCpkFile)
+	except (cpk.DecodeError, OSError):
+		print("Cannot read previous cpk '%s', packing everything again" % previousCpkFile)
+		previousCpk.close()
+		return None
+
+	return previousCpk
+
+# Returned by main when the cpk couldn't be packed, since 0 and None don't stand out from a successful run
+packFailed = -1
+
+def main(cpkFile, packedFiles, allowOverwrite, previousCpkFile = None, compressedExtensions = None, jobs = 1, manifest = None, hashesFile = None):
 	if not allowOverwrite and os.path.exists(cpkFile):
 		print("Output file '%s' already exists, not overwriting" % cpkFile)
-		return
+		return packFailed
+
+	# Unchanged files get copied from the previous version of the cpk, if it has records to recognize them by
+	previousRecords = previousRecordsRead(hashesFile, previousCpkFile)
+	previousCpk = None
+	if previousRecords:
+		previousCpk = previousCpkOpen(previousCpkFile)
+	if previousCpk is not None:
+		outputFilename = cpkFile + '.tmp'
+	else:
+		outputFilename = cpkFile
 
 	outputFile = cpk.CpkWriter()
-	outputFile.open(cpkFile)
+	outputFile.open(outputFilename, compressedExtensions = compressedExtensions)
 
+	fileList = []
 	for filename in packedFiles:
-		if not addFileRecursive(outputFile, filename, os.path.basename(filename.strip('/\\'))):
-			return
+		fileListRecursive(filename, os.path.basename(filename.strip('/\\')), fileList)
+
+	# The manifest maps packed filenames to paths, replacing the files on disk with the same name
+	if manifest:
+		fileList = [(realFilename, packedFilename) for (realFilename, packedFilename) in fileList if packedFilename not in manifest]
+		fileList += [(manifest[packedFilename], packedFilename) for packedFilename in sorted(manifest)]
+
+	# Files only get hashed if the hashes are going to be saved
+	fileRecords = {}
+	def fileRecordFind(index):
+		if hashesFile is None:
+			return (None, None)
+		if index not in fileRecords:
+			(realFilename, packedFilename) = fileList[index]
+			record = sourceRecord(realFilename, previousRecords.get(packedFilename))
+			fileRecords[index] = (record, previousEntryFind(outputFile, packedFilename, record, previousCpk, previousRecords))
+		return fileRecords[index]
+
+	# Compressing is much slower than writing, so with more than one job the files get compressed
+	# on a pool of processes, a few files ahead of the one being written
+	executor = None
+	if jobs > 1 and outputFile.compressedExtensions:
+		executor = concurrent.futures.ProcessPoolExecutor(max_workers = jobs)
+	compressions = {}
+	submitIndex = 0
+	records = {}
+	packed = False
+
+	try:
+		for (index, (realFilename, packedFilename)) in enumerate(fileList):
+			if executor is not None:
+				while submitIndex < len(fileList) and submitIndex <= index + jobs * 2:
+					(submitRealFilename, submitPackedFilename) = fileList[submitIndex]
+					if (
+						outputFile.compressionWanted(submitPackedFilename)
+						and fileRecordFind(submitIndex)[1] is None
+					):
+						compressions[submitIndex] = executor.submit(compressFile, submitRealFilename)
+					submitIndex += 1
+
+			(record, previousEntry) = fileRecordFind(index)
+			fileRecords.pop(index, None)
+
+			# The hash of the file lets duplicates be found without reading it again
+			contentDigest = None
+			if record is not None:
+				contentDigest = bytes.fromhex(record['hash'])
+
+			if not addFile(outputFile, realFilename, packedFilename, previousCpk, previousEntry, compressions.pop(index, None), contentDigest):
+				return packFailed
+
+			# Remember where and how the file was stored, to check the previous cpk against it on the next run
+			if record is not None:
+				entry = outputFile.files[packedFilename]
+				record['compression'] = outputFile.compressionWanted(packedFilename)
+				record['offset'] = entry.offset
+				record['storedSize'] = entry.size
+				records[packedFilename] = record
+
+		outputFile.close()
+		packed = True
+	finally:
+		if executor is not None:
+			executor.shutdown(cancel_futures = True)
+		if previousCpk is not None:
+			previousCpk.close()
+		# Don't leave a half-written cpk behind
+		if not packed:
+			outputFile.discard()
+			os.remove(outputFilename)
+
+	if previousCpk is not None:
+		os.replace(outputFilename, cpkFile)
+
+	if hashesFile is not None:
+		recordsWrite(hashesFile, cpkFile, records)
 
-	outputFile.close()
+	# Size of the duplicate files which were stored only once
+	return outputFile.deduplicatedSize
 
 def usage():
 	print("pes-cpk-pack -- Pack a PES cpk archive")
@@ -52,12 +242,20 @@ def usage():
 	print("    Recursively packs the contents of <filename>")
 	print("Options:")
 	print("  -r, --allow-replace        Allow overwriting existing cpk file")
+	print("  -p, --previous <cpk file>  Copy unchanged files from a previous version of the cpk")
+	print("  -H, --hashes <file>        File keeping the hashes of the packed files, needed by --previous")
+	print("  -c, --compress <extension> Compress the files with this extension, can be repeated")
+	print("  -j, --jobs <count>         Number of processes used for compressing")
 	print("  -h, --help                 Display this help")
 	sys.exit()
 
 
 if __name__ == "__main__":
 	allowOverwrite = False
+	previousCpkFile = None
+	hashesFile = None
+	compressedExtensions = []
+	jobs = 1
 	cpkFile = None
 	packedFiles = []
 
@@ -67,6 +265,18 @@ if __name__ == "__main__":
 		index += 1
 		if arg in ['-r', '--allow-replace']:
 			allowOverwrite = True
+		elif arg in ['-p', '--previous'] and index < len(sys.argv):
+			previousCpkFile = sys.argv[index]
+			index += 1
+		elif arg in ['-H', '--hashes'] and index < len(sys.argv):
+			hashesFile = sys.argv[index]
+			index += 1
+		elif arg in ['-c', '--compress'] and index < len(sys.argv):
+			compressedExtensions.append('.' + sys.argv[index].lstrip('.'))
+			index += 1
+		elif arg in ['-j', '--jobs'] and index < len(sys.argv) and sys.argv[index].isdigit():
+			jobs = int(sys.argv[index]) or os.cpu_count() or 1
+			index += 1
 		elif arg[0:1] == '-':
 			usage()
 		elif cpkFile is None:
@@ -77,4 +287,8 @@ if __name__ == "__main__":
 	if cpkFile is None:
 		usage()
 
-	main(cpkFile, packedFiles, allowOverwrite)
+	deduplicatedSize = main(cpkFile, packedFiles, allowOverwrite, previousCpkFile, compressedExtensions, jobs, hashesFile = hashesFile)
+	if deduplicatedSize == packFailed:
+		sys.exit(1)
+	if deduplicatedSize:
+		print("Stored %d bytes of duplicate files only once" % deduplicatedSize)
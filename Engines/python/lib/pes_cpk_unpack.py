@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+import os
+import re
+import sys
+import fnmatch
+import concurrent.futures
+
+from .utils import cpk
+
+def entryWanted(name, globPatterns, regexPatterns):
+	if not globPatterns and not regexPatterns:
+		return True
+	return (
+		any(fnmatch.fnmatchcase(name, pattern) for pattern in globPatterns)
+		or any(pattern.search(name) for pattern in regexPatterns)
+	)
+
+def extractFile(reader, entry, outputDirectory):
+	# Names which would end up outside of the output directory are refused
+	outputPath = os.path.normpath(os.path.join(outputDirectory, entry.name))
+	if os.path.commonpath([os.path.abspath(outputPath), os.path.abspath(outputDirectory)]) != os.path.abspath(outputDirectory):
+		print("Skipping file with an unsafe name '%s'" % entry.name)
+		return False
+
+	content = reader.readFilePositional(entry)
+
+	os.makedirs(os.path.dirname(outputPath), exist_ok = True)
+	with open(outputPath, 'wb') as outputStream:
+		outputStream.write(content)
+	return True
+
+def listFiles(entries):
+	for entry in entries:
+		modificationTime = entry.modificationTime.isoformat(' ') if entry.modificationTime is not None else '-'
+		print("%10d %10d  %s  %s" % (entry.size, entry.compressedSize, modificationTime, entry.name))
+
+def main(cpkFile, outputDirectory, globPatterns = None, regexPatterns = None, listOnly = False, jobs = None):
+	globPatterns = globPatterns or []
+	regexPatterns = [re.compile(pattern) for pattern in (regexPatterns or [])]
+
+	# Each file gets read with its own positional read, so the threads can share the archive,
+	# and only the matching entries are ever read
+	reader = cpk.CpkReader()
+	reader.open(cpkFile, mapped = not hasattr(os, 'pread'))
+
+	try:
+		entries = [entry for entry in reader.index.values() if entryWanted(entry.name, globPatterns, regexPatterns)]
+
+		if listOnly:
+			listFiles(entries)
+			return len(entries)
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as executor:
+			extracted = sum(executor.map(lambda entry: extractFile(reader, entry, outputDirectory), entries))
+	finally:
+		reader.close()
+
+	return extracted
+
+def usage():
+	print("pes-cpk-unpack -- Unpack a PES cpk archive")
+	print("Usage:")
+	print("  pes-cpk-unpack [OPTIONS] <cpk file>")
+	print("    Unpacks the contents of <cpk file>, or the files matching the filters")
+	print("Options:")
+	print("  -o, --output <directory>   Unpack into this directory instead of one named after the cpk")
+	print("  -g, --glob <pattern>       Only unpack the files matching this glob pattern, can be repeated")
+	print("  -e, --regex <pattern>      Only unpack the files matching this regular expression, can be repeated")
+	print("  -l, --list                 List the files instead of unpacking them")
+	print("  -j, --jobs <count>         Number of threads used for unpacking")
+	print("  -h, --help                 Display this help")
+	sys.exit()
+
+
+if __name__ == "__main__":
+	outputDirectory = None
+	globPatterns = []
+	regexPatterns = []
+	listOnly = False
+	jobs = None
+	cpkFile = None
+
+	index = 1
+	while index < len(sys.argv):
+		arg = sys.argv[index]
+		index += 1
+		if arg in ['-o', '--output'] and index < len(sys.argv):
+			outputDirectory = sys.argv[index]
+			index += 1
+		elif arg in ['-g', '--glob'] and index < len(sys.argv):
+			globPatterns.append(sys.argv[index])
+			index += 1
+		elif arg in ['-e', '--regex'] and index < len(sys.argv):
+			regexPatterns.append(sys.argv[index])
+			index += 1
+		elif arg in ['-l', '--list']:
+			listOnly = True
+		elif arg in ['-j', '--jobs'] and index < len(sys.argv) and sys.argv[index].isdigit():
+			jobs = int(sys.argv[index]) or None
+			index += 1
+		elif arg[0:1] == '-':
+			usage()
+		elif cpkFile is None:
+			cpkFile = arg
+		else:
+			usage()
+
+	if cpkFile is None:
+		usage()
+
+	if outputDirectory is None:
+		outputDirectory = os.path.splitext(cpkFile)[0]
+
+	count = main(cpkFile, outputDirectory, globPatterns, regexPatterns, listOnly, jobs)
+	if not listOnly:
+		print("Unpacked %d files" % count)
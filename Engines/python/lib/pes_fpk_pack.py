@@ -10,11 +10,8 @@ def addFile(fpk, realFilename, packedFilename):
 		print("Cannot pack duplicate filename '%s'" % packedFilename)
 		return False
 
-	inputFile = open(realFilename, 'rb')
-	content = inputFile.read()
-	inputFile.close()
-
-	fpk.entries[packedFilename] = content
+	# The content is only read when the fpk gets written
+	fpk.entries[packedFilename] = realFilename
 	return True
 
 def addDirectoryRecursive(fpk, directory, pathPrefix):
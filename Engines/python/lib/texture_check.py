@@ -1,8 +1,12 @@
 import os
-import struct
 import logging
 
-from .utils.ftex import ftexToDds
+from .utils.ftex import (
+    DecodeError,
+    ftexToDds,
+    readDdsHeader,
+    readFtexHeader,
+)
 from .utils.zlib_plus import (
     get_bytes_ascii,
     unzlib_file,
@@ -27,29 +31,31 @@ def get_image_type(image_path):
 
     return "Unknown"
 
-def texture_dimensions_check(dds_file_path):
+def texture_dimensions_check(tex_path, tex_header):
+    '''
+    Check if the dimensions and format of a texture are valid for its type.
 
-    fox_mode = (int(os.environ.get('PES_VERSION', '19')) >= 18)
+    Args:
+        tex_path (str): Path to the texture, used for its name and the name of its folder
+        tex_header (TextureHeader): Header of the texture, as read by readDdsHeader or readFtexHeader
 
-    dds_file_name = os.path.basename(dds_file_path)
-    dds_folder_path = os.path.dirname(dds_file_path)
-    dds_folder_name = os.path.basename(dds_folder_path)
+    Returns:
+        bool: True if the texture has any issues
+    '''
 
-    dds_file_stream = open(dds_file_path, 'rb')
+    fox_mode = (int(os.environ.get('PES_VERSION', '19')) >= 18)
 
-    dds_file_stream.seek(12)
-    height = struct.unpack("<I", dds_file_stream.read(4))[0]
-    dds_file_stream.seek(16)
-    width = struct.unpack("<I", dds_file_stream.read(4))[0]
-    dds_file_stream.seek(28)
-    mips_count = struct.unpack("<I", dds_file_stream.read(4))[0]
+    dds_file_name = os.path.basename(tex_path)
+    dds_folder_path = os.path.dirname(tex_path)
+    dds_folder_name = os.path.basename(dds_folder_path)
 
-    dds_file_stream.close()
+    height = tex_header.height
+    width = tex_header.width
+    mips_count = tex_header.mipmapCount
 
     mips_present = not (mips_count == 0 or mips_count == 1)
 
-    format = get_bytes_ascii(dds_file_path, 84, 4)
-    format_uncompressed = (format == "\0\0\0\0")
+    format_uncompressed = (tex_header.fourCC == b"\0\0\0\0")
 
     # Divisible by 4 check
     height_divisible_by_4 = (height % 4 == 0)
@@ -65,8 +71,9 @@ def texture_dimensions_check(dds_file_path):
 
     type_regular = not type_portrait
 
-    # Check if the texture is a main kit texture
-    type_kit = (dds_folder_name.lower() == "kit textures" and dds_file_name.startswith('u0') and len(dds_file_name) == 11)
+    # Check if the texture is a main kit texture, like u0XXXp1, whatever its extension
+    dds_file_stem = os.path.splitext(dds_file_name)[0]
+    type_kit = (dds_folder_name.lower() == "kit textures" and dds_file_stem.startswith('u0') and len(dds_file_stem) == 7)
 
     error = False
 
@@ -199,28 +206,39 @@ def texture_check(tex_path):
 
         return True
 
-    if tex_type == "DDS":
-        tex_check_path = tex_type_check_path
+    # Check the texture dimensions, reading only the header of the file
+    try:
+        if tex_type == "DDS":
+            tex_header = readDdsHeader(tex_type_check_path)
+        else:
+            tex_header = readFtexHeader(tex_type_check_path)
 
-    elif tex_type == "FTEX":
-        # Prepare a texture path with dds extension
-        tex_converted_path = os.path.splitext(tex_path)[0] + ".dds"
+    except DecodeError as e:
+        logging.error( "-")
+        logging.error(f"- ERROR - Unreadable {tex_type.lower()} texture")
+        logging.error(f"- Folder:         {tex_folder}")
+        logging.error(f"- Texture name:   {tex_name}")
+        logging.error(f"- Reason:         {e}")
+        logging.error( "- This texture will not work")
+        logging.error( "-")
+        logging.error( "- Resave it in the proper format with an updated plugin")
 
-        # Convert the file to dds
-        ftexToDds(tex_type_check_path, tex_converted_path)
+        if tex_zlibbed:
+            os.remove(tex_unzlibbed_path)
 
-        # Set the converted file as file to check
-        tex_check_path = tex_converted_path
+        return True
 
-    # Check the texture dimensions
-    error = texture_dimensions_check(tex_check_path)
+    error = texture_dimensions_check(tex_path, tex_header)
 
+    # Pre-Fox mode needs the ftex textures converted to dds
     if tex_type == "FTEX":
-        if fox_mode:
-            # Delete the converted file
-            os.remove(tex_converted_path)
+        if not fox_mode:
+            # Prepare a texture path with dds extension
+            tex_converted_path = os.path.splitext(tex_path)[0] + ".dds"
+
+            # Convert the file to dds
+            ftexToDds(tex_type_check_path, tex_converted_path)
 
-        else:
             # Delete the original file
             os.remove(tex_path)
 
@@ -4,6 +4,7 @@ import os
 EXPORTS_TO_ADD_PATH          = "exports_to_add"
 EXTRACTED_TEAMS_PATH         = "extracted_teams"
 EXTRACTED_REFEREES_PATH      = "extracted_referees"
+EXTRACTED_STAGING_PATH       = "extracted_staging"
 PATCHES_CONTENTS_PATH        = "patches_contents"
 PATCHES_OUTPUT_PATH          = "patches_output"
 SIDELOAD_PATH                = "sideload"
@@ -32,6 +33,9 @@ FIRST_RUN_DONE_PATH          = os.path.join(STATE_FOLDER_PATH, "first_run_done.t
 DT00_WRITE_ALLOWED_PATH      = os.path.join(STATE_FOLDER_PATH, "dt00_write_allowed.txt")
 SIDELOAD_WARNED_PATH         = os.path.join(STATE_FOLDER_PATH, "sideload_warned.txt")
 VER_MISMATCH_WARNED_PATH     = os.path.join(STATE_FOLDER_PATH, "ver_mismatch_warned.txt")
+CPK_TOC_CACHE_PATH           = os.path.join(STATE_FOLDER_PATH, "cpk_toc_cache.json")
+CPK_HASHES_FOLDER_PATH       = os.path.join(STATE_FOLDER_PATH, "cpk_hashes")
+FTEX_CACHE_FOLDER_PATH       = os.path.join(STATE_FOLDER_PATH, "ftex_cache")
 
 # Template files
 TEMPLATE_FOLDER_PATH         = os.path.join("Engines", "templates")
@@ -0,0 +1,620 @@
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Number of blocks transcoded at a time, to keep the temporary arrays small
+BLOCK_BATCH_SIZE = 16384
+
+# Block decoder and block size in bytes for every supported legacy fourCC
+FOURCC_BLOCK_FORMATS = {
+    b'DXT1': ("BC1", 8),
+    b'DXT2': ("BC2", 16),
+    b'DXT3': ("BC2", 16),
+    b'DXT4': ("BC3", 16),
+    b'DXT5': ("BC3", 16),
+    b'ATI1': ("BC4", 8),
+    b'BC4U': ("BC4", 8),
+    b'ATI2': ("BC5", 16),
+    b'BC5U': ("BC5", 16),
+}
+
+# Block decoder and block size in bytes for every supported dxgiFormat (typeless, unorm and srgb)
+DXGI_BLOCK_FORMATS = {
+    70: ("BC1", 8), 71: ("BC1", 8), 72: ("BC1", 8),
+    73: ("BC2", 16), 74: ("BC2", 16), 75: ("BC2", 16),
+    76: ("BC3", 16), 77: ("BC3", 16), 78: ("BC3", 16),
+    79: ("BC4", 8), 80: ("BC4", 8),
+    82: ("BC5", 16), 83: ("BC5", 16),
+    97: ("BC7", 16), 98: ("BC7", 16), 99: ("BC7", 16),
+}
+
+# BC7 mode parameters: subsets, partition bits, rotation bits, index selection bits, color bits,
+# alpha bits, endpoint p-bits, shared p-bits, index bits, secondary index bits
+BC7_MODES = [
+    (3, 4, 0, 0, 4, 0, 1, 0, 3, 0),
+    (2, 6, 0, 0, 6, 0, 0, 1, 3, 0),
+    (3, 6, 0, 0, 5, 0, 0, 0, 2, 0),
+    (2, 6, 0, 0, 7, 0, 1, 0, 2, 0),
+    (1, 0, 2, 1, 5, 6, 0, 0, 2, 3),
+    (1, 0, 2, 0, 7, 8, 0, 0, 2, 2),
+    (1, 0, 0, 0, 7, 7, 1, 0, 4, 0),
+    (2, 6, 0, 0, 5, 5, 1, 0, 2, 0),
+]
+
+# Subset of every pixel for the 2-subset partitions, 1 bit per pixel
+BC7_PARTITIONS_2 = [
+    0xcccc, 0x8888, 0xeeee, 0xecc8, 0xc880, 0xfeec, 0xfec8, 0xec80, 0xc800, 0xffec,
+    0xfe80, 0xe800, 0xffe8, 0xff00, 0xfff0, 0xf000, 0xf710, 0x008e, 0x7100, 0x08ce,
+    0x008c, 0x7310, 0x3100, 0x8cce, 0x088c, 0x3110, 0x6666, 0x366c, 0x17e8, 0x0ff0,
+    0x718e, 0x399c, 0xaaaa, 0xf0f0, 0x5a5a, 0x33cc, 0x3c3c, 0x55aa, 0x9696, 0xa55a,
+    0x73ce, 0x13c8, 0x324c, 0x3bdc, 0x6996, 0xc33c, 0x9966, 0x0660, 0x0272, 0x04e4,
+    0x4e40, 0x2720, 0xc936, 0x936c, 0x39c6, 0x639c, 0x9336, 0x9cc6, 0x817e, 0xe718,
+    0xccf0, 0x0fcc, 0x7744, 0xee22,
+]
+
+# Subset of every pixel for the 3-subset partitions, 2 bits per pixel
+BC7_PARTITIONS_3 = [
+    0xaa685050, 0x6a5a5040, 0x5a5a4200, 0x5450a0a8, 0xa5a50000, 0xa0a05050, 0x5555a0a0,
+    0x5a5a5050, 0xaa550000, 0xaa555500, 0xaaaa5500, 0x90909090, 0x94949494, 0xa4a4a4a4,
+    0xa9a59450, 0x2a0a4250, 0xa5945040, 0x0a425054, 0xa5a5a500, 0x55a0a0a0, 0xa8a85454,
+    0x6a6a4040, 0xa4a45000, 0x1a1a0500, 0x0050a4a4, 0xaaa59090, 0x14696914, 0x69691400,
+    0xa08585a0, 0xaa821414, 0x50a4a450, 0x6a5a0200, 0xa9a58000, 0x5090a0a8, 0xa8a09050,
+    0x24242424, 0x00aa5500, 0x24924924, 0x24499224, 0x50a50a50, 0x500aa550, 0xaaaa4444,
+    0x66660000, 0xa5a0a5a0, 0x50a050a0, 0x69286928, 0x44aaaa44, 0x66666600, 0xaa444444,
+    0x54a854a8, 0x95809580, 0x96969600, 0xa85454a8, 0x80959580, 0xaa141414, 0x96960000,
+    0xaaaa1414, 0xa05050a0, 0xa0a5a5a0, 0x96000000, 0x40804080, 0xa9a8a9a8, 0xaaaaaa44,
+    0x2a4a5254,
+]
+
+# Anchor pixel of the second subset for the 2-subset partitions
+BC7_ANCHORS_2 = [
+    15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15,
+    15, 2, 8, 2, 2, 8, 8, 15, 2, 8, 2, 2, 8, 8, 2, 2,
+    15, 15, 6, 8, 2, 8, 15, 15, 2, 8, 2, 2, 2, 15, 15, 6,
+    6, 2, 6, 8, 15, 15, 2, 2, 15, 15, 15, 15, 15, 2, 2, 15,
+]
+
+# Anchor pixels of the second and third subsets for the 3-subset partitions
+BC7_ANCHORS_3_SECOND = [
+    3, 3, 15, 15, 8, 3, 15, 15, 8, 8, 6, 6, 6, 5, 3, 3,
+    3, 3, 8, 15, 3, 3, 6, 10, 5, 8, 8, 6, 8, 5, 15, 15,
+    8, 15, 3, 5, 6, 10, 8, 15, 15, 3, 15, 5, 15, 15, 15, 15,
+    3, 15, 5, 5, 5, 8, 5, 10, 5, 10, 8, 13, 15, 12, 3, 3,
+]
+BC7_ANCHORS_3_THIRD = [
+    15, 8, 8, 3, 15, 15, 3, 8, 15, 15, 15, 15, 15, 15, 15, 8,
+    15, 8, 15, 3, 15, 8, 15, 8, 3, 15, 6, 10, 15, 15, 10, 8,
+    15, 3, 15, 10, 10, 8, 9, 10, 6, 15, 8, 15, 3, 6, 6, 8,
+    15, 3, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 3, 15, 15, 8,
+]
+
+# Interpolation weights for every number of index bits
+BC7_WEIGHTS = {
+    2: [0, 21, 43, 64],
+    3: [0, 9, 18, 27, 37, 46, 55, 64],
+    4: [0, 4, 9, 13, 17, 21, 26, 30, 34, 38, 43, 47, 51, 55, 60, 64],
+}
+
+
+def bc_transcode_available():
+    '''Check if NumPy is installed, which the in-process texture conversion needs'''
+
+    return np is not None
+
+
+def bits_read(bits, offset, count):
+    '''Read a little-endian field at the same offset from every row of an array of bits'''
+
+    weights = np.left_shift(1, np.arange(count, dtype=np.uint32), dtype=np.uint32)
+    return bits[:, offset:offset + count].astype(np.uint32) @ weights
+
+
+def bc1_colors_decode(blocks, four_colors_forced):
+    '''Decode the color part of BC1, BC2 or BC3 blocks into 16 RGBA pixels per block'''
+
+    color_0 = blocks[:, 0].astype(np.int32) | (blocks[:, 1].astype(np.int32) << 8)
+    color_1 = blocks[:, 2].astype(np.int32) | (blocks[:, 3].astype(np.int32) << 8)
+
+    palette = np.zeros((len(blocks), 4, 4), np.int32)
+    for entry, color in enumerate([color_0, color_1]):
+        red = (color & 0xf800) >> 8
+        green = (color & 0x7e0) >> 3
+        blue = (color & 0x1f) << 3
+        palette[:, entry, 0] = red | (red >> 5)
+        palette[:, entry, 1] = green | (green >> 6)
+        palette[:, entry, 2] = blue | (blue >> 5)
+    palette[:, :, 3] = 255
+
+    # BC2 and BC3 always use four colors, BC1 uses three colors and transparent black if color 0 is not bigger
+    four_colors = ((color_0 > color_1) | four_colors_forced)[:, None]
+    end_0 = palette[:, 0, :3]
+    end_1 = palette[:, 1, :3]
+    palette[:, 2, :3] = np.where(four_colors, (2 * end_0 + end_1) // 3, (end_0 + end_1) // 2)
+    palette[:, 3, :3] = np.where(four_colors, (end_0 + 2 * end_1) // 3, 0)
+    palette[:, 3, 3] = np.where(four_colors[:, 0], 255, 0)
+
+    codes = blocks[:, 4:8].copy().view('<u4')
+    indices = (codes >> (2 * np.arange(16, dtype=np.uint32))) & 3
+
+    return np.take_along_axis(palette, indices[:, :, None].astype(np.intp), axis=1).astype(np.uint8)
+
+
+def bc4_channel_decode(blocks):
+    '''Decode BC4 blocks, which BC3 uses for its alpha and BC5 for each of its channels, into 16 values per block'''
+
+    value_0 = blocks[:, 0].astype(np.int32)[:, None]
+    value_1 = blocks[:, 1].astype(np.int32)[:, None]
+
+    # Eight interpolated values if value 0 is bigger, otherwise six plus 0 and 255
+    steps_7 = np.arange(1, 7)
+    steps_5 = np.arange(1, 5)
+    palette_8 = ((7 - steps_7) * value_0 + steps_7 * value_1) // 7
+    palette_6 = np.concatenate([
+        ((5 - steps_5) * value_0 + steps_5 * value_1) // 5,
+        np.zeros_like(value_0),
+        np.full_like(value_0, 255),
+    ], axis=1)
+    palette = np.concatenate([value_0, value_1, np.where(value_0 > value_1, palette_8, palette_6)], axis=1)
+
+    codes = np.zeros(len(blocks), np.uint64)
+    for byte_index in range(6):
+        codes |= blocks[:, 2 + byte_index].astype(np.uint64) << np.uint64(8 * byte_index)
+    indices = (codes[:, None] >> (np.uint64(3) * np.arange(16, dtype=np.uint64))) & np.uint64(7)
+
+    return np.take_along_axis(palette, indices.astype(np.intp), axis=1).astype(np.uint8)
+
+
+def bc7_indices_read(bits, offset, index_bits, anchors):
+    '''Read the 16 indices of BC7 blocks, the anchor pixels having one bit less'''
+
+    widths = index_bits - anchors.astype(np.int32)
+    offsets = offset + np.cumsum(widths, axis=1) - widths
+    rows = np.arange(len(bits))[:, None]
+
+    indices = np.zeros(anchors.shape, np.intp)
+    for bit_index in range(index_bits):
+        bit = bits[rows, np.minimum(offsets + bit_index, 127)].astype(np.intp)
+        indices |= np.where(bit_index < widths, bit, 0) << bit_index
+
+    return indices
+
+
+def bc7_mode_decode(bits, mode):
+    '''Decode BC7 blocks which all use the given mode into 16 RGBA pixels per block'''
+
+    (
+        subset_count,
+        partition_bits,
+        rotation_bits,
+        selection_bits,
+        color_bits,
+        alpha_bits,
+        endpoint_pbits,
+        shared_pbits,
+        index_bits,
+        index_bits_secondary,
+    ) = BC7_MODES[mode]
+
+    block_count = len(bits)
+    offset = mode + 1
+
+    partition = bits_read(bits, offset, partition_bits)
+    offset += partition_bits
+    rotation = bits_read(bits, offset, rotation_bits)
+    offset += rotation_bits
+    selection = bits_read(bits, offset, selection_bits)
+    offset += selection_bits
+
+    # Read the endpoints, channel by channel
+    endpoint_count = subset_count * 2
+    channel_count = 4 if alpha_bits else 3
+    channel_bits_list = [color_bits, color_bits, color_bits, alpha_bits]
+    endpoints = np.full((block_count, endpoint_count, 4), 255, np.int32)
+    for channel in range(channel_count):
+        for endpoint in range(endpoint_count):
+            endpoints[:, endpoint, channel] = bits_read(bits, offset, channel_bits_list[channel])
+            offset += channel_bits_list[channel]
+
+    # Append the p-bits, one per endpoint or one per subset
+    if endpoint_pbits or shared_pbits:
+        if endpoint_pbits:
+            pbits = bits[:, offset:offset + endpoint_count].astype(np.int32)
+            offset += endpoint_count
+        else:
+            pbits = np.repeat(bits[:, offset:offset + subset_count].astype(np.int32), 2, axis=1)
+            offset += subset_count
+        endpoints[:, :, :channel_count] = (endpoints[:, :, :channel_count] << 1) | pbits[:, :, None]
+        channel_bits_list = [channel_bits + 1 for channel_bits in channel_bits_list]
+
+    # Expand the endpoints to 8 bits
+    for channel in range(channel_count):
+        channel_bits = channel_bits_list[channel]
+        values = endpoints[:, :, channel] << (8 - channel_bits)
+        endpoints[:, :, channel] = values | (values >> channel_bits)
+
+    # Find the subset of every pixel and the anchor pixels, whose indices have one bit less
+    pixel_range = np.arange(16)
+    if subset_count == 1:
+        subsets = np.zeros((block_count, 16), np.intp)
+        anchors = np.broadcast_to(pixel_range == 0, (block_count, 16))
+    elif subset_count == 2:
+        subsets = (np.array(BC7_PARTITIONS_2)[partition][:, None] >> pixel_range) & 1
+        anchors = (pixel_range == 0) | (pixel_range == np.array(BC7_ANCHORS_2)[partition][:, None])
+    else:
+        subsets = (np.array(BC7_PARTITIONS_3, np.int64)[partition][:, None] >> (2 * pixel_range)) & 3
+        anchors = (
+            (pixel_range == 0) |
+            (pixel_range == np.array(BC7_ANCHORS_3_SECOND)[partition][:, None]) |
+            (pixel_range == np.array(BC7_ANCHORS_3_THIRD)[partition][:, None])
+        )
+
+    indices = bc7_indices_read(bits, offset, index_bits, anchors)
+    color_weights = np.array(BC7_WEIGHTS[index_bits])[indices]
+    alpha_weights = color_weights
+
+    # Modes 4 and 5 have a second set of indices, used for the alpha unless the selection bit swaps them
+    if index_bits_secondary:
+        offset += 16 * index_bits - subset_count
+        indices_secondary = bc7_indices_read(
+            bits, offset, index_bits_secondary, np.broadcast_to(pixel_range == 0, (block_count, 16))
+        )
+        alpha_weights = np.array(BC7_WEIGHTS[index_bits_secondary])[indices_secondary]
+        swapped = (selection == 1)[:, None]
+        color_weights, alpha_weights = (
+            np.where(swapped, alpha_weights, color_weights),
+            np.where(swapped, color_weights, alpha_weights),
+        )
+
+    # Interpolate between the endpoints of the subset of every pixel
+    rows = np.arange(block_count)[:, None]
+    end_0 = endpoints[rows, subsets * 2]
+    end_1 = endpoints[rows, subsets * 2 + 1]
+    weights = np.concatenate([np.repeat(color_weights[:, :, None], 3, axis=2), alpha_weights[:, :, None]], axis=2)
+    pixels = ((64 - weights) * end_0 + weights * end_1 + 32) >> 6
+
+    # Swap the alpha with one of the color channels if the rotation says so
+    for channel in range(3):
+        rotated = (rotation == channel + 1)
+        pixels[rotated, :, channel], pixels[rotated, :, 3] = pixels[rotated, :, 3], pixels[rotated, :, channel]
+
+    return pixels.astype(np.uint8)
+
+
+def bc7_decode(blocks):
+    '''Decode BC7 blocks into 16 RGBA pixels per block, handling every mode separately'''
+
+    pixels = np.zeros((len(blocks), 16, 4), np.uint8)
+    bits = np.unpackbits(blocks, axis=1, bitorder='little')
+
+    # The mode is the position of the lowest set bit, blocks without any are reserved and stay black
+    modes = np.full(len(blocks), 8)
+    for mode in reversed(range(8)):
+        modes[(blocks[:, 0] & (1 << mode)) != 0] = mode
+
+    for mode in range(8):
+        selected = np.nonzero(modes == mode)[0]
+        if len(selected):
+            pixels[selected] = bc7_mode_decode(bits[selected], mode)
+
+    return pixels
+
+
+def blocks_decode(blocks, block_format):
+    '''Decode blocks of any supported format into 16 RGBA pixels per block'''
+
+    if block_format == "BC1":
+        return bc1_colors_decode(blocks, False)
+
+    if block_format == "BC2":
+        pixels = bc1_colors_decode(blocks[:, 8:], True)
+        alpha = np.stack([blocks[:, :8] & 0xf, blocks[:, :8] >> 4], axis=2).reshape(-1, 16)
+        pixels[:, :, 3] = alpha * 17
+        return pixels
+
+    if block_format == "BC3":
+        pixels = bc1_colors_decode(blocks[:, 8:], True)
+        pixels[:, :, 3] = bc4_channel_decode(blocks[:, :8])
+        return pixels
+
+    pixels = np.zeros((len(blocks), 16, 4), np.uint8)
+    pixels[:, :, 3] = 255
+
+    if block_format == "BC4":
+        pixels[:, :, 0] = bc4_channel_decode(blocks)
+        return pixels
+
+    if block_format == "BC5":
+        pixels[:, :, 0] = bc4_channel_decode(blocks[:, :8])
+        pixels[:, :, 1] = bc4_channel_decode(blocks[:, 8:])
+        return pixels
+
+    return bc7_decode(blocks)
+
+
+def bc3_alpha_encode(alpha):
+    '''Encode 16 alpha values per block as the alpha part of BC3 blocks, using the eight values mode'''
+
+    alpha = alpha.astype(np.int32)
+    value_0 = alpha.max(axis=1)[:, None]
+    value_1 = alpha.min(axis=1)[:, None]
+
+    steps = np.arange(8)
+    palette = np.concatenate([
+        value_0,
+        value_1,
+        ((7 - steps[1:7]) * value_0 + steps[1:7] * value_1) // 7,
+    ], axis=1)
+
+    indices = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=2).astype(np.uint64)
+    codes = (indices << (np.uint64(3) * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+
+    output = np.empty((len(alpha), 8), np.uint8)
+    output[:, 0] = value_0[:, 0]
+    output[:, 1] = value_1[:, 0]
+    output[:, 2:] = codes.astype('<u8')[:, None].view(np.uint8).reshape(-1, 8)[:, :6]
+
+    return output
+
+
+def rgb565_pack(colors):
+    '''Round colors to 5:6:5 bits, returning both the packed values and the colors they decode to'''
+
+    levels = np.array([31, 63, 31])
+    quantized = np.clip(np.rint(colors * levels / 255), 0, levels).astype(np.int32)
+    packed = (quantized[:, 0] << 11) | (quantized[:, 1] << 5) | quantized[:, 2]
+
+    expanded = np.empty_like(quantized)
+    expanded[:, 0] = (quantized[:, 0] << 3) | (quantized[:, 0] >> 2)
+    expanded[:, 1] = (quantized[:, 1] << 2) | (quantized[:, 1] >> 4)
+    expanded[:, 2] = (quantized[:, 2] << 3) | (quantized[:, 2] >> 2)
+
+    return packed, expanded
+
+
+def bc1_indices_fit(colors, weights, end_0, end_1):
+    '''Pick the nearest of the four palette colors for every pixel, returning the indices and the total weighted error'''
+
+    # The palette colors are on the line between the endpoints, so the nearest one is the nearest along it
+    end_1 = end_1.astype(np.float32)
+    direction = end_0.astype(np.float32) - end_1
+    length = np.maximum((direction * direction).sum(axis=1), 1e-6)[:, None]
+    position = np.matmul(colors - end_1[:, None, :], direction[:, :, None])[:, :, 0] / length
+    steps = np.clip(np.rint(position * 3), 0, 3).astype(np.intp)
+
+    reconstructed = end_1[:, None, :] + (steps / np.float32(3))[:, :, None] * direction[:, None, :]
+    error = (((colors - reconstructed) ** 2).sum(axis=2) * weights).sum(axis=1)
+
+    # Steps from color 1 to color 0 are indices 1, 3, 2 and 0
+    indices = np.array([1, 3, 2, 0])[steps]
+
+    return indices, error
+
+
+def bc1_colors_encode(colors, weights):
+    '''Encode 16 RGB colors per block as the color part of BC3 blocks
+
+    Only the pixels with a weight of 1 are fitted, every block needs at least one of them'''
+
+    colors = colors.astype(np.float32)
+    weights = weights.astype(np.float32)
+    mean = np.matmul(weights[:, None, :], colors)[:, 0, :] / weights.sum(axis=1)[:, None]
+    centered = colors - mean[:, None, :]
+
+    # Find the main axis of the colors with a few power iterations on their covariance
+    covariance = np.matmul((centered * weights[:, :, None]).transpose(0, 2, 1), centered)
+    axis = np.ones((len(colors), 3, 1), np.float32)
+    for _ in range(4):
+        axis = np.matmul(covariance, axis)
+        axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-12)
+    axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+
+    # Use the extremes along the axis as endpoints, inset slightly to reduce the error of the middle colors
+    projection = np.matmul(centered, axis)[:, :, 0]
+    axis = axis[:, :, 0]
+    fitted = weights > 0
+    end_0 = mean + axis * np.where(fitted, projection, -np.inf).max(axis=1)[:, None]
+    end_1 = mean + axis * np.where(fitted, projection, np.inf).min(axis=1)[:, None]
+    inset = (end_0 - end_1) / 16
+    packed_0, end_0 = rgb565_pack(end_0 - inset)
+    packed_1, end_1 = rgb565_pack(end_1 + inset)
+    indices, error = bc1_indices_fit(colors, weights, end_0, end_1)
+
+    # Refine the endpoints with a least squares fit to the chosen indices, keeping them where it helps
+    weights_0 = np.array([1, 0, 2 / 3, 1 / 3], np.float32)[indices]
+    weights_1 = 1 - weights_0
+    sum_00 = (weights * weights_0 * weights_0).sum(axis=1)[:, None]
+    sum_11 = (weights * weights_1 * weights_1).sum(axis=1)[:, None]
+    sum_01 = (weights * weights_0 * weights_1).sum(axis=1)[:, None]
+    target_0 = np.matmul((weights * weights_0)[:, None, :], colors)[:, 0, :]
+    target_1 = np.matmul((weights * weights_1)[:, None, :], colors)[:, 0, :]
+    determinant = sum_00 * sum_11 - sum_01 * sum_01
+    solvable = np.abs(determinant[:, 0]) > 1e-6
+    determinant[~solvable] = 1
+    refined_packed_0, refined_0 = rgb565_pack((target_0 * sum_11 - target_1 * sum_01) / determinant)
+    refined_packed_1, refined_1 = rgb565_pack((target_1 * sum_00 - target_0 * sum_01) / determinant)
+    refined_indices, refined_error = bc1_indices_fit(colors, weights, refined_0, refined_1)
+
+    better = solvable & (refined_error < error)
+    packed_0 = np.where(better, refined_packed_0, packed_0)
+    packed_1 = np.where(better, refined_packed_1, packed_1)
+    indices = np.where(better[:, None], refined_indices, indices)
+
+    # Keep color 0 bigger than color 1, like BC1 decoders expect for the four colors mode
+    swapped = packed_0 < packed_1
+    packed_0, packed_1 = np.where(swapped, packed_1, packed_0), np.where(swapped, packed_0, packed_1)
+    indices = np.where(swapped[:, None], np.array([1, 0, 3, 2])[indices], indices)
+    indices[packed_0 == packed_1] = 0
+
+    codes = (indices.astype(np.uint32) << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+
+    output = np.empty((len(colors), 8), np.uint8)
+    output[:, 0:2] = packed_0.astype('<u2')[:, None].view(np.uint8)
+    output[:, 2:4] = packed_1.astype('<u2')[:, None].view(np.uint8)
+    output[:, 4:8] = codes.astype('<u4')[:, None].view(np.uint8)
+
+    return output
+
+
+def blocks_transcode(blocks, block_format, normal_map):
+    '''Transcode blocks of any supported format to BC3 blocks'''
+
+    pixels = blocks_decode(blocks, block_format)
+
+    # Store normal maps like texconv's DXT5nm, with X in the alpha and Y in the green channel
+    if normal_map:
+        pixels = np.stack([
+            np.full(pixels.shape[:2], 255, np.uint8),
+            pixels[:, :, 1],
+            np.zeros(pixels.shape[:2], np.uint8),
+            pixels[:, :, 0],
+        ], axis=2)
+
+        # The alpha holds X here, so every pixel counts
+        weights = np.ones(pixels.shape[:2], bool)
+    else:
+        # Fully transparent pixels don't show, so their colors are left out of the fit,
+        # unless the whole block is transparent
+        weights = pixels[:, :, 3] > 0
+        weights[~weights.any(axis=1)] = True
+
+    output = np.empty((len(blocks), 16), np.uint8)
+    output[:, :8] = bc3_alpha_encode(pixels[:, :, 3])
+    output[:, 8:] = bc1_colors_encode(pixels[:, :, :3], weights)
+
+    return output
+
+
+def dds_dxt5_transcode(tex_path, normal_map=False):
+    '''
+    Convert a block compressed dds texture to DXT5 in place, without external tools.
+
+    Args:
+        tex_path (str): Path to the dds texture
+        normal_map (bool): Whether to store the texture as a DXT5nm normal map
+
+    Returns:
+        bool: True if the texture was converted, False if NumPy is missing or the texture
+        is of a kind which is not supported, like BC6H, uncompressed or texture arrays
+    '''
+
+    if np is None:
+        return False
+
+    with open(tex_path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < 128:
+        return False
+
+    (
+        magic,
+        header_size,
+        flags,
+        height,
+        width,
+        depth,
+        mipmap_count,
+        four_cc,
+        capabilities_1,
+        capabilities_2,
+    ) = struct.unpack_from('< 4s 4I 4x 2I 44x 8x 4s 20x 2I 12x', data)
+
+    if magic != b'DDS ' or header_size != 124:
+        return False
+
+    # Volume textures are not supported
+    if capabilities_2 & 0x200000:
+        return False
+
+    cube_map = bool(capabilities_2 & 0x200)
+    data_offset = 128
+
+    if four_cc == b'DX10':
+        if len(data) < 148:
+            return False
+
+        (dxgi_format, dimension, flags_misc, array_size) = struct.unpack_from('< 4I', data, 128)
+
+        # Only 2D textures and single cube maps are supported
+        if dimension != 3 or array_size != 1:
+            return False
+
+        block_format_info = DXGI_BLOCK_FORMATS.get(dxgi_format)
+        cube_map = bool(flags_misc & 0x4)
+        data_offset = 148
+
+    else:
+        block_format_info = FOURCC_BLOCK_FORMATS.get(four_cc)
+
+    if block_format_info is None:
+        return False
+
+    block_format, block_size = block_format_info
+
+    # Count the blocks of every mipmap of every face, which are stored one after the other
+    if not (flags & 0x20000) or mipmap_count == 0:
+        mipmap_count = 1
+    face_count = 6 if cube_map else 1
+
+    block_count = 0
+    for mipmap_index in range(mipmap_count):
+        mipmap_width = max(width >> mipmap_index, 1)
+        mipmap_height = max(height >> mipmap_index, 1)
+        block_count += ((mipmap_width + 3) // 4) * ((mipmap_height + 3) // 4)
+    block_count *= face_count
+
+    if len(data) < data_offset + block_count * block_size:
+        return False
+
+    blocks = np.frombuffer(data, np.uint8, block_count * block_size, data_offset).reshape(-1, block_size)
+
+    # Every block turns into one BC3 block, so the mipmaps and faces stay in the same order
+    output_blocks = np.empty((block_count, 16), np.uint8)
+    for batch_start in range(0, block_count, BLOCK_BATCH_SIZE):
+        batch_end = batch_start + BLOCK_BATCH_SIZE
+        output_blocks[batch_start:batch_end] = blocks_transcode(blocks[batch_start:batch_end], block_format, normal_map)
+
+    output_flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000
+    output_capabilities_1 = 0x1000
+    output_capabilities_2 = 0
+    if mipmap_count > 1:
+        output_flags |= 0x20000
+        output_capabilities_1 |= 0x8 | 0x400000
+    if cube_map:
+        output_capabilities_1 |= 0x8
+        output_capabilities_2 |= 0xfe00
+
+    header = struct.pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
+        b'DDS ',
+        124,
+        output_flags,
+        height,
+        width,
+        ((width + 3) // 4) * ((height + 3) // 4) * 16,
+        0,
+        mipmap_count,
+        32,
+        0x4,
+        b'DXT5',
+        0, 0, 0, 0, 0,
+        output_capabilities_1,
+        output_capabilities_2,
+    )
+
+    # Write to a temporary file first, so that the texture is never left half-written
+    tex_temp_path = f"{tex_path}.{os.getpid()}.tmp"
+    try:
+        with open(tex_temp_path, 'wb') as f:
+            f.write(header)
+            f.write(output_blocks.tobytes())
+        os.replace(tex_temp_path, tex_path)
+    finally:
+        if os.path.exists(tex_temp_path):
+            os.remove(tex_temp_path)
+
+    return True
@@ -0,0 +1,173 @@
+import os
+import shutil
+
+from .file_management import remove_readonly, move_files_to_windx11
+from .FILE_INFO import PATCHES_CONTENTS_PATH
+
+
+# Files to pack for every contents folder name, as {path inside the cpk: source file path}
+manifests = {}
+
+# Source folders which can only be deleted after the cpks have been packed
+source_path_cleanup_list = []
+
+
+def manifest_mode_enabled():
+    '''
+    Check if the contents are recorded in manifests instead of being moved into the patches_contents folder.
+
+    This is only the case for all-in-one runs which clear the cache afterwards, since otherwise the
+    patches_contents folder needs to exist on disk for the following runs, and it can still be forced
+    with the --contents-folder argument for debugging.
+    '''
+
+    all_in_one = int(os.environ.get('ALL_IN_ONE', '0'))
+    cache_clear = int(os.environ.get('CACHE_CLEAR', '0'))
+    contents_folder_write = int(os.environ.get('CONTENTS_FOLDER_WRITE', '0'))
+
+    return bool(all_in_one and cache_clear and not contents_folder_write)
+
+
+def manifest_entries_remove(folder_name, path_in_cpk):
+    '''Remove an entry from a manifest, along with every entry inside it if it's a folder'''
+
+    manifest = manifests.get(folder_name, {})
+    folder_prefix = path_in_cpk.rstrip("/") + "/"
+
+    for entry_path in [x for x in manifest if x == path_in_cpk or x.startswith(folder_prefix)]:
+        del manifest[entry_path]
+
+
+def manifest_folder_add(folder_name, path_in_cpk, source_folder_path):
+    '''Add every file inside a folder to a manifest, keeping its structure'''
+
+    manifest = manifests.setdefault(folder_name, {})
+
+    for root, dirs, files in os.walk(source_folder_path):
+        rel_path = os.path.relpath(root, source_folder_path).replace("\\", "/")
+        for file in files:
+            if rel_path == ".":
+                manifest[f"{path_in_cpk}/{file}"] = os.path.join(root, file)
+            else:
+                manifest[f"{path_in_cpk}/{rel_path}/{file}"] = os.path.join(root, file)
+
+
+def contents_remove(folder_name, path_in_cpk):
+    '''
+    Remove a file or folder from a contents folder, both from its manifest and from the disk.
+
+    Args:
+        folder_name (str): Name of the contents folder, like "Singlecpk"
+        path_in_cpk (str): Path of the file or folder inside the cpk, with forward slashes
+    '''
+
+    manifest_entries_remove(folder_name, path_in_cpk)
+
+    destination_path = os.path.join(PATCHES_CONTENTS_PATH, folder_name, path_in_cpk)
+
+    if os.path.isdir(destination_path):
+        shutil.rmtree(destination_path, onerror=remove_readonly)
+    elif os.path.exists(destination_path):
+        os.remove(destination_path)
+
+
+def contents_move(source_path, folder_name, path_in_cpk):
+    '''
+    Move a file or folder into a contents folder, replacing anything already there.
+
+    Args:
+        source_path (str): Path to the file or folder to move
+        folder_name (str): Name of the contents folder, like "Singlecpk"
+        path_in_cpk (str): Path of the file or folder inside the cpk, with forward slashes
+    '''
+
+    # Remove anything already at the destination
+    contents_remove(folder_name, path_in_cpk)
+
+    if manifest_mode_enabled():
+        if os.path.isdir(source_path):
+            manifest_folder_add(folder_name, path_in_cpk, source_path)
+        else:
+            manifests.setdefault(folder_name, {})[path_in_cpk] = source_path
+        return
+
+    destination_path = os.path.join(PATCHES_CONTENTS_PATH, folder_name, path_in_cpk)
+
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    shutil.move(source_path, destination_path)
+
+
+def contents_copy(source_path, folder_name, path_in_cpk):
+    '''
+    Copy a file or folder into a contents folder, merging it with any folder already there.
+
+    Args:
+        source_path (str): Path to the file or folder to copy
+        folder_name (str): Name of the contents folder, like "Singlecpk"
+        path_in_cpk (str): Path of the file or folder inside the cpk, with forward slashes
+    '''
+
+    if manifest_mode_enabled():
+        if os.path.isdir(source_path):
+            manifest_folder_add(folder_name, path_in_cpk, source_path)
+        else:
+            manifests.setdefault(folder_name, {})[path_in_cpk] = source_path
+        return
+
+    destination_path = os.path.join(PATCHES_CONTENTS_PATH, folder_name, path_in_cpk)
+
+    if os.path.isdir(source_path):
+        shutil.copytree(source_path, destination_path, dirs_exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        shutil.copy2(source_path, destination_path)
+
+
+def contents_windx11_move(source_folder_path, folder_name, path_in_cpk, use_sourceimages=True):
+    '''
+    Move the files in a folder into a contents folder, putting the ones in every subfolder
+    inside a #windx11 folder, like move_files_to_windx11 does, and replacing anything already there.
+    '''
+
+    # Remove anything already at the destination
+    contents_remove(folder_name, path_in_cpk)
+
+    if not manifest_mode_enabled():
+        destination_path = os.path.join(PATCHES_CONTENTS_PATH, folder_name, path_in_cpk)
+        move_files_to_windx11(source_folder_path, destination_path, use_sourceimages)
+        return
+
+    terminal_name = "sourceimages/#windx11" if use_sourceimages else "#windx11"
+    manifest = manifests.setdefault(folder_name, {})
+
+    for root, dirs, files in os.walk(source_folder_path):
+        rel_path = os.path.relpath(root, source_folder_path).replace("\\", "/")
+        if rel_path == ".":
+            target_folder = f"{path_in_cpk}/{terminal_name}"
+        else:
+            target_folder = f"{path_in_cpk}/{rel_path}/{terminal_name}"
+
+        for file in files:
+            manifest[f"{target_folder}/{file}"] = os.path.join(root, file)
+
+
+def contents_source_remove(source_path):
+    '''Delete a source folder, or keep it until the cpks have been packed if its files are in a manifest'''
+
+    if manifest_mode_enabled():
+        source_path_cleanup_list.append(source_path)
+        return
+
+    if os.path.exists(source_path):
+        shutil.rmtree(source_path, onerror=remove_readonly)
+
+
+def contents_sources_cleanup():
+    '''Delete the source folders kept for the manifests, after packing'''
+
+    for source_path in source_path_cleanup_list:
+        if os.path.exists(source_path):
+            shutil.rmtree(source_path, onerror=remove_readonly)
+
+    source_path_cleanup_list.clear()
+    manifests.clear()
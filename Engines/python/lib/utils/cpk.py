@@ -1,19 +1,24 @@
 import datetime
+import hashlib
 import io
+import mmap
+import os
 import struct
 
-from .crilayla import decompressCrilayla
+from .crilayla import compressCrilayla, decompressCrilayla
 
 class DecodeError(Exception):
 	pass
 
 def read(stream, size):
-	output = bytes()
-	while len(output) < size:
-		buffer = stream.read(size - len(output))
-		if len(buffer) == 0:
+	output = bytearray(size)
+	view = memoryview(output)
+	position = 0
+	while position < size:
+		readSize = stream.readinto(view[position:])
+		if not readSize:
 			raise DecodeError("Unexpected end of file")
-		output += buffer
+		position += readSize
 	return output
 
 def write(stream, content):
@@ -44,6 +49,16 @@ class UtfTable:
 		UtfDatumType.bytestring: 8,
 	}
 	
+	datumFormats = {
+		UtfDatumType.int8: 'B',
+		UtfDatumType.int16: 'H',
+		UtfDatumType.int32: 'I',
+		UtfDatumType.int64: 'Q',
+		UtfDatumType.float32: 'f',
+		UtfDatumType.string: 'I',
+		UtfDatumType.bytestring: 'II',
+	}
+	
 	class UtfDatumStorage:
 		null = 1
 		constant = 3
@@ -54,21 +69,39 @@ class UtfTable:
 			self.name = name
 			self.datumType = datumType
 	
+	keystream = None
+	
 	def __init__(self):
 		self.columns = []
 		self.rows = []
+		# Filled in by read, as one list of values per column name
+		self.columnValues = {}
+		self.rowCount = 0
+	
+	@staticmethod
+	def cryptKeystream():
+		# The key only depends on the position, and repeats itself every 64 bytes
+		if UtfTable.keystream is None:
+			m = 0x5f
+			t = 0x15
+			
+			keystream = bytearray(64)
+			for i in range(len(keystream)):
+				keystream[i] = m
+				m *= t
+				m &= 0xff
+			UtfTable.keystream = bytes(keystream)
+		return UtfTable.keystream
 	
 	@staticmethod
 	def crypt(block):
-		m = 0x5f
-		t = 0x15
+		keystream = UtfTable.cryptKeystream()
+		length = len(block)
+		key = keystream * (length // len(keystream) + 1)
 		
-		output = bytearray(len(block))
-		for i in range(len(output)):
-			output[i] = block[i] ^ (m & 0xff)
-			m *= t
-			m &= 0xff
-		return output
+		# Xor the whole block at once as a single big integer
+		output = int.from_bytes(block, 'little') ^ int.from_bytes(key[0:length], 'little')
+		return output.to_bytes(length, 'little')
 	
 	def read(self, stream, offset, tableName):
 		stream.seek(offset, 0)
@@ -110,64 +143,44 @@ class UtfTable:
 		strings = body[stringsOffset:]
 		data = body[dataOffset:]
 		
-		def readString(offset):
-			stringBytes = bytearray()
-			while offset < len(strings) and strings[offset] != 0:
-				stringBytes.append(strings[offset])
-				offset += 1
-			return str(stringBytes, 'UTF-8')
+		stringBytes = bytes(strings)
+		# Byte offsets match character offsets in pure ascii string tables, so they can be decoded just once
+		if stringBytes.isascii():
+			stringText = str(stringBytes, 'ascii')
+			def readString(offset):
+				stringEnd = stringText.find('\0', offset)
+				if stringEnd == -1:
+					stringEnd = len(stringText)
+				return stringText[offset:stringEnd]
+		else:
+			def readString(offset):
+				stringEnd = stringBytes.find(b'\0', offset)
+				if stringEnd == -1:
+					stringEnd = len(stringBytes)
+				return str(stringBytes[offset:stringEnd], 'UTF-8')
 		
 		def readData(offset, length):
 			return data[offset : offset + length]
 		
 		def readValue(stream, dataType):
-			if dataType == UtfTable.UtfDatumType.int8:
-				data = bytearray(1)
-				if stream.readinto(data) != len(data):
-					raise DecodeError("Unexpected end of input")
-				( value, ) = struct.unpack('> B', data)
-				return value
-			elif dataType == UtfTable.UtfDatumType.int16:
-				data = bytearray(2)
-				if stream.readinto(data) != len(data):
-					raise DecodeError("Unexpected end of input")
-				( value, ) = struct.unpack('> H', data)
-				return value
-			elif dataType == UtfTable.UtfDatumType.int32:
-				data = bytearray(4)
-				if stream.readinto(data) != len(data):
-					raise DecodeError("Unexpected end of input")
-				( value, ) = struct.unpack('> I', data)
-				return value
-			elif dataType == UtfTable.UtfDatumType.int64:
-				data = bytearray(8)
-				if stream.readinto(data) != len(data):
-					raise DecodeError("Unexpected end of input")
-				( value, ) = struct.unpack('> Q', data)
-				return value
-			elif dataType == UtfTable.UtfDatumType.float32:
-				data = bytearray(4)
-				if stream.readinto(data) != len(data):
-					raise DecodeError("Unexpected end of input")
-				( value, ) = struct.unpack('> f', data)
-				return value
-			elif dataType == UtfTable.UtfDatumType.string:
-				data = bytearray(4)
-				if stream.readinto(data) != len(data):
-					raise DecodeError("Unexpected end of input")
-				( offset, ) = struct.unpack('> I', data)
-				return readString(offset)
-			elif dataType == UtfTable.UtfDatumType.bytestring:
-				data = bytearray(8)
-				if stream.readinto(data) != len(data):
-					raise DecodeError("Unexpected end of input")
-				( offset, length, ) = struct.unpack('> II', data)
-				return readData(offset, length)
-			else:
+			if dataType not in UtfTable.datumFormats:
 				print("Unknown data type: %s" % dataType)
 				return None
+			
+			datumStruct = struct.Struct('>' + UtfTable.datumFormats[dataType])
+			data = bytearray(datumStruct.size)
+			if stream.readinto(data) != len(data):
+				raise DecodeError("Unexpected end of input")
+			value = datumStruct.unpack(data)
+			
+			if dataType == UtfTable.UtfDatumType.string:
+				return readString(value[0])
+			elif dataType == UtfTable.UtfDatumType.bytestring:
+				return readData(value[0], value[1])
+			return value[0]
 		
 		columns = []
+		rowFormat = '>'
 		for i in range(columnCount):
 			rowBuffer = bytearray(5)
 			if headerStream.readinto(rowBuffer) != len(rowBuffer):
@@ -183,27 +196,61 @@ class UtfTable:
 			else:
 				constantValue = None
 			
+			if storageType == UtfTable.UtfDatumStorage.variable:
+				if datumType not in UtfTable.datumFormats:
+					raise DecodeError("Unknown data type: %s" % datumType)
+				rowFormat += UtfTable.datumFormats[datumType]
+			
 			columns.append((name, datumType, storageType, constantValue))
 			self.columns.append(UtfTable.Column(name, datumType))
 		
-		for i in range(rowCount):
-			rowBuffer = rows[i * rowLength : (i + 1) * rowLength]
-			rowStream = io.BytesIO(rowBuffer)
-			
-			row = {}
-			for (name, datumType, storageType, constantValue) in columns:
-				if storageType == UtfTable.UtfDatumStorage.null:
-					value = None
-				elif storageType == UtfTable.UtfDatumStorage.constant:
-					value = constantValue
-				elif storageType == UtfTable.UtfDatumStorage.variable:
-					value = readValue(rowStream, datumType)
+		# Decode all the variable cells at once with a single struct compiled from the column layout,
+		# then transpose the row tuples into one tuple of values per struct field
+		rowStruct = struct.Struct(rowFormat)
+		if rowStruct.size > rowLength:
+			raise DecodeError("Unexpected utf table row length")
+		if rowStruct.size < rowLength:
+			rowStruct = struct.Struct(rowFormat + '%sx' % (rowLength - rowStruct.size))
+		
+		fieldCount = len(rowFormat) - 1
+		if rowCount > 0 and fieldCount > 0:
+			rowsBuffer = rows[0 : rowCount * rowLength]
+			if len(rowsBuffer) != rowCount * rowLength:
+				raise DecodeError("Unexpected end of input")
+			fieldValues = list(zip(*rowStruct.iter_unpack(rowsBuffer)))
+		else:
+			fieldValues = [()] * fieldCount
+		
+		fieldIndex = 0
+		for (name, datumType, storageType, constantValue) in columns:
+			if storageType == UtfTable.UtfDatumStorage.null:
+				values = [None] * rowCount
+			elif storageType == UtfTable.UtfDatumStorage.constant:
+				values = [constantValue] * rowCount
+			elif storageType == UtfTable.UtfDatumStorage.variable:
+				if datumType == UtfTable.UtfDatumType.string:
+					offsets = fieldValues[fieldIndex]
+					fieldIndex += 1
+					# Most string columns repeat the same few offsets, decode each of them only once
+					stringCache = {offset: readString(offset) for offset in set(offsets)}
+					values = list(map(stringCache.__getitem__, offsets))
+				elif datumType == UtfTable.UtfDatumType.bytestring:
+					offsets = fieldValues[fieldIndex]
+					lengths = fieldValues[fieldIndex + 1]
+					fieldIndex += 2
+					values = list(map(readData, offsets, lengths))
 				else:
-					print("Unknown encoding: %s" % storageType)
-					value = None
-				
-				row[name] = value
-			self.rows.append(row)
+					values = list(fieldValues[fieldIndex])
+					fieldIndex += 1
+			else:
+				print("Unknown encoding: %s" % storageType)
+				values = [None] * rowCount
+			
+			self.columnValues[name] = values
+		self.rowCount = rowCount
+	
+	def row(self, index):
+		return {name: values[index] for (name, values) in self.columnValues.items()}
 	
 	def write(self, stream, tableMagic, tableName):
 		columnStream = io.BytesIO()
@@ -310,16 +357,30 @@ class CpkReader:
 	
 	def __init__(self):
 		self.stream = None
+		self.mapping = None
 		self.files = []
+		self.index = {}
 	
-	def open(self, filename):
+	# With mapped = True the archive gets memory-mapped, and readFile returns
+	# memoryviews into the mapping for uncompressed entries instead of copies.
+	def open(self, filename, files = None, mapped = False):
 		self.close()
 		self.stream = open(filename, 'rb')
+		if mapped:
+			self.mapping = mmap.mmap(self.stream.fileno(), 0, access = mmap.ACCESS_READ)
 		self.files = []
+		self.index = {}
+		
+		# Entries cached from an earlier open of the same file make parsing the tables unnecessary
+		if files is not None:
+			for entry in files:
+				self.files.append(entry)
+				self.index.setdefault(entry.name, entry)
+			return
 		
 		headerTable = UtfTable()
 		headerTable.read(self.stream, 0, 'CPK ')
-		headerFields = headerTable.rows[0]
+		headerFields = headerTable.row(0)
 		
 		if 'ContentOffset' not in headerFields:
 			raise DecodeError("Missing content offset")
@@ -331,50 +392,99 @@ class CpkReader:
 		tocTable = UtfTable()
 		tocTable.read(self.stream, tocOffset, 'TOC ')
 		
-		etocTable = None
+		etocTimes = None
 		if 'EtocOffset' in headerFields:
 			etocOffset = headerFields['EtocOffset']
 			if etocOffset is not None:
 				etocTable = UtfTable()
 				etocTable.read(self.stream, etocOffset, 'ETOC')
-				if 'UpdateDateTime' not in [column.name for column in etocTable.columns]:
-					etocTable = None
+				etocTimes = etocTable.columnValues.get('UpdateDateTime')
 		
-		tocRows = [column.name for column in tocTable.columns]
-		for row in ['DirName', 'FileName', 'FileSize', 'FileOffset', 'ExtractSize']:
-			if row not in tocRows:
+		for column in ['DirName', 'FileName', 'FileSize', 'FileOffset', 'ExtractSize']:
+			if column not in tocTable.columnValues:
 				raise DecodeError("Incomplete table of contents")
 		
+		tocColumns = tocTable.columnValues
+		ids = tocColumns.get('ID', [None] * tocTable.rowCount)
+		
 		# The actual offset used by libcpk seems to be hardcoded as 0x800,
 		# and ignores ContentOffset entirely.
 		effectiveContentOffset = 0x800
-		for row in tocTable.rows:
-			name = row['DirName'].replace('\\', '/').rstrip('/') + '/' + row['FileName'].replace('\\', '/').lstrip('/')
+		# Files packed together usually share their timestamps
+		modificationTimes = {}
+		for (dirName, fileName, fileSize, fileOffset, extractSize, id) in zip(
+			tocColumns['DirName'],
+			tocColumns['FileName'],
+			tocColumns['FileSize'],
+			tocColumns['FileOffset'],
+			tocColumns['ExtractSize'],
+			ids,
+		):
+			name = dirName.replace('\\', '/').rstrip('/') + '/' + fileName.replace('\\', '/').lstrip('/')
 			
-			if 'ID' in row and row['ID'] is not None and etocTable is not None and row['ID'] < len(etocTable.rows):
-				encodedModificationTime = etocTable.rows[row['ID']]['UpdateDateTime']
-				modificationTime = datetime.datetime(
-					encodedModificationTime >> 48 & 0xffff,
-					encodedModificationTime >> 40 & 0xff,
-					encodedModificationTime >> 32 & 0xff,
-					encodedModificationTime >> 24 & 0xff,
-					encodedModificationTime >> 16 & 0xff,
-					encodedModificationTime >>  8 & 0xff,
-				)
+			if id is not None and etocTimes is not None and id < len(etocTimes):
+				encodedModificationTime = etocTimes[id]
+				if encodedModificationTime not in modificationTimes:
+					modificationTimes[encodedModificationTime] = datetime.datetime(
+						encodedModificationTime >> 48 & 0xffff,
+						encodedModificationTime >> 40 & 0xff,
+						encodedModificationTime >> 32 & 0xff,
+						encodedModificationTime >> 24 & 0xff,
+						encodedModificationTime >> 16 & 0xff,
+						encodedModificationTime >>  8 & 0xff,
+					)
+				modificationTime = modificationTimes[encodedModificationTime]
 			else:
 				modificationTime = None
 			
-			self.files.append(CpkReader.FileEntry(name, row['ExtractSize'], row['FileOffset'] + effectiveContentOffset, modificationTime, row['FileSize']))
+			entry = CpkReader.FileEntry(name, extractSize, fileOffset + effectiveContentOffset, modificationTime, fileSize)
+			self.files.append(entry)
+			# Keep the first entry if a name is repeated, like a linear search through the files would
+			self.index.setdefault(name, entry)
+	
+	def find(self, name):
+		return self.index.get(name)
+	
+	def __contains__(self, name):
+		return name in self.index
 	
 	def close(self):
+		if self.mapping is not None:
+			try:
+				self.mapping.close()
+			except BufferError:
+				# Views returned by readFile are still alive, the mapping gets released along with them
+				pass
+			self.mapping = None
 		if self.stream is not None:
 			self.stream.close()
 			self.stream = None
 	
 	def readFile(self, entry):
-		self.stream.seek(entry.offset, 0)
-		content = read(self.stream, entry.compressedSize)
+		if self.mapping is not None:
+			if entry.offset + entry.compressedSize > len(self.mapping):
+				raise DecodeError("Unexpected end of file")
+			content = memoryview(self.mapping)[entry.offset : entry.offset + entry.compressedSize]
+		else:
+			self.stream.seek(entry.offset, 0)
+			content = read(self.stream, entry.compressedSize)
+		
+		return CpkReader.decodeFile(entry, content)
+	
+	# Same as readFile, but without moving the stream position, so it can be called from several threads at
+	# once. Without os.pread (on Windows) this needs the archive to have been opened with mapped = True.
+	def readFilePositional(self, entry):
+		if self.mapping is not None:
+			return self.readFile(entry)
+		
+		content = os.pread(self.stream.fileno(), entry.compressedSize, entry.offset)
+		if len(content) < entry.compressedSize:
+			raise DecodeError("Unexpected end of file")
 		
+		return CpkReader.decodeFile(entry, content)
+	
+	@staticmethod
+	def decodeFile(entry, content):
 		if entry.size != entry.compressedSize and len(content) >= 16 and content[0:8] == b'CRILAYLA':
 			return decompressCrilayla(content)
 		
@@ -382,27 +492,123 @@ class CpkReader:
 
 class CpkWriter:
 	class FileEntry:
-		def __init__(self, size, offset, modificationTime):
+		def __init__(self, size, offset, modificationTime, extractSize = None):
 			self.size = size
 			self.offset = offset
 			self.modificationTime = modificationTime
+			self.extractSize = size if extractSize is None else extractSize
+	
+	copyChunkSize = 1 << 20
 	
 	def __init__(self):
 		self.stream = None
 		self.alignment = None
 		self.position = None
 		self.files = {}
+		self.contentOffsets = {}
+		self.deduplicatedSize = 0
+		self.patching = False
+		self.patched = False
+		self.deadSize = 0
+		self.zeroBuffer = None
+		self.copyBuffer = None
+		self.compressedExtensions = set()
 	
-	def open(self, filename, alignment = 0x800):
+	# Files whose extension is in compressedExtensions (like '.fmdl') get stored
+	# crilayla-compressed, unless compressing doesn't make them any smaller.
+	def open(self, filename, alignment = 0x800, compressedExtensions = None):
 		self.alignment = alignment
+		self.compressedExtensions = set(extension.lower() for extension in (compressedExtensions or []))
+		self.zeroBuffer = memoryview(bytes(alignment))
+		self.copyBuffer = memoryview(bytearray(CpkWriter.copyChunkSize))
 		self.stream = open(filename, 'wb')
 		self.files = {}
+		self.contentOffsets = {}
+		self.deduplicatedSize = 0
+		self.patching = False
+		self.patched = False
+		self.deadSize = 0
 		
 		self.position = 0x800
 		write(self.stream, bytes(self.position - 6))
 		write(self.stream, "(c)CRI".encode('utf-8'))
 	
+	# Opens an existing archive for patching with replaceFile. Nothing the current header points at
+	# is ever overwritten: new content and new tables are written after the end of the archive, and
+	# close() syncs them to disk before rewriting the header, so the old archive stays readable until
+	# the header is replaced, and the header write is what switches over to the new one.
+	# If nothing ends up being replaced, the archive is left untouched.
+	def openExisting(self, filename, compressedExtensions = None):
+		reader = CpkReader()
+		reader.open(filename)
+		reader.close()
+		
+		self.stream = open(filename, 'r+b')
+		headerTable = UtfTable()
+		headerTable.read(self.stream, 0, 'CPK ')
+		headerFields = headerTable.row(0)
+		
+		self.alignment = headerFields.get('Align') or 0x800
+		self.compressedExtensions = set(extension.lower() for extension in (compressedExtensions or []))
+		self.zeroBuffer = memoryview(bytes(self.alignment))
+		self.copyBuffer = memoryview(bytearray(CpkWriter.copyChunkSize))
+		
+		self.files = {}
+		for entry in reader.files:
+			if entry.name not in self.files:
+				self.files[entry.name] = CpkWriter.FileEntry(entry.compressedSize, entry.offset, entry.modificationTime, entry.size)
+		
+		self.contentOffsets = {}
+		self.deduplicatedSize = 0
+		self.patching = True
+		self.patched = False
+		
+		self.stream.seek(0, 2)
+		fileSize = self.stream.tell()
+		self.position = fileSize
+		
+		# Space used by neither the header, the contents nor the tables, which earlier patches left behind,
+		# counting the padding after every content and table as used
+		usedSizes = list({entry.offset: entry.compressedSize for entry in reader.files}.values())
+		usedSizes += [headerFields.get('TocSize') or 0, headerFields.get('EtocSize') or 0]
+		usedSize = 0x800
+		for size in usedSizes:
+			usedSize += -(-size // self.alignment) * self.alignment
+		self.deadSize = max(fileSize - usedSize, 0)
+	
+	# Replaces the content of a file in an archive opened with openExisting, or adds it if it's new.
+	# The new content is always appended, the old one is left behind as dead space, unless it's
+	# the same as the new one, in which case nothing gets written.
+	def replaceFile(self, filename, content, modificationTime = None):
+		extractSize = len(content)
+		if self.compressionWanted(filename):
+			compressedContent = compressCrilayla(content)
+			if compressedContent is not None:
+				content = compressedContent
+		
+		entry = self.files.get(filename)
+		if entry is not None and entry.size == len(content) and entry.extractSize == extractSize:
+			self.stream.seek(entry.offset, 0)
+			storedContent = read(self.stream, entry.size)
+			self.stream.seek(self.position, 0)
+			if storedContent == content:
+				return True
+		
+		# The appended content starts aligned like every other one
+		if not self.patched:
+			self.writePadding(self.position)
+			self.patched = True
+		
+		self.files.pop(filename, None)
+		return self.writeStoredFile(filename, content, extractSize, modificationTime)
+	
 	def close(self):
+		# A patched archive which didn't get anything replaced stays as it was
+		if self.patching and not self.patched:
+			self.stream.close()
+			self.stream = None
+			return
+		
 		toc = UtfTable()
 		toc.columns.append(UtfTable.Column("DirName", UtfTable.UtfDatumType.string))
 		toc.columns.append(UtfTable.Column("FileName", UtfTable.UtfDatumType.string))
@@ -416,7 +622,8 @@ class CpkWriter:
 		etoc.columns.append(UtfTable.Column("UpdateDateTime", UtfTable.UtfDatumType.int64))
 		etoc.columns.append(UtfTable.Column("LocalDir", UtfTable.UtfDatumType.string))
 		
-		totalSize = 0
+		totalPackedSize = 0
+		totalDataSize = 0
 		for filename in sorted(list(self.files.keys()), key = lambda x: x.upper()):
 			pos = filename.rfind('/')
 			if pos == -1:
@@ -431,7 +638,7 @@ class CpkWriter:
 				"DirName": entryDirName,
 				"FileName": entryFileName,
 				"FileSize": entry.size,
-				"ExtractSize": entry.size,
+				"ExtractSize": entry.extractSize,
 				"FileOffset": entry.offset - 0x800,
 				"ID": len(toc.rows),
 				"UserString": "",
@@ -451,7 +658,8 @@ class CpkWriter:
 					"LocalDir": entryDirName,
 				})
 			
-			totalSize += entry.size
+			totalPackedSize += entry.size
+			totalDataSize += entry.extractSize
 		
 		tocPosition = self.position
 		tocSize = toc.write(self.stream, 'TOC ', 'CpkTocInfo')
@@ -498,8 +706,8 @@ class CpkWriter:
 		addHeader("GtocCrc", None, UtfTable.UtfDatumType.int32)
 		addHeader("HgtocOffset", None, UtfTable.UtfDatumType.int64)
 		addHeader("HgtocSize", None, UtfTable.UtfDatumType.int64)
-		addHeader("EnabledPackedSize", totalSize, UtfTable.UtfDatumType.int64)
-		addHeader("EnabledDataSize", totalSize, UtfTable.UtfDatumType.int64)
+		addHeader("EnabledPackedSize", totalPackedSize, UtfTable.UtfDatumType.int64)
+		addHeader("EnabledDataSize", totalDataSize, UtfTable.UtfDatumType.int64)
 		addHeader("TotalDataSize", None, UtfTable.UtfDatumType.int64)
 		addHeader("Tocs", None, UtfTable.UtfDatumType.int32)
 		addHeader("Files", len(self.files), UtfTable.UtfDatumType.int32)
@@ -524,20 +732,151 @@ class CpkWriter:
 		addHeader("CrcMode", 0, UtfTable.UtfDatumType.int32)
 		addHeader("CrcTable", bytes(0), UtfTable.UtfDatumType.bytestring)
 		
+		# When patching, the content and tables have to be on disk before the header points at them
+		if self.patching:
+			self.stream.flush()
+			os.fsync(self.stream.fileno())
+		
 		self.stream.seek(0)
 		header.write(self.stream, 'CPK ', 'CpkHeader')
+		if self.patching:
+			self.stream.flush()
+			os.fsync(self.stream.fileno())
 		self.stream.close()
 	
+	# Closes the archive without writing its tables, leaving it unusable
+	def discard(self):
+		if self.stream is not None:
+			self.stream.close()
+			self.stream = None
+	
+	def writePadding(self, length):
+		if length % self.alignment > 0:
+			paddingLength = self.alignment - (length % self.alignment)
+		else:
+			paddingLength = 0
+		write(self.stream, self.zeroBuffer[0:paddingLength])
+		self.position += paddingLength
+	
+	# Identical content is only written once, the entries written after the first one point at it,
+	# and deduplicatedSize counts the bytes which didn't have to be written again
+	@staticmethod
+	def contentKey(contentDigest, size, extractSize):
+		return (contentDigest, size, size if extractSize is None else extractSize)
+	
+	def writeDuplicate(self, filename, contentKey, modificationTime):
+		offset = self.contentOffsets.get(contentKey)
+		if offset is None:
+			return False
+		
+		(_, size, extractSize) = contentKey
+		self.files[filename] = CpkWriter.FileEntry(size, offset, modificationTime, extractSize)
+		self.deduplicatedSize += size
+		return True
+	
+	def compressionWanted(self, filename):
+		return os.path.splitext(filename)[1].lower() in self.compressedExtensions
+	
 	def writeFile(self, filename, content, modificationTime = None):
 		if filename in self.files:
 			return False
 		
-		self.files[filename] = CpkWriter.FileEntry(len(content), self.position, modificationTime)
-		if len(content) % self.alignment > 0:
-			paddingLength = self.alignment - (len(content) % self.alignment)
-		else:
-			paddingLength = 0
+		if self.compressionWanted(filename):
+			compressedContent = compressCrilayla(content)
+			if compressedContent is not None:
+				return self.writeStoredFile(filename, compressedContent, len(content), modificationTime)
+		
+		return self.writeStoredFile(filename, content, len(content), modificationTime)
+	
+	# Writes content which is already in its stored form, extractSize being its size once decompressed
+	def writeStoredFile(self, filename, content, extractSize, modificationTime = None):
+		if filename in self.files:
+			return False
+		
+		contentKey = CpkWriter.contentKey(hashlib.blake2b(content, digest_size = 16).digest(), len(content), extractSize)
+		if self.writeDuplicate(filename, contentKey, modificationTime):
+			return True
+		self.contentOffsets[contentKey] = self.position
+		
+		self.files[filename] = CpkWriter.FileEntry(len(content), self.position, modificationTime, extractSize)
 		write(self.stream, content)
-		write(self.stream, bytearray(paddingLength))
-		self.position += len(content) + paddingLength
+		self.position += len(content)
+		self.writePadding(len(content))
 		return True
+	
+	# Reads the next length bytes of a stream into the reused copy buffer
+	def readChunk(self, stream, length):
+		chunk = self.copyBuffer[0:length]
+		position = 0
+		while position < length:
+			readLength = stream.readinto(chunk[position:])
+			if not readLength:
+				raise DecodeError("Unexpected end of file")
+			position += readLength
+		return chunk
+	
+	# Copies size bytes from a stream. contentDigest is the 16 bytes blake2b digest of the content,
+	# if the caller already knows it, so that duplicates are found before anything is read.
+	def writeStream(self, filename, stream, size, modificationTime = None, extractSize = None, contentDigest = None):
+		if filename in self.files:
+			return False
+		
+		# Duplicates are looked up before anything gets written. Content which fits in a single chunk
+		# is hashed from the buffer it gets written from, larger content is hashed in a first pass
+		# over the stream, which is then read again.
+		chunk = None
+		if contentDigest is None:
+			if size <= len(self.copyBuffer):
+				chunk = self.readChunk(stream, size)
+				contentDigest = hashlib.blake2b(chunk, digest_size = 16).digest()
+			else:
+				startPosition = stream.tell()
+				contentHash = hashlib.blake2b(digest_size = 16)
+				remaining = size
+				while remaining > 0:
+					chunkLength = min(remaining, len(self.copyBuffer))
+					contentHash.update(self.readChunk(stream, chunkLength))
+					remaining -= chunkLength
+				contentDigest = contentHash.digest()
+				stream.seek(startPosition, 0)
+		
+		contentKey = CpkWriter.contentKey(contentDigest, size, extractSize)
+		if self.writeDuplicate(filename, contentKey, modificationTime):
+			return True
+		self.contentOffsets[contentKey] = self.position
+		
+		# Copy the content in fixed-size chunks through a reused buffer,
+		# so that memory usage doesn't depend on the size of the file
+		if chunk is not None:
+			write(self.stream, chunk)
+		else:
+			remaining = size
+			while remaining > 0:
+				chunkLength = min(remaining, len(self.copyBuffer))
+				write(self.stream, self.readChunk(stream, chunkLength))
+				remaining -= chunkLength
+		
+		self.files[filename] = CpkWriter.FileEntry(size, self.position, modificationTime, extractSize)
+		self.position += size
+		self.writePadding(size)
+		return True
+	
+	def writeFileFromCpk(self, filename, reader, entry):
+		if filename in self.files:
+			return False
+		
+		# Copy the stored bytes as a single range of the other archive
+		reader.stream.seek(entry.offset, 0)
+		return self.writeStream(filename, reader.stream, entry.compressedSize, entry.modificationTime, entry.size)
+	
+	# contentDigest is the 16 bytes blake2b digest of the file, if the caller already knows it
+	def writeFileFromPath(self, filename, path, modificationTime = None, allowCompression = True, contentDigest = None):
+		if filename in self.files:
+			return False
+		
+		with open(path, 'rb') as inputStream:
+			if allowCompression and self.compressionWanted(filename):
+				return self.writeFile(filename, inputStream.read(), modificationTime)
+			
+			size = os.fstat(inputStream.fileno()).st_size
+			return self.writeStream(filename, inputStream, size, modificationTime, contentDigest = contentDigest)
@@ -1,60 +1,93 @@
+import zlib
 import struct
 
 class DecodeError(Exception):
 	pass
 
-class BitStream:
-	def __init__(self, buffer):
-		self.buffer = buffer
-		self.index = 0
-		self.pooledBits = 0
-		self.pooledBitCount = 0
-	
-	def read(self, bits):
-		while self.pooledBitCount < bits:
-			if self.index >= len(self.buffer):
-				raise DecodeError('unexpected end of crilayla stream')
-			self.pooledBits = self.pooledBits << 8 | self.buffer[len(self.buffer) - self.index - 1]
-			self.pooledBitCount += 8
-			self.index += 1
-		result = self.pooledBits >> (self.pooledBitCount - bits)
-		self.pooledBitCount -= bits
-		self.pooledBits = self.pooledBits & ((1 << self.pooledBitCount) - 1)
-		return result
-
-def decompressCrilaylaStream(stream, uncompressedSize):
-	buffer = bytearray(uncompressedSize)
+def decompressCrilaylaStream(compressedBuffer, uncompressedSize):
+	# The bit stream is read starting from its last byte, and the output is written starting from its
+	# last byte too. Reversing both makes every read and every back-reference copy run forwards,
+	# so the bits can be pulled in whole words and the copies done as slices.
+	# The zero padding lets the loop refill without checking for the end of the stream, over-reads
+	# are detected when a refill runs out of padding, and once more after decoding.
+	source = bytes(compressedBuffer)[::-1] + bytes(16)
+	sourceBitLength = len(compressedBuffer) * 8
+	sourcePosition = 0
+	bits = 0
+	bitCount = 0
+	
+	output = bytearray()
 	size = 0
 	
-	while size < len(buffer):
-		isReferenceBlock = stream.read(1)
-		if isReferenceBlock:
+	while size < uncompressedSize:
+		# A flag, an offset and the first three length chunks need at most 24 bits
+		if bitCount < 24:
+			word = source[sourcePosition : sourcePosition + 7]
+			if len(word) < 7:
+				raise DecodeError('unexpected end of crilayla stream')
+			sourcePosition += 7
+			bits = (bits & ((1 << bitCount) - 1)) << 56 | int.from_bytes(word, 'big')
+			bitCount += 56
+		
+		bitCount -= 1
+		
+		if bits >> bitCount & 1:
 			# backreference to earlier data in output buffer
-			referenceOffset = stream.read(13) + 3
-			referenceLength = 3
+			bitCount -= 15
+			referenceOffset = (bits >> (bitCount + 2) & 0x1fff) + 3
+			chunk = bits >> bitCount & 0x3
+			referenceLength = 3 + chunk
 			
-			def referenceLengthSizeChunks():
-				for i in [2, 3, 5, 8]:
-					yield i
-				while True:
-					yield 8
-			for chunkSize in referenceLengthSizeChunks():
-				chunk = stream.read(chunkSize)
+			if chunk == 0x3:
+				bitCount -= 3
+				chunk = bits >> bitCount & 0x7
 				referenceLength += chunk
-				if chunk + 1 != 1 << chunkSize:
-					break
+				
+				if chunk == 0x7:
+					bitCount -= 5
+					chunk = bits >> bitCount & 0x1f
+					referenceLength += chunk
+					
+					# Any further chunks are 8 bits long
+					if chunk == 0x1f:
+						chunk = 0xff
+					while chunk == 0xff:
+						if bitCount < 8:
+							word = source[sourcePosition : sourcePosition + 7]
+							if len(word) < 7:
+								raise DecodeError('unexpected end of crilayla stream')
+							sourcePosition += 7
+							bits = (bits & ((1 << bitCount) - 1)) << 56 | int.from_bytes(word, 'big')
+							bitCount += 56
+						bitCount -= 8
+						chunk = bits >> bitCount & 0xff
+						referenceLength += chunk
+			
+			referenceStart = size - referenceOffset
+			if referenceStart < 0:
+				raise DecodeError('crilayla backreference out of range')
 			
-			for i in range(referenceLength):
-				buffer[len(buffer) - size - 1] = buffer[len(buffer) - size - 1 + referenceOffset]
-				size += 1
+			if referenceLength <= referenceOffset:
+				output += output[referenceStart : referenceStart + referenceLength]
+			else:
+				# Overlapping reference, the referenced bytes repeat themselves
+				pattern = output[referenceStart : size]
+				output += (pattern * (referenceLength // referenceOffset + 1))[0:referenceLength]
+			size += referenceLength
 		
 		else:
 			# raw byte
-			byte = stream.read(8)
-			buffer[len(buffer) - size - 1] = byte
+			bitCount -= 8
+			output.append(bits >> bitCount & 0xff)
 			size += 1
 	
-	return buffer
+	if sourcePosition * 8 - bitCount > sourceBitLength:
+		raise DecodeError('unexpected end of crilayla stream')
+	
+	# A reference may run past the start of the output
+	del output[uncompressedSize:]
+	output.reverse()
+	return output
 
 def decompressCrilayla(buffer):
 	( magic, uncompressedSize, uncompressedPrefixOffset ) = struct.unpack('< 8s I I', buffer[0:16])
@@ -68,5 +101,167 @@ def decompressCrilayla(buffer):
 	uncompressedPrefix = buffer[0x10 + uncompressedPrefixOffset : 0x10 + uncompressedPrefixOffset + uncompressedPrefixLength]
 	
 	# The total buffer, minus the header, minus the uncompressed prefix
-	stream = BitStream(buffer[0x10 : 0x10 + uncompressedPrefixOffset])
-	return uncompressedPrefix + decompressCrilaylaStream(stream, uncompressedSize)
+	stream = buffer[0x10 : 0x10 + uncompressedPrefixOffset]
+	return bytes(uncompressedPrefix) + decompressCrilaylaStream(stream, uncompressedSize)
+
+def compressCrilaylaStream(uncompressedBuffer):
+	# Mirror image of decompressCrilaylaStream: the input is reversed so matches can be searched
+	# forwards, and the bit stream is built forwards then reversed.
+	source = bytes(uncompressedBuffer)[::-1]
+	sourceLength = len(source)
+	
+	output = bytearray()
+	bits = 0
+	bitCount = 0
+	
+	# Latest position of every three byte sequence
+	positions = {}
+	
+	position = 0
+	while position < sourceLength:
+		matchOffset = 0
+		matchLength = 0
+		
+		key = source[position : position + 3]
+		candidate = positions.get(key)
+		if candidate is not None and len(key) == 3:
+			offset = position - candidate
+			# Runs with a period shorter than the minimum offset can use a multiple of it instead
+			if offset < 3:
+				offset *= 3 if offset == 1 else 2
+			if offset <= 0x1fff + 3 and offset <= position and source[position - offset : position - offset + 3] == key:
+				matchOffset = offset
+				matchLength = 3
+				
+				# Grow the match in doubling steps, then narrow it down to its exact length
+				step = 8
+				while (
+					position + matchLength + step <= sourceLength
+					and source[position + matchLength : position + matchLength + step]
+						== source[position + matchLength - offset : position + matchLength - offset + step]
+				):
+					matchLength += step
+					step *= 2
+				while step > 1:
+					step //= 2
+					if (
+						position + matchLength + step <= sourceLength
+						and source[position + matchLength : position + matchLength + step]
+							== source[position + matchLength - offset : position + matchLength - offset + step]
+					):
+						matchLength += step
+		
+		if matchLength:
+			# Flag, offset and the first length chunk
+			referenceLength = matchLength - 3
+			chunk = min(referenceLength, 0x3)
+			bits = bits << 16 | 1 << 15 | (matchOffset - 3) << 2 | chunk
+			bitCount += 16
+			referenceLength -= chunk
+			
+			if chunk == 0x3:
+				chunk = min(referenceLength, 0x7)
+				bits = bits << 3 | chunk
+				bitCount += 3
+				referenceLength -= chunk
+				
+				if chunk == 0x7:
+					chunk = min(referenceLength, 0x1f)
+					bits = bits << 5 | chunk
+					bitCount += 5
+					referenceLength -= chunk
+					
+					# Any further chunks are 8 bits long, ending with one which isn't full
+					if chunk == 0x1f:
+						while True:
+							chunk = min(referenceLength, 0xff)
+							bits = bits << 8 | chunk
+							bitCount += 8
+							referenceLength -= chunk
+							if bitCount >= 64:
+								output += (bits >> (bitCount & 7)).to_bytes(bitCount >> 3, 'big')
+								bitCount &= 7
+								bits &= (1 << bitCount) - 1
+							if chunk != 0xff:
+								break
+			
+			# Only the last positions of long matches are worth remembering
+			for matchPosition in range(max(position, position + matchLength - 64), position + matchLength):
+				positions[source[matchPosition : matchPosition + 3]] = matchPosition
+			position += matchLength
+		
+		else:
+			# raw byte
+			bits = bits << 9 | source[position]
+			bitCount += 9
+			positions[key] = position
+			position += 1
+		
+		if bitCount >= 64:
+			output += (bits >> (bitCount & 7)).to_bytes(bitCount >> 3, 'big')
+			bitCount &= 7
+			bits &= (1 << bitCount) - 1
+	
+	# The last byte is padded with zero bits, which are never read
+	paddingBitCount = -bitCount & 7
+	output += (bits << paddingBitCount).to_bytes((bitCount + paddingBitCount) >> 3, 'big')
+	
+	output.reverse()
+	return output
+
+def compressCrilayla(buffer):
+	# hardcoded
+	uncompressedPrefixLength = 0x100
+	if len(buffer) <= uncompressedPrefixLength:
+		return None
+	
+	uncompressedPrefix = buffer[0 : uncompressedPrefixLength]
+	uncompressedBody = buffer[uncompressedPrefixLength:]
+	
+	# Crilayla stores raw bytes in 9 bits and searches a smaller window than zlib, so content which
+	# zlib can't make at least 5% smaller, like ftex textures made of zlib chunks, never gets any
+	# smaller with it either, and zlib finds that out about thirty times faster
+	if len(zlib.compress(uncompressedBody, 1)) * 20 >= len(uncompressedBody) * 19:
+		return None
+	
+	stream = compressCrilaylaStream(uncompressedBody)
+	
+	# Incompressible content is better left as it is
+	if 0x10 + len(stream) + uncompressedPrefixLength >= len(buffer):
+		return None
+	
+	return (
+		struct.pack('< 8s I I', b'CRILAYLA', len(uncompressedBody), len(stream))
+		+ stream
+		+ bytes(uncompressedPrefix)
+	)
+
+
+#
+# Fixture compressed by an independent bit-by-bit encoder and checked against the
+# original one-byte-at-a-time decoder. It covers raw bytes, plain and overlapping
+# back-references, and lengths using every chunk size. The compressed stream is
+# followed by the first 0x100 bytes, which are stored uncompressed.
+#
+fixtureCompressed = bytes.fromhex(
+	'4352494c41594c41000400006d000000a0fcff1f000c2366cceeff122014396f4014b1f3864d1d3a69deb80131e5cd98'
+	'3165e480005040c1030a193c8c40d142c60d1e418c2c815245cb173269dcccc1d347d02146912c6d02554ad52b5ab97c'
+	'0d43d64cda356ee1ccad83574fdfbfecff0dc03172d2b00993874d1810'
+) + b"CRILAYLA fixture" * 16
+fixtureExpected = (
+	b"CRILAYLA fixture" * 16
+	+ b"abc" * 150
+	+ b"Pro Evolution Soccer " * 12
+	+ bytes(range(0, 256, 5))
+	+ b"crilayla " * 30
+)
+
+
+if __name__ == "__main__":
+	import sys
+	
+	# Self-check of the decoder against the fixture, the speed is measured by crilayla_benchmark.py
+	if bytes(decompressCrilayla(fixtureCompressed)) != fixtureExpected:
+		print("Fixture: decompressed content doesn't match")
+		sys.exit(1)
+	print("Fixture: ok")
@@ -1,11 +1,14 @@
 import hashlib
 import io
+import os
 import struct
 
 class DecodeError(Exception):
 	pass
 
 class FpkFile:
+	copyChunkSize = 1 << 20
+	
 	def __init__(self):
 		self.entries = {}
 	
@@ -77,26 +80,35 @@ class FpkFile:
 		stream.close()
 		self.read(byteBuffer)
 	
-	def write(self, isFpkd):
+	# The entries are either their content (bytes or a memoryview), or the path of a file holding it.
+	# The header, the entry table and the filenames are laid out first, since only the lengths of
+	# the contents are needed for their offsets, and then every content is streamed after them.
+	def layout(self, isFpkd):
 		entries = []
 		filenameBuffer = bytearray()
-		contentBuffer = bytearray()
+		contentLength = 0
 		for filename in sorted(self.entries.keys()):
 			relativeFilenameOffset = len(filenameBuffer)
 			encodedFilename = bytes(filename, 'utf-8')
 			filenameBuffer += encodedFilename + b'\0'
 			
-			relativeContentOffset = len(contentBuffer)
-			contentBuffer += self.entries[filename]
-			if len(contentBuffer) % 16 > 0:
-				contentBuffer += bytearray(16 - len(contentBuffer) % 16)
+			content = self.entries[filename]
+			if isinstance(content, str):
+				length = os.path.getsize(content)
+			else:
+				length = len(content)
+			
+			relativeContentOffset = contentLength
+			contentLength += length
+			if contentLength % 16 > 0:
+				contentLength += 16 - contentLength % 16
 			
 			digest = hashlib.md5()
 			digest.update(encodedFilename)
 			
 			entries.append((
 				relativeContentOffset,
-				len(self.entries[filename]),
+				length,
 				relativeFilenameOffset,
 				len(encodedFilename),
 				digest.digest(),
@@ -108,10 +120,10 @@ class FpkFile:
 		entryBufferOffset = 48
 		filenameBufferOffset = entryBufferOffset + 48 * len(entries)
 		contentBufferOffset = filenameBufferOffset + len(filenameBuffer)
-		for (relativeContentOffset, contentLength, relativeFilenameOffset, filenameLength, filenameDigest) in entries:
+		for (relativeContentOffset, length, relativeFilenameOffset, filenameLength, filenameDigest) in entries:
 			entryBuffer += struct.pack('< QQQQ 16s',
 				relativeContentOffset + contentBufferOffset,
-				contentLength,
+				length,
 				relativeFilenameOffset + filenameBufferOffset,
 				filenameLength,
 				filenameDigest,
@@ -121,17 +133,45 @@ class FpkFile:
 			b'foxfpk',
 			(b'd' if isFpkd else b'\0'),
 			b'win',
-			len(contentBuffer) + contentBufferOffset,
+			contentLength + contentBufferOffset,
 			2,
 			len(entries),
 			0,
 			0,
 		)
-		return header + entryBuffer + filenameBuffer + contentBuffer
+		return (header + entryBuffer + filenameBuffer, [length for (_, length, _, _, _) in entries])
+	
+	def writeStream(self, stream, isFpkd):
+		(tables, lengths) = self.layout(isFpkd)
+		stream.write(tables)
+		
+		for (filename, length) in zip(sorted(self.entries.keys()), lengths):
+			content = self.entries[filename]
+			if isinstance(content, str):
+				with open(content, 'rb') as inputStream:
+					copied = 0
+					while True:
+						chunk = inputStream.read(FpkFile.copyChunkSize)
+						if not chunk:
+							break
+						stream.write(chunk)
+						copied += len(chunk)
+				if copied != length:
+					raise DecodeError("File '%s' changed while being packed" % content)
+			else:
+				stream.write(content)
+			
+			if length % 16 > 0:
+				stream.write(bytes(16 - length % 16))
+	
+	def write(self, isFpkd):
+		stream = io.BytesIO()
+		self.writeStream(stream, isFpkd)
+		return stream.getvalue()
 	
 	def writeFile(self, filename):
 		isFpkd = filename.lower().endswith('.fpkd')
 		
 		stream = open(filename, 'wb')
-		stream.write(self.write(isFpkd))
+		self.writeStream(stream, isFpkd)
 		stream.close()
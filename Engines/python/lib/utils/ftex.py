@@ -1,4 +1,7 @@
+import concurrent.futures
 import io
+import os
+from collections import namedtuple
 import struct
 import zlib
 from .zlib_plus import tryDecompress
@@ -48,6 +51,26 @@ formatBlockConfiguration = {
 	14: (1,  4), # DXGI_FORMAT_R10G10B10A2_UNORM
 	15: (1,  4), # DXGI_FORMAT_R11G11B10_FLOAT
 }
+
+#
+# For each compressed ftex format, stores the fourCC of the equivalent dds,
+# and the dxgiFormat of its extension header if it needs one.
+#
+ddsFormatFromFtexFormat = {
+	1:  (b'DX10', 61), # DXGI_FORMAT_R8_UNORM
+	2:  (b'DXT1', None),
+	3:  (b'DXT3', None),
+	4:  (b'DXT5', None),
+	8:  (b'DX10', 80), # DXGI_FORMAT_BC4_UNORM
+	9:  (b'DX10', 83), # DXGI_FORMAT_BC5_UNORM
+	10: (b'DX10', 95), # DXGI_FORMAT_BC6H_UF16
+	11: (b'DX10', 98), # DXGI_FORMAT_BC7_UNORM
+	12: (b'DX10', 10), # DXGI_FORMAT_R16G16B16A16_FLOAT
+	13: (b'DX10', 2),  # DXGI_FORMAT_R32G32B32A32_FLOAT
+	14: (b'DX10', 24), # DXGI_FORMAT_R10G10B10A2_UNORM
+	15: (b'DX10', 26), # DXGI_FORMAT_R11G11B10_FLOAT
+}
+
 def ddsMipmapSize(ftexFormat, width, height, depth, mipmapIndex):
 	(blockSizePixels, blockSizeBytes) = formatBlockConfiguration[ftexFormat]
 	scaleFactor = 2 ** mipmapIndex
@@ -60,21 +83,60 @@ def ddsMipmapSize(ftexFormat, width, height, depth, mipmapIndex):
 	heightBlocks = (mipmapHeight + blockSizePixels - 1) // blockSizePixels
 	return widthBlocks * heightBlocks * mipmapDepth * blockSizeBytes
 
-def ftexToDdsBuffer(ftexBuffer):
-	def readImageBuffer(stream, imageOffset, chunkCount, uncompressedSize, compressedSize):
+#
+# Largest piece of image data held in memory at once while decoding, so that
+# even huge frames stored in a single zlib stream get written out piecemeal.
+#
+ddsStreamPieceSize = 1 << 20
+
+def ftexToDdsStream(inputStream, outputStream):
+	def readExactly(stream, size):
+		buffer = bytearray(size)
+		if stream.readinto(buffer) != len(buffer):
+			raise DecodeError("Unexpected end of stream")
+		return buffer
+
+	#
+	# Frames are cut or zero-padded to their expected size, so every write goes
+	# through here with the number of bytes still missing from the frame.
+	#
+	def writeFrameData(data, remainingSize):
+		if remainingSize > 0:
+			outputStream.write(memoryview(data)[:remainingSize])
+		return max(remainingSize - len(data), 0)
+
+	def copyFrameData(stream, size, remainingSize):
+		while size > 0:
+			buffer = readExactly(stream, min(size, ddsStreamPieceSize))
+			size -= len(buffer)
+			remainingSize = writeFrameData(buffer, remainingSize)
+		return remainingSize
+
+	def inflateFrameData(stream, compressedSize, remainingSize):
+		# Every chunk is a zlib stream of its own
+		decompressor = zlib.decompressobj()
+		try:
+			while compressedSize > 0:
+				compressedBuffer = readExactly(stream, min(compressedSize, ddsStreamPieceSize))
+				compressedSize -= len(compressedBuffer)
+				while len(compressedBuffer) > 0:
+					decompressedBuffer = decompressor.decompress(compressedBuffer, ddsStreamPieceSize)
+					remainingSize = writeFrameData(decompressedBuffer, remainingSize)
+					compressedBuffer = decompressor.unconsumed_tail
+			if not decompressor.eof:
+				raise DecodeError("Decompression error")
+		except zlib.error:
+			raise DecodeError("Decompression error")
+		return remainingSize
+
+	def writeImage(stream, imageOffset, chunkCount, uncompressedSize, compressedSize, remainingSize):
 		stream.seek(imageOffset, 0)
 
 		if chunkCount == 0:
 			if compressedSize == 0:
-				uncompressedBuffer = bytearray(uncompressedSize)
-				if stream.readinto(uncompressedBuffer) != len(uncompressedBuffer):
-					raise DecodeError("Unexpected end of stream")
-				return uncompressedBuffer
+				return copyFrameData(stream, uncompressedSize, remainingSize)
 			else:
-				compressedBuffer = bytearray(compressedSize)
-				if stream.readinto(compressedBuffer) != len(compressedBuffer):
-					raise DecodeError("Unexpected end of stream")
-				return zlib.decompress(compressedBuffer)
+				return inflateFrameData(stream, compressedSize, remainingSize)
 
 		chunks = []
 		for i in range(chunkCount):
@@ -91,25 +153,15 @@ def ftexToDdsBuffer(ftexBuffer):
 
 			chunks.append((offset, compressedSize, isCompressed))
 
-		imageBuffers = []
 		for (offset, compressedSize, isCompressed) in chunks:
 			stream.seek(imageOffset + offset, 0)
-			compressedBuffer = bytearray(compressedSize)
-			if stream.readinto(compressedBuffer) != len(compressedBuffer):
-				raise DecodeError("Unexpected end of stream")
 			if isCompressed:
-				try:
-					decompressedBuffer = zlib.decompress(compressedBuffer)
-				except Exception:
-					raise DecodeError("Decompression error")
+				remainingSize = inflateFrameData(stream, compressedSize, remainingSize)
 			else:
-				decompressedBuffer = compressedBuffer
-			imageBuffers.append(decompressedBuffer)
-		return b''.join(imageBuffers)
-
+				remainingSize = copyFrameData(stream, compressedSize, remainingSize)
+		return remainingSize
 
 
-	inputStream = io.BytesIO(ftexBuffer)
 
 	header = bytearray(64)
 	if inputStream.readinto(header) != len(header):
@@ -218,15 +270,6 @@ def ftexToDdsBuffer(ftexBuffer):
 			expectedFrameSize = ddsMipmapSize(ftexPixelFormat, ftexWidth, ftexHeight, ddsDepth, j)
 			frameSpecifications.append((offset, chunkCount, uncompressedSize, compressedSize, expectedFrameSize))
 
-	frames = []
-	for (offset, chunkCount, uncompressedSize, compressedSize, expectedSize) in frameSpecifications:
-		frame = readImageBuffer(inputStream, offset, chunkCount, uncompressedSize, compressedSize)
-		if len(frame) < expectedSize:
-			frame += bytes(expectedSize - len(frame))
-		elif len(frame) > expectedSize:
-			frame = frame[0:expectedSize]
-		frames.append(frame)
-
 
 
 	if ftexPixelFormat == 0:
@@ -242,7 +285,7 @@ def ftexToDdsBuffer(ftexBuffer):
 		ddsBBitMask = 0x000000ff
 		ddsABitMask = 0xff000000
 	else:
-		ddsPitchOrLinearSize = len(frames[0])
+		ddsPitchOrLinearSize = frameSpecifications[0][4]
 		ddsFlags |= 0x80000 # linear size
 
 		ddsFormatFlags = 0x4 # compressed
@@ -252,35 +295,9 @@ def ftexToDdsBuffer(ftexBuffer):
 		ddsBBitMask = 0
 		ddsABitMask = 0
 
-		ddsFourCC = None
-		ddsExtensionFormat = None
-
-		if ftexPixelFormat == 1:
-			ddsExtensionFormat = 61 # DXGI_FORMAT_R8_UNORM
-		elif ftexPixelFormat == 2:
-			ddsFourCC = b'DXT1'
-		elif ftexPixelFormat == 3:
-			ddsFourCC = b'DXT3'
-		elif ftexPixelFormat == 4:
-			ddsFourCC = b'DXT5'
-		elif ftexPixelFormat == 8:
-			ddsExtensionFormat = 80 # DXGI_FORMAT_BC4_UNORM
-		elif ftexPixelFormat == 9:
-			ddsExtensionFormat = 83 # DXGI_FORMAT_BC5_UNORM
-		elif ftexPixelFormat == 10:
-			ddsExtensionFormat = 95 # DXGI_FORMAT_BC6H_UF16
-		elif ftexPixelFormat == 11:
-			ddsExtensionFormat = 98 # DXGI_FORMAT_BC7_UNORM
-		elif ftexPixelFormat == 12:
-			ddsExtensionFormat = 10 # DXGI_FORMAT_R16G16B16A16_FLOAT
-		elif ftexPixelFormat == 13:
-			ddsExtensionFormat = 2  # DXGI_FORMAT_R32G32B32A32_FLOAT
-		elif ftexPixelFormat == 14:
-			ddsExtensionFormat = 24 # DXGI_FORMAT_R10G10B10A2_UNORM
-		elif ftexPixelFormat == 15:
-			ddsExtensionFormat = 26 # DXGI_FORMAT_R11G11B10_FLOAT
-		else:
+		if ftexPixelFormat not in ddsFormatFromFtexFormat:
 			raise DecodeError("Unsupported ftex codec")
+		(ddsFourCC, ddsExtensionFormat) = ddsFormatFromFtexFormat[ftexPixelFormat]
 
 		if ddsExtensionFormat is not None:
 			ddsFourCC = b'DX10'
@@ -290,7 +307,6 @@ def ftexToDdsBuffer(ftexBuffer):
 
 
 
-	outputStream = io.BytesIO()
 	outputStream.write(struct.pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
 		b'DDS ',
 
@@ -324,23 +340,150 @@ def ftexToDdsBuffer(ftexBuffer):
 			0, # flags
 		))
 
-	for frame in frames:
-		outputStream.write(frame)
+	for (offset, chunkCount, uncompressedSize, compressedSize, expectedSize) in frameSpecifications:
+		remainingSize = writeImage(inputStream, offset, chunkCount, uncompressedSize, compressedSize, expectedSize)
+		if remainingSize > 0:
+			outputStream.write(bytes(remainingSize))
 
+def ftexToDdsBuffer(ftexBuffer):
+	outputStream = io.BytesIO()
+	ftexToDdsStream(io.BytesIO(ftexBuffer), outputStream)
 	return outputStream.getbuffer()
 
 def ftexToDds(ftexFilename, ddsFilename):
 	inputStream = open(ftexFilename, 'rb')
-	inputBuffer = inputStream.read()
+	outputStream = open(ddsFilename, 'wb')
+	try:
+		ftexToDdsStream(inputStream, outputStream)
+	except Exception:
+		# Leave no partial dds behind
+		outputStream.close()
+		os.remove(ddsFilename)
+		raise
+	finally:
+		outputStream.close()
+		inputStream.close()
+
+#
+# Header of a texture, with the fourCC and dxgiFormat that a dds version of it
+# would have, read without decoding any of its images.
+#
+TextureHeader = namedtuple('TextureHeader', ['width', 'height', 'depth', 'mipmapCount', 'fourCC', 'dxgiFormat'])
+
+def readFtexHeader(ftexFilename):
+	inputStream = open(ftexFilename, 'rb')
+	header = inputStream.read(64)
 	inputStream.close()
 
-	outputBuffer = ftexToDdsBuffer(inputBuffer)
+	if len(header) != 64:
+		raise DecodeError("Incomplete ftex header")
 
-	outputStream = open(ddsFilename, 'wb')
-	outputStream.write(outputBuffer)
-	outputStream.close()
+	(
+		ftexMagic,
+		ftexVersion,
+		ftexPixelFormat,
+		ftexWidth,
+		ftexHeight,
+		ftexDepth,
+		ftexMipmapCount,
+		ftexTextureType,
+		ftexFtexsCount,
+	) = struct.unpack('< 4s f HHHH  Bx 2x 8x I  B 15x  16x', header)
+
+	if ftexMagic != b'FTEX':
+		raise DecodeError("Incorrect ftex signature")
+
+	if ftexVersion < 2.025:
+		raise DecodeError("Unsupported ftex version")
+	if ftexVersion > 2.045:
+		raise DecodeError("Unsupported ftex version")
+	if ftexFtexsCount > 0:
+		raise DecodeError("Unsupported ftex variant")
+	if ftexMipmapCount == 0:
+		raise DecodeError("Unsupported ftex variant")
+	if (ftexTextureType & 4) != 0 and ftexDepth > 1:
+		raise DecodeError("Unsupported ftex variant")
 
-def ddsToFtexBuffer(ddsBuffer, colorSpace):
+	if ftexPixelFormat == 0:
+		(ddsFourCC, ddsExtensionFormat) = (b'\0\0\0\0', None)
+	elif ftexPixelFormat in ddsFormatFromFtexFormat:
+		(ddsFourCC, ddsExtensionFormat) = ddsFormatFromFtexFormat[ftexPixelFormat]
+	else:
+		raise DecodeError("Unsupported ftex codec")
+
+	return TextureHeader(ftexWidth, ftexHeight, ftexDepth, ftexMipmapCount, ddsFourCC, ddsExtensionFormat)
+
+def readDdsHeader(ddsFilename):
+	inputStream = open(ddsFilename, 'rb')
+	header = inputStream.read(148)
+	inputStream.close()
+
+	if len(header) < 128:
+		raise DecodeError("Incomplete dds header")
+
+	(
+		ddsMagic,
+		ddsHeaderSize,
+		ddsHeight,
+		ddsWidth,
+		ddsDepth,
+		ddsMipmapCount,
+		ddsFourCC,
+	) = struct.unpack('< 4s I 4x 2I 4x 2I 44x 8x 4s 40x', header[:128])
+
+	if ddsMagic != b'DDS ':
+		raise DecodeError("Incorrect dds signature")
+	if ddsHeaderSize != 124:
+		raise DecodeError("Incorrect dds header")
+
+	ddsExtensionFormat = None
+	if ddsFourCC == b'DX10':
+		if len(header) != 148:
+			raise DecodeError("Incomplete dds extension header")
+		(ddsExtensionFormat,) = struct.unpack('< I', header[128:132])
+
+	return TextureHeader(ddsWidth, ddsHeight, ddsDepth, ddsMipmapCount, ddsFourCC, ddsExtensionFormat)
+
+# Bumped whenever the output of ddsToFtexBuffer changes, so that cached conversions get redone
+ftexEncoderVersion = 1
+
+# Number of chunks compressed by each task when compressing on threads
+chunkGroupSize = 16
+
+def compressChunks(chunks):
+	return [zlib.compress(chunk, level = 3) for chunk in chunks]
+
+# Pool of threads kept between calls of ddsToFtexBuffer, so that converting a batch of textures
+# doesn't start new threads for every one of them
+chunkExecutor = None
+chunkExecutorThreads = 0
+
+def chunkExecutorGet(threads):
+	global chunkExecutor, chunkExecutorThreads
+	
+	if chunkExecutor is None or chunkExecutorThreads != threads:
+		chunkExecutorShutdown()
+		chunkExecutor = concurrent.futures.ThreadPoolExecutor(max_workers = threads)
+		chunkExecutorThreads = threads
+	
+	return chunkExecutor
+
+def chunkExecutorShutdown():
+	global chunkExecutor, chunkExecutorThreads
+	
+	if chunkExecutor is not None:
+		chunkExecutor.shutdown()
+		chunkExecutor = None
+		chunkExecutorThreads = 0
+
+# With threads > 1 the chunks of each image get compressed on a pool of threads, which works since
+# zlib releases the GIL while compressing. The chunks are put back in order, so the output is the same.
+def ddsToFtexBuffer(ddsBuffer, colorSpace, threads = 1):
+	if threads > 1:
+		return ddsToFtexBufferEncode(ddsBuffer, colorSpace, chunkExecutorGet(threads))
+	return ddsToFtexBufferEncode(ddsBuffer, colorSpace, None)
+
+def ddsToFtexBufferEncode(ddsBuffer, colorSpace, executor):
 	def encodeImage(data):
 		chunkSize = 1 << 14 # Value known not to crash PES
 		chunkCount = (len(data) + chunkSize - 1) // chunkSize
@@ -349,9 +492,15 @@ def ddsToFtexBuffer(ddsBuffer, colorSpace):
 		chunkBuffer = bytearray()
 		chunkBufferOffset = chunkCount * 8
 
-		for i in range(chunkCount):
-			chunk = data[chunkSize * i : chunkSize * (i + 1)]
-			compressedChunk = zlib.compress(chunk, level = 3)
+		data = memoryview(data)
+		chunks = [data[chunkSize * i : chunkSize * (i + 1)] for i in range(chunkCount)]
+		if executor is not None and chunkCount > chunkGroupSize:
+			chunkGroups = [chunks[i : i + chunkGroupSize] for i in range(0, chunkCount, chunkGroupSize)]
+			compressedChunks = [compressedChunk for group in executor.map(compressChunks, chunkGroups) for compressedChunk in group]
+		else:
+			compressedChunks = compressChunks(chunks)
+
+		for (chunk, compressedChunk) in zip(chunks, compressedChunks):
 			offset = len(chunkBuffer)
 			chunkBuffer += compressedChunk
 			headerBuffer += struct.pack('< HHI',
@@ -570,13 +719,55 @@ def ddsToFtexBuffer(ddsBuffer, colorSpace):
 
 	return header + mipmapBuffer + frameBuffer
 
-def ddsToFtex(ddsFilename, ftexFilename, colorSpace):
+def ddsToFtex(ddsFilename, ftexFilename, colorSpace, threads = 1):
 	inputStream = open(ddsFilename, 'rb')
 	inputBuffer = inputStream.read()
 	inputStream.close()
 
-	outputBuffer = ddsToFtexBuffer(tryDecompress(inputBuffer), colorSpace)
+	outputBuffer = ddsToFtexBuffer(tryDecompress(inputBuffer), colorSpace, threads)
 
 	outputStream = open(ftexFilename, 'wb')
 	outputStream.write(outputBuffer)
 	outputStream.close()
+
+
+#
+# Self-check of the threaded encoder: a generated DXT5 texture with mipmaps, big enough
+# to be split into several groups of chunks, has to come out the same with and without
+# threads, and has to decode back to the same images.
+#
+def selfCheckTexture():
+	import random
+	generator = random.Random(0)
+	words = [generator.randbytes(generator.randint(2, 16)) for i in range(200)]
+	
+	size = 1024
+	mipmapCount = size.bit_length()
+	dataSize = sum(max((size >> mipmapIndex) // 4, 1) ** 2 * 16 for mipmapIndex in range(mipmapCount))
+	data = bytearray()
+	while len(data) < dataSize:
+		data += generator.choice(words)
+	
+	header = struct.pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
+		b'DDS ', 124, 0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | 0x80000, size, size, size * size, 0, mipmapCount,
+		32, 0x4, b'DXT5', 0, 0, 0, 0, 0, 0x1000 | 0x8 | 0x400000, 0,
+	)
+	return header + bytes(data[0:dataSize])
+
+
+if __name__ == "__main__":
+	import sys
+	
+	ddsBuffer = selfCheckTexture()
+	serialBuffer = ddsToFtexBuffer(ddsBuffer, None)
+	for threads in [2, 4]:
+		if ddsToFtexBuffer(ddsBuffer, None, threads) != serialBuffer:
+			print("Threads: the output with %d threads doesn't match the serial one" % threads)
+			sys.exit(1)
+	chunkExecutorShutdown()
+	print("Threads: ok")
+	
+	if bytes(ftexToDdsBuffer(serialBuffer))[128:] != ddsBuffer[128:]:
+		print("Round trip: the decoded images don't match")
+		sys.exit(1)
+	print("Round trip: ok")
@@ -0,0 +1,179 @@
+import os
+import shutil
+import hashlib
+
+from .ftex import ftexEncoderVersion
+from .FILE_INFO import FTEX_CACHE_FOLDER_PATH
+
+
+# Hits and misses of the textures converted by this process, worker processes return theirs along with their results
+ftex_cache_stats = {"hits": 0, "misses": 0}
+
+
+def ftex_cache_enabled():
+    '''Check if the Texture Cache setting is enabled'''
+
+    return bool(int(os.environ.get('TEXTURE_CACHE', '1')))
+
+
+def ftex_cache_key(tex_path, color_space=None):
+    '''
+    Get the key of a dds file in the cache, from its contents, the color space and the encoder version.
+
+    Args:
+        tex_path (str): Path to the dds file
+        color_space (str): Color space passed to the ftex encoder
+
+    Returns:
+        str: Hex digest used as the name of the cached ftex file
+    '''
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{ftexEncoderVersion}|{color_space}|".encode('utf-8'))
+
+    with open(tex_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def ftex_cache_path(cache_key):
+    '''Get the path of a cached ftex file, in a subfolder named after the first two characters of its key'''
+
+    return os.path.join(FTEX_CACHE_FOLDER_PATH, cache_key[:2], f"{cache_key}.ftex")
+
+
+def ftex_cache_get(cache_key, ftex_path):
+    '''
+    Copy a cached ftex file to the given path if there is one.
+
+    Returns:
+        bool: True if the ftex file was found in the cache
+    '''
+
+    cache_path = ftex_cache_path(cache_key)
+
+    try:
+        shutil.copyfile(cache_path, ftex_path)
+    except OSError:
+        ftex_cache_stats["misses"] += 1
+        return False
+
+    # Mark the file as recently used, so that it's evicted last
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+    ftex_cache_stats["hits"] += 1
+    return True
+
+
+def ftex_cache_put(cache_key, ftex_path):
+    '''Store a freshly converted ftex file in the cache'''
+
+    cache_path = ftex_cache_path(cache_key)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Write to a temporary file first, since other processes may be storing the same texture
+    cache_temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(ftex_path, cache_temp_path)
+        os.replace(cache_temp_path, cache_path)
+    except OSError:
+        if os.path.exists(cache_temp_path):
+            os.remove(cache_temp_path)
+
+
+def ftex_cache_stats_reset():
+    '''Forget the hits and misses recorded until now'''
+
+    for stat_name in ftex_cache_stats:
+        ftex_cache_stats[stat_name] = 0
+
+
+def ftex_cache_stats_take():
+    '''
+    Get the hits and misses recorded until now, and forget them.
+
+    Returns:
+        dict: Number of "hits" and "misses", to be passed to ftex_cache_stats_add by the main process
+    '''
+
+    stats = dict(ftex_cache_stats)
+    ftex_cache_stats_reset()
+
+    return stats
+
+
+def ftex_cache_stats_add(stats):
+    '''Add the hits and misses returned by a worker process to the ones of this process'''
+
+    for stat_name in ftex_cache_stats:
+        ftex_cache_stats[stat_name] += stats[stat_name]
+
+
+def ftex_cache_trim(size_max):
+    '''
+    Delete the least recently used ftex files until the cache is no bigger than the given size.
+
+    Args:
+        size_max (int): Maximum size of the cache in bytes
+
+    Returns:
+        int: Number of files deleted
+    '''
+
+    entry_list = []
+    for root, dirs, files in os.walk(FTEX_CACHE_FOLDER_PATH):
+        for file in files:
+            if not file.endswith(".ftex"):
+                continue
+            file_path = os.path.join(root, file)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            entry_list.append((file_stat.st_mtime, file_stat.st_size, file_path))
+
+    size_total = sum(entry[1] for entry in entry_list)
+    deleted_count = 0
+
+    # Oldest first
+    for _, file_size, file_path in sorted(entry_list):
+        if size_total <= size_max:
+            break
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        size_total -= file_size
+        deleted_count += 1
+
+    return deleted_count
+
+
+def ftex_cache_summary():
+    '''Print how many textures were reused from the cache during this run, then trim the cache'''
+
+    stats = ftex_cache_stats_take()
+    hit_count = stats["hits"]
+    miss_count = stats["misses"]
+
+    if not ftex_cache_enabled() or not (hit_count or miss_count):
+        return
+
+    try:
+        size_max = int(os.environ.get('TEXTURE_CACHE_SIZE', '512')) * 1024 * 1024
+    except ValueError:
+        size_max = 512 * 1024 * 1024
+
+    deleted_count = ftex_cache_trim(size_max)
+
+    print(f"- Texture cache: {hit_count} textures reused, {miss_count} converted", end='')
+    if deleted_count:
+        print(f", {deleted_count} old textures removed from the cache")
+    else:
+        print()
+    print("-")
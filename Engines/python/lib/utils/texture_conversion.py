@@ -1,7 +1,9 @@
 import os
 import sys
 import logging
+import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from .file_management import (
     file_critical_check,
@@ -16,9 +18,25 @@ from .ftex import (
     DecodeError,
     ftexToDds,
     ddsToFtex,
+    chunkExecutorShutdown,
+)
+from .bc_transcode import bc_transcode_available, dds_dxt5_transcode
+from .ftex_cache import (
+    ftex_cache_enabled,
+    ftex_cache_key,
+    ftex_cache_get,
+    ftex_cache_put,
+    ftex_cache_stats_reset,
+    ftex_cache_stats_take,
+    ftex_cache_stats_add,
 )
 from .FILE_INFO import TEXCONV_PATH
 from .pausing import pause
+from .worker_pool import jobs_count, worker_init
+
+
+# Process pool shared by every batch of textures, started when first needed and stopped by texture_executor_shutdown
+texture_executor = None
 
 
 def dds_is_bc5(tex_path):
@@ -32,32 +50,240 @@ def dds_is_bc5(tex_path):
             return True
     return False
 
-def dds_dxt5_conv(tex_path):
-    tex_folder_path = os.path.dirname(tex_path)
-    is_bc5 = dds_is_bc5(tex_path)
-    tex_format = "DX5nm" if is_bc5 else "DXT5"
+def dds_dxt5_converted_name(tex_path):
+    '''Get the name the external tools give to a converted texture, swapping its extension for .dds'''
+
+    return os.path.splitext(os.path.basename(tex_path))[0] + ".dds"
+
+def dx10_in_process_enabled():
+    '''Check if the In-process DX10 Conversion setting is enabled'''
+
+    return bool(int(os.environ.get('DX10_IN_PROCESS', '0')))
+
+def dds_dxt5_tool_available():
+    '''Check if texconv or ImageMagick is there to convert textures to DXT5'''
+
+    if sys.platform == "win32":
+        return os.path.exists(TEXCONV_PATH)
+
+    return shutil.which("magick") is not None
+
+def dds_dxt5_tool_args(tex_format, tex_path_list, staging_folder_path):
+    '''Prepare the command which converts a list of textures with texconv or ImageMagick, into the staging folder'''
+
     if sys.platform == "win32":
-        # Convert the texture and store into its parent folder
         file_critical_check(TEXCONV_PATH)
-        srgb_args = [] if is_bc5 else ["-srgbi", "-srgbo"]
-        texconv_args = [
-            TEXCONV_PATH, "-f", tex_format, *srgb_args, "-nologo", "-y", "-o", tex_folder_path, tex_path
+
+        # Pass the textures in a list file, to stay clear of the command line length limit
+        tex_list_path = os.path.join(staging_folder_path, "_texture_list_.txt")
+        with open(tex_list_path, "w") as f:
+            f.write("\n".join(tex_path_list))
+
+        srgb_args = [] if tex_format == "DX5nm" else ["-srgbi", "-srgbo"]
+        return [
+            TEXCONV_PATH, "-f", tex_format, *srgb_args, "-nologo", "-y", "-o", staging_folder_path, "-flist", tex_list_path
         ]
+
+    # ImageMagick's mogrify writes every converted texture into the staging folder, keeping its name
+    return [
+        "magick", "mogrify", "-path", staging_folder_path, "-format", "dds", "-define", "dds:compression=dxt5", *tex_path_list
+    ]
+
+def dds_dxt5_batch_conv(tex_format, tex_path_list, staging_folder_path):
+    '''Convert a batch of textures with different names with a single run of the external tool,
+    then move the converted textures back in place, reporting the ones which failed'''
+
+    os.makedirs(staging_folder_path, exist_ok=True)
+
+    try:
         try:
-            result = subprocess.run(texconv_args, capture_output=True, text=True)
-            if result.returncode != 0:
-                print("- Error converting the texture: ", result.stderr or result.stdout)
+            result = subprocess.run(
+                dds_dxt5_tool_args(tex_format, tex_path_list, staging_folder_path), capture_output=True, text=True
+            )
+            tool_output = result.stdout + result.stderr
         except Exception as e:
-            print("- Exception converting the texture: ", str(e))
+            tool_output = str(e)
+
+        # A texture failed if the tool didn't write its converted version
+        for tex_path in tex_path_list:
+            tex_converted_path = os.path.join(staging_folder_path, dds_dxt5_converted_name(tex_path))
+
+            if os.path.exists(tex_converted_path):
+                os.replace(tex_converted_path, tex_path)
+                continue
+
+            # Show the lines of the tool output about this texture, or all of it if there are none
+            tex_name = os.path.basename(tex_path)
+            error_lines = [line.strip() for line in tool_output.splitlines() if tex_name in line]
+            print(f"- Error converting the texture {tex_name}: ", "\n".join(error_lines) or tool_output.strip())
+
+    finally:
+        shutil.rmtree(staging_folder_path, ignore_errors=True)
+
+def textures_dxt5_convert(tex_path_list):
+    '''Convert a list of dds textures to DXT5 in place
+
+    The textures are grouped by target format and converted with one run of texconv or ImageMagick per group,
+    or a few runs at the same time if more than one job was requested. If the In-process DX10 Conversion
+    setting is enabled and NumPy is installed, they are converted in-process instead, on the texture process
+    pool if more than one job was requested'''
+
+    tex_bc5_list = [dds_is_bc5(tex_path) for tex_path in tex_path_list]
+
+    # The in-process converter is opt-in, since it takes over a second for a 1024x1024 texture on a single
+    # process, while the external tools run once per batch
+    tex_transcoded_list = [False] * len(tex_path_list)
+    if tex_path_list and dx10_in_process_enabled() and bc_transcode_available():
+        if min(jobs_count(), len(tex_path_list)) > 1:
+            tex_transcoded_list = list(texture_executor_get().map(dds_dxt5_transcode, tex_path_list, tex_bc5_list))
+        else:
+            tex_transcoded_list = [
+                dds_dxt5_transcode(tex_path, is_bc5) for tex_path, is_bc5 in zip(tex_path_list, tex_bc5_list)
+            ]
+
+    # Group the rest by target format
+    tex_group_dict = {}
+    for tex_path, is_bc5, tex_transcoded in zip(tex_path_list, tex_bc5_list, tex_transcoded_list):
+        if tex_transcoded:
+            continue
+
+        tex_format = "DX5nm" if is_bc5 else "DXT5"
+        tex_group_dict.setdefault(tex_format, []).append(tex_path)
+
+    # Split every group into batches, one per job, where no name appears twice since each batch has one staging folder
+    batch_list = []
+    for tex_format, tex_group_list in tex_group_dict.items():
+        group_batch_list = [([], set()) for _ in range(min(jobs_count(), len(tex_group_list)))]
+
+        for tex_index, tex_path in enumerate(tex_group_list):
+            tex_name = dds_dxt5_converted_name(tex_path).lower()
+            batch_index = tex_index % len(group_batch_list)
+
+            # Move on to the next batch if the name is taken, adding a new one if needed
+            for _ in range(len(group_batch_list)):
+                if tex_name not in group_batch_list[batch_index][1]:
+                    break
+                batch_index = (batch_index + 1) % len(group_batch_list)
+            else:
+                group_batch_list.append(([], set()))
+                batch_index = len(group_batch_list) - 1
+
+            group_batch_list[batch_index][0].append(tex_path)
+            group_batch_list[batch_index][1].add(tex_name)
+
+        batch_list += [(tex_format, batch_tex_path_list) for batch_tex_path_list, _ in group_batch_list]
+
+    # Put each staging folder in the folder containing every texture of its batch, so that moving them back is cheap
+    batch_argument_list = []
+    for batch_index, (tex_format, batch_tex_path_list) in enumerate(batch_list):
+        batch_folder_path = os.path.commonpath([os.path.dirname(tex_path) for tex_path in batch_tex_path_list])
+        staging_folder_path = os.path.join(batch_folder_path, f"_dxt5_staging_{batch_index}_")
+        batch_argument_list.append((tex_format, batch_tex_path_list, staging_folder_path))
+
+    jobs = min(jobs_count(), len(batch_argument_list))
+
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(dds_dxt5_batch_conv, *zip(*batch_argument_list)))
     else:
-        # Prepare a dummy path to save the converted texture
-        dummy_tex_path = os.path.join(tex_folder_path, '_dummy_.dds')
-        # Convert the texture with imagemagick
-        os.system(f"magick -format dds -define dds:compression=dxt5 {tex_path} {dummy_tex_path}")
-        # Delete the original texture
-        os.remove(tex_path)
-        # Rename the dummy texture
-        os.rename(dummy_tex_path, tex_path)
+        for batch_arguments in batch_argument_list:
+            dds_dxt5_batch_conv(*batch_arguments)
+
+def texture_executor_get():
+    '''Get the process pool used for converting textures, starting it if needed'''
+
+    global texture_executor
+
+    if texture_executor is None:
+        texture_executor = ProcessPoolExecutor(max_workers=jobs_count(), initializer=worker_init)
+
+    return texture_executor
+
+def texture_executor_shutdown():
+    '''Stop the process pool used for converting textures, and the threads used for compressing ftex chunks,
+    if they were started, once the conversions are over'''
+
+    global texture_executor
+
+    if texture_executor is not None:
+        texture_executor.shutdown()
+        texture_executor = None
+
+    chunkExecutorShutdown()
+
+def dds_to_ftex_convert(tex_path, threads=1):
+    '''Convert a dds file to an ftex file next to it, compressing its chunks on the given number of threads
+
+    Returns None if it was converted, or "uncompressed" or "codec" depending on why it couldn't be'''
+
+    ftex_path = os.path.splitext(tex_path)[0] + '.ftex'
+
+    # Reuse the ftex converted from the same dds on a previous run if possible
+    cache_key = None
+    if ftex_cache_enabled():
+        cache_key = ftex_cache_key(tex_path)
+        if ftex_cache_get(cache_key, ftex_path):
+            return None
+
+    try:
+        ddsToFtex(tex_path, ftex_path, None, threads)
+    except DecodeError:
+        # Check if the texture is uncompressed
+        format = get_bytes_ascii(tex_path, 84, 4)
+        return "uncompressed" if format == "\0\0\0\0" else "codec"
+
+    if cache_key:
+        ftex_cache_put(cache_key, ftex_path)
+
+    return None
+
+def dds_to_ftex_pool_convert(tex_path):
+    '''Convert a dds file to ftex on the process pool, returning the texture cache stats along with the result'''
+
+    ftex_cache_stats_reset()
+    error = dds_to_ftex_convert(tex_path)
+
+    return error, ftex_cache_stats_take()
+
+def textures_dds_to_ftex(tex_path_list):
+    '''Convert a list of dds files to ftex files, on a process pool if more than one job was requested
+
+    Returns the result of dds_to_ftex_convert for every texture, in the same order as the list'''
+
+    jobs = min(jobs_count(), len(tex_path_list))
+
+    if jobs > 1:
+        error_list = []
+        for error, cache_stats in texture_executor_get().map(dds_to_ftex_pool_convert, tex_path_list):
+            ftex_cache_stats_add(cache_stats)
+            error_list.append(error)
+        return error_list
+
+    # A single texture can still use every job, by compressing its chunks on threads
+    return [dds_to_ftex_convert(tex_path, jobs_count()) for tex_path in tex_path_list]
+
+def texture_error_log(tex_path, error):
+    '''Log the reason why a texture couldn't be converted to ftex'''
+
+    if error == "uncompressed":
+        logging.error( "-")
+        logging.error( "- ERROR: Unsupported uncompressed texture")
+        logging.error(f"- Folder:         {os.path.dirname(tex_path)}")
+        logging.error(f"- Texture name:   {os.path.basename(tex_path)}")
+        logging.error( "- This texture will be skipped")
+        logging.error( "-")
+        logging.error( "- Resave it in the proper ARGB format, or a DXT format")
+        logging.error( "- If using Photoshop, update your DDS plugin and resave it")
+        pause()
+    else:
+        logging.error( "-")
+        logging.error( "- ERROR: Unsupported texture codec")
+        logging.error(f"- Folder:         {os.path.dirname(tex_path)}")
+        logging.error(f"- Texture name:   {os.path.basename(tex_path)}")
+        logging.error( "- This texture will be skipped")
+        logging.error( "-")
+        logging.error( "- Make sure you are using an updated DDS plugin and resave it")
+        pause()
 
 def textures_convert(folder_path, fox_mode=False, pes_19_plus=False):
     '''If fox_mode is True, convert all .dds files in the folder and subfolders to .ftex files
@@ -68,6 +294,13 @@ def textures_convert(folder_path, fox_mode=False, pes_19_plus=False):
 
     file_list_rel = get_files_list(folder_path, recursive=True)
 
+    # List of the dds files to convert to ftex all at once
+    tex_ftex_path_list = []
+
+    # Lists of the dds files to convert to DXT5 all at once, and of the state of every dds file until then
+    tex_dxt5_path_list = []
+    tex_state_list = []
+
     for tex_file_rel in [f for f in file_list_rel if f.endswith(".dds")]:
 
         tex_path = os.path.join(folder_path, tex_file_rel)
@@ -92,8 +325,15 @@ def textures_convert(folder_path, fox_mode=False, pes_19_plus=False):
             tex_reconvert_needed = get_bytes_ascii(tex_check_path, 84, 4) == 'DX10'
 
             if tex_reconvert_needed:
-                # Convert it to DXT5
-                dds_dxt5_conv(tex_check_path)
+                # Add it to the list of textures to convert to DXT5
+                tex_dxt5_path_list.append(tex_check_path)
+
+        tex_state_list.append((tex_path, tex_unzlibbed_path, tex_zlibbed, tex_reconvert_needed))
+
+    # Convert the DX10 files to DXT5
+    textures_dxt5_convert(tex_dxt5_path_list)
+
+    for tex_path, tex_unzlibbed_path, tex_zlibbed, tex_reconvert_needed in tex_state_list:
 
         # If it was zlibbed
         if tex_zlibbed:
@@ -110,39 +350,22 @@ def textures_convert(folder_path, fox_mode=False, pes_19_plus=False):
                 os.remove(tex_unzlibbed_path)
 
         if fox_mode:
-            ftex_path = os.path.splitext(tex_path)[0] + '.ftex'
-
-            try:
-                ddsToFtex(tex_path, ftex_path, None)
-            except DecodeError:
-                # Check if the texture is uncompressed
-                format = get_bytes_ascii(tex_path, 84, 4)
-                format_uncompressed = (format == "\0\0\0\0")
-                if format_uncompressed:
-                    logging.error( "-")
-                    logging.error( "- ERROR: Unsupported uncompressed texture")
-                    logging.error(f"- Folder:         {os.path.dirname(tex_path)}")
-                    logging.error(f"- Texture name:   {os.path.basename(tex_path)}")
-                    logging.error( "- This texture will be skipped")
-                    logging.error( "-")
-                    logging.error( "- Resave it in the proper ARGB format, or a DXT format")
-                    logging.error( "- If using Photoshop, update your DDS plugin and resave it")
-                    pause()
-                else:
-                    logging.error( "-")
-                    logging.error( "- ERROR: Unsupported texture codec")
-                    logging.error(f"- Folder:         {os.path.dirname(tex_path)}")
-                    logging.error(f"- Texture name:   {os.path.basename(tex_path)}")
-                    logging.error( "- This texture will be skipped")
-                    logging.error( "-")
-                    logging.error( "- Make sure you are using an updated DDS plugin and resave it")
-                    pause()
-
-            os.remove(tex_path)
+            tex_ftex_path_list.append(tex_path)
+
+    # Convert the dds files to ftex, then report the ones which failed in the same order as the list
+    for tex_path, error in zip(tex_ftex_path_list, textures_dds_to_ftex(tex_ftex_path_list)):
+
+        if error:
+            texture_error_log(tex_path, error)
+
+        os.remove(tex_path)
 
     if pes_19_plus or not fox_mode:
         return
 
+    # List of the ftex files to reconvert through temp dds files, along with those
+    tex_reconvert_list = []
+
     for tex_file_rel in [f for f in file_list_rel if f.endswith(".ftex")]:
 
         tex_path = os.path.join(folder_path, tex_file_rel)
@@ -170,14 +393,18 @@ def textures_convert(folder_path, fox_mode=False, pes_19_plus=False):
         if not os.path.exists(tex_path_dds):
             logging.warning(f"- Converting {tex_path} failed - 2.04 or BC7 texture")
         else:
-            # Convert the temp dds to DXT5
-            dds_dxt5_conv(tex_path_dds)
+            tex_reconvert_list.append((tex_path, tex_path_dds))
+
+    # Convert the temp dds files to DXT5
+    textures_dxt5_convert([tex_path_dds for _, tex_path_dds in tex_reconvert_list])
 
-            # Delete the original ftex
-            os.remove(tex_path)
+    for tex_path, tex_path_dds in tex_reconvert_list:
+
+        # Delete the original ftex
+        os.remove(tex_path)
 
-            # Convert the temp dds to ftex
-            ddsToFtex(tex_path_dds, tex_path, None)
+        # Convert the temp dds to ftex
+        ddsToFtex(tex_path_dds, tex_path, None)
 
-            # Delete the temp dds file
-            os.remove(tex_path_dds)
+        # Delete the temp dds file
+        os.remove(tex_path_dds)
@@ -0,0 +1,120 @@
+import io
+import os
+import sys
+import logging
+import contextlib
+
+
+def jobs_count():
+    """
+    Get the number of worker processes requested with the --jobs argument.
+
+    Returns:
+        int: The number of jobs, 1 meaning that everything runs serially
+    """
+
+    try:
+        jobs = int(os.environ.get('JOBS', '1'))
+    except ValueError:
+        jobs = 1
+
+    # 0 means one job per logical cpu
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    return max(jobs, 1)
+
+
+class OutputRecorderStream(io.TextIOBase):
+    """
+    Text stream which stores everything written to it as print events.
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def write(self, text):
+        self.events.append(("print", text))
+        return len(text)
+
+
+class OutputRecorderHandler(logging.Handler):
+    """
+    Logging handler which stores every record as a log event.
+    """
+
+    def __init__(self, events):
+        super().__init__(logging.INFO)
+        self.events = events
+
+    def emit(self, record):
+        self.events.append(("log", record.levelno, record.getMessage()))
+
+
+def worker_init():
+    """
+    Prepare a worker process so that its output can be captured and replayed by the main process.
+    """
+
+    # Workers can't wait for the user, the main process pauses after replaying their output instead
+    os.environ['PAUSE_ALLOW'] = '0'
+
+    # Workers already run in parallel, so they don't start pools of their own
+    os.environ['JOBS'] = '1'
+
+    # Drop any handlers inherited from the main process, so that the log files are only written by it
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.setLevel(logging.INFO)
+
+
+def output_capture(function, *args):
+    """
+    Run a function, storing everything it prints or logs instead of outputting it.
+
+    Args:
+        function: Function to run, must be picklable when used on a process pool
+        *args: Arguments for the function
+
+    Returns:
+        tuple: The return value of the function and the list of output events
+    """
+
+    events = []
+    handler = OutputRecorderHandler(events)
+    logging.getLogger().addHandler(handler)
+
+    try:
+        with contextlib.redirect_stdout(OutputRecorderStream(events)):
+            result = function(*args)
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    return result, events
+
+
+def output_replay(events):
+    """
+    Print and log the output events stored by output_capture, in their original order.
+
+    Args:
+        events: List of output events
+
+    Returns:
+        bool: True if any errors were logged, False otherwise
+    """
+
+    error_logged = False
+
+    for event in events:
+        if event[0] == "print":
+            sys.stdout.write(event[1])
+        else:
+            logging.log(event[1], event[2])
+            if event[1] >= logging.ERROR:
+                error_logged = True
+
+    sys.stdout.flush()
+
+    return error_logged
@@ -3,20 +3,61 @@ import sys
 import shutil
 import logging
 import subprocess
+import concurrent.futures
 
 from .lib import pes_cpk_pack as cpktool
 from .lib.utils import COLORS
 from .lib.utils.app_tools import app_title
 from .lib.utils.pausing import pause
 from .lib.utils.logging_tools import logger_stop, log_presence_warn
+from .lib.utils.worker_pool import jobs_count
+from .lib.utils.contents_manifest import manifests, manifest_mode_enabled, contents_sources_cleanup
 from .lib.utils.FILE_INFO import (
     PATCHES_CONTENTS_PATH,
     PATCHES_OUTPUT_PATH,
+    CPK_HASHES_FOLDER_PATH,
     MOVED_CPKS_TXT_NAME,
     TEAMNOTES_PATH,
 )
 
 
+def cpk_move(cpk_name, pes_download_path):
+    '''Move a packed cpk from the output folder to the PES download folder, replacing the old one'''
+
+    cpk_destination_path = os.path.join(pes_download_path, f"{cpk_name}.cpk")
+
+    # Remove the cpk from the destination folder if present
+    if os.path.exists(cpk_destination_path):
+        try:
+            os.remove(cpk_destination_path)
+
+        except PermissionError:
+            logging.critical( "-")
+            logging.critical( "- FATAL ERROR - Error while trying to remove the old cpk")
+            logging.critical(f"- Path:           {cpk_destination_path}")
+            logging.critical( "- Please check if PES is open, and close it if so")
+
+            print( "-")
+            input("Press Enter to continue after checking... ")
+
+            try:
+                os.remove(cpk_destination_path)
+
+            except PermissionError:
+                logging.critical( "-")
+                logging.critical( "- FATAL ERROR - Cannot remove the old cpk")
+                logging.critical( "- Restart your PC and try again")
+                logger_stop()
+
+                pause("Press any key to exit... ", force=True)
+
+                sys.exit()
+
+    # Move the cpk to the destination folder
+    cpk_path = os.path.join(PATCHES_OUTPUT_PATH, f"{cpk_name}.cpk")
+    shutil.move(cpk_path, pes_download_path)
+
+
 def patches_from_contents():
 
     # Read the necessary parameters
@@ -33,11 +74,22 @@ def patches_from_contents():
     bins_cpk_name = os.environ.get('BINS_CPK_NAME', '4cc_08_bins')
     refs_cpk_name = os.environ.get('REFS_CPK_NAME', '4cc_35_referees')
     cache_clear = int(os.environ.get('CACHE_CLEAR', '0'))
+    incremental_packing = int(os.environ.get('INCREMENTAL_PACKING', '0'))
+    cpk_compression = int(os.environ.get('CPK_COMPRESSION', '0'))
+    cpk_compression_extensions = os.environ.get('CPK_COMPRESSION_EXTENSIONS', 'fmdl')
 
     pes_download_path = os.path.join(pes_folder_path, "download")
 
-    # Check if the contents folder exists
-    if not os.path.exists(PATCHES_CONTENTS_PATH):
+    # List of extensions of the files to compress, like [".fmdl", ".ftex"]
+    compressed_extension_list = []
+    if cpk_compression:
+        compressed_extension_list = [
+            "." + extension.strip().lstrip(".").lower()
+            for extension in cpk_compression_extensions.replace(",", " ").split()
+        ]
+
+    # Check if the contents folder exists, unless the contents were recorded in manifests during this run
+    if not os.path.exists(PATCHES_CONTENTS_PATH) and not manifest_mode_enabled():
         logging.critical( "-")
         logging.critical( "- FATAL ERROR - \"patches_contents\" folder not found")
         logging.critical( "-")
@@ -48,8 +100,13 @@ def patches_from_contents():
 
         sys.exit()
 
-    folder_list = os.listdir(PATCHES_CONTENTS_PATH)
+    # The contents can be in the patches_contents folder, in the manifests recorded during this run, or both
+    folder_list = []
+    if os.path.exists(PATCHES_CONTENTS_PATH):
+        folder_list = os.listdir(PATCHES_CONTENTS_PATH)
+    folder_list += [x for x in manifests if x not in folder_list]
 
+    # Check if there's anything to pack
     if not folder_list:
         logging.critical( "-")
         logging.critical( "- FATAL ERROR - No folders found in the \"patches_contents\" folder")
@@ -95,81 +152,114 @@ def patches_from_contents():
         # Set the console title
         os.system("title " + "3 - " + app_title(colorize=False))
 
+    if move_cpks:
+        print( "-")
+        print( "- Move Cpks mode is enabled, each cpk will be moved to the download folder")
+        print( "- as soon as it has been packed")
+        print( "-")
 
-    for folder_name, cpk_name in zip(folder_name_list, cpk_name_list):
-
-        folder_path = os.path.join(PATCHES_CONTENTS_PATH, folder_name)
-
-        # Make sure that the folder is not empty to avoid errors
-        if not os.listdir(folder_path):
-            open(os.path.join(folder_path, 'placeholder'), 'w').close()
-
-        source_contents_path_list = [os.path.join(folder_path, x) for x in os.listdir(folder_path)]
-        cpk_path = os.path.join(PATCHES_OUTPUT_PATH, f"{cpk_name}.cpk")
-
-        print(f"- {cpk_name}")
-        cpktool.main(cpk_path, source_contents_path_list, True)
-
-    # Delete the patches contents folder
-    if cache_clear:
-        shutil.rmtree(PATCHES_CONTENTS_PATH)
+    # The cpks are packed at the same time on threads, splitting the jobs available between them
+    # so that the compression pools of all the cpks together don't use more processes than set
+    jobs = jobs_count()
+    cpk_jobs = max(1, min(jobs, len(cpk_name_list)))
+    compression_jobs = max(1, jobs // cpk_jobs)
 
-    print("-")
-    print("- The patches have been created")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=cpk_jobs) as executor:
 
-    log_presence_warn_done = False
+        cpk_pack_futures = {}
 
-    # If Move Cpks mode is enabled
-    if move_cpks:
+        for folder_name, cpk_name in zip(folder_name_list, cpk_name_list):
 
-        print("-")
-        print("- Move Cpks mode is enabled")
-        print("-")
-        print("- Moving the cpks to the download folder")
+            folder_path = os.path.join(PATCHES_CONTENTS_PATH, folder_name)
+            manifest = manifests.get(folder_name)
 
-        for cpk_name in cpk_name_list:
-            cpk_destination_path = os.path.join(pes_download_path, f"{cpk_name}.cpk")
+            # Make sure that the cpk is not empty to avoid errors
+            if not manifest:
+                os.makedirs(folder_path, exist_ok=True)
+                if not os.listdir(folder_path):
+                    open(os.path.join(folder_path, 'placeholder'), 'w').close()
 
-            # Remove the cpk from the destination folder if present
-            if os.path.exists(cpk_destination_path):
-                try:
-                    os.remove(cpk_destination_path)
+            source_contents_path_list = []
+            if os.path.exists(folder_path):
+                source_contents_path_list = [os.path.join(folder_path, x) for x in os.listdir(folder_path)]
+            cpk_path = os.path.join(PATCHES_OUTPUT_PATH, f"{cpk_name}.cpk")
 
-                except PermissionError:
-                    logging.critical( "-")
-                    logging.critical( "- FATAL ERROR - Error while trying to remove the old cpk")
-                    logging.critical(f"- Path:           {cpk_destination_path}")
-                    logging.critical( "- Please check if PES is open, and close it if so")
+            # Look for the cpk packed on the previous run, to copy the unchanged files from it,
+            # recognizing them by the hashes saved along with it
+            cpk_previous_path = None
+            cpk_hashes_path = None
+            if incremental_packing:
+                cpk_hashes_path = os.path.join(CPK_HASHES_FOLDER_PATH, f"{cpk_name}.json")
+                cpk_download_path = os.path.join(pes_download_path, f"{cpk_name}.cpk")
+                if os.path.exists(cpk_path):
+                    cpk_previous_path = cpk_path
+                elif move_cpks and os.path.exists(cpk_download_path):
+                    cpk_previous_path = cpk_download_path
+
+            cpk_pack_future = executor.submit(
+                cpktool.main,
+                cpk_path,
+                source_contents_path_list,
+                True,
+                cpk_previous_path,
+                compressed_extension_list,
+                compression_jobs,
+                manifest,
+                cpk_hashes_path,
+            )
+            cpk_pack_futures[cpk_pack_future] = cpk_name
+
+        # Report each cpk as soon as it's done, and move it right away if needed
+        cpk_failed_list = []
+        for cpk_pack_future in concurrent.futures.as_completed(cpk_pack_futures):
+            cpk_name = cpk_pack_futures[cpk_pack_future]
+            deduplicated_size = cpk_pack_future.result()
+
+            # Don't move or report as packed a cpk which failed, the reason has been printed already
+            if deduplicated_size == cpktool.packFailed:
+                logging.error( "-")
+                logging.error( "- ERROR - Failed to pack a cpk")
+                logging.error(f"- Cpk name:       {cpk_name}")
+                logging.error( "- The cpk from the previous run, if any, has been left as it was")
+                pause()
+                cpk_failed_list.append(cpk_name)
+                continue
 
-                    print( "-")
-                    input("Press Enter to continue after checking... ")
+            # Mention the space saved by storing identical files only once
+            deduplicated_string = ""
+            if deduplicated_size:
+                deduplicated_string = f" ({deduplicated_size / 1024 / 1024:.1f} MB of duplicate files stored once)"
 
-                    try:
-                        os.remove(cpk_destination_path)
+            if move_cpks:
+                cpk_move(cpk_name, pes_download_path)
+                print(f"- {cpk_name} packed and moved{deduplicated_string}")
+            else:
+                print(f"- {cpk_name} packed{deduplicated_string}")
 
-                    except PermissionError:
-                        logging.critical( "-")
-                        logging.critical( "- FATAL ERROR - Cannot remove the old cpk")
-                        logging.critical( "- Restart your PC and try again")
-                        logger_stop()
+    # Delete the source folders of the files packed from the manifests
+    contents_sources_cleanup()
 
-                        pause("Press any key to exit... ", force=True)
+    # Delete the patches contents folder
+    if cache_clear and os.path.exists(PATCHES_CONTENTS_PATH):
+        shutil.rmtree(PATCHES_CONTENTS_PATH)
 
-                        sys.exit()
+    print("-")
+    if cpk_failed_list:
+        print("- The patches have been created, except for the ones which failed")
+    else:
+        print("- The patches have been created")
 
-            # Move the cpk to the destination folder
-            cpk_path = os.path.join(PATCHES_OUTPUT_PATH, f"{cpk_name}.cpk")
-            shutil.move(cpk_path, pes_download_path)
+    log_presence_warn_done = False
 
-        print("-")
-        print("- Done")
-        print("-")
+    # If Move Cpks mode is enabled
+    if move_cpks:
 
         # Create a txt file with the list of cpks that were moved
         with open(os.path.join(PATCHES_OUTPUT_PATH, MOVED_CPKS_TXT_NAME), "w") as f:
             f.write("The following cpks were moved to the download folder:\n")
             for cpk_name in cpk_name_list:
-                f.write(f"{cpk_name}.cpk\n")
+                if cpk_name not in cpk_failed_list:
+                    f.write(f"{cpk_name}.cpk\n")
 
     else:
         # Remove the moved cpks txt file if it exists